@@ -0,0 +1,148 @@
+"""Run grasstool commands end to end on synthetic DEMs
+
+For every DEM size and roughness a synthetic DEM is written, or reused, and
+each command is run on it as a separate grasstool process. The wall time of
+the process and the run_report.json the command writes are collected into
+results.json, with the totals per module, and summarized in results.csv.
+
+With --stub the commands run against the stand-in GRASS under stub/, whose
+modules cost only their share of the cost table, so the time left is that
+of the orchestration: session setup, process spawning, scheduling, cleanup
+and export.
+
+    python benchmarks/run.py --size 1000 --size 4000 --roughness 0.3 results/
+"""
+
+from __future__ import print_function
+
+import os
+import sys
+import csv
+import json
+import time
+import shlex
+import subprocess
+
+import click
+
+from terrain import dem_file
+
+
+COMMANDS = ['hydrolines', 'sinks', 'terraflow']
+
+# GISBASE of the stand-in GRASS
+STUB = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'stub')
+
+# columns of results.csv
+FIELDS = ['command', 'size', 'roughness', 'repeat', 'status', 'wall', 'report_wall',
+          'cpu_user', 'cpu_system', 'max_rss', 'read_bytes', 'write_bytes', 'peak_disk',
+          'slowest_module', 'slowest_wall']
+
+
+def stub_env(scale):
+    """Environment running grasstool against the stand-in GRASS"""
+    python = os.path.join(STUB, 'etc', 'python')
+    paths = [python] + [p for p in os.environ.get('PYTHONPATH', '').split(os.pathsep) if p]
+
+    return dict(os.environ, GISBASE=STUB, GRASS_STUB_SCALE=str(scale),
+                PYTHONPATH=os.pathsep.join(paths))
+
+
+def summary(record, report):
+    """Flatten a run and its report into a results.csv row"""
+    row = dict(record)
+    if report:
+        children = report.get('children', {})
+        row.update(report_wall=report['wall'], peak_disk=report['peak_disk'],
+                   **dict((key, children.get(key)) for key in
+                          ['cpu_user', 'cpu_system', 'max_rss', 'read_bytes', 'write_bytes']))
+        if report['modules']:
+            row.update(slowest_module=report['modules'][0]['name'],
+                       slowest_wall=report['modules'][0]['wall'])
+
+    return row
+
+
+@click.command(options_metavar='<options>')
+@click.argument('outdir', nargs=1, type=click.Path(file_okay=False))
+@click.option('--command', 'commands', multiple=True, type=click.Choice(COMMANDS),
+              help="Command to run; repeat for several, defaults to all")
+@click.option('--size', 'sizes', multiple=True, type=int,
+              help="DEM side in cells; repeat for several, defaults to 1000")
+@click.option('--roughness', 'roughnesses', multiple=True, type=float,
+              help="Terrain roughness from 0 to 1; repeat for several, defaults to 0.5")
+@click.option('--pits', nargs=1, default=None, type=int,
+              help="Pits planted in each DEM, defaults to one per 10000 cells")
+@click.option('--quarries', nargs=1, default=None, type=int,
+              help="Quarries planted in each DEM, defaults to one per million cells")
+@click.option('--seed', nargs=1, default=0, help="Random seed of the terrain")
+@click.option('--repeat', nargs=1, default=1, help="Runs of each command on each DEM")
+@click.option('--grasstool', nargs=1, default='grasstool', help="grasstool executable")
+@click.option('--args', 'grasstool_args', nargs=1, default='',
+              help="grasstool options before the command, e.g. '-j 4 --memory 2000'")
+@click.option('--stub', default=False, is_flag=True,
+              help="Run against the stand-in GRASS to measure the orchestration")
+@click.option('--scale', nargs=1, default=1.0,
+              help="Factor on the simulated module costs of --stub")
+def benchmark(outdir, commands, sizes, roughnesses, pits, quarries, seed, repeat, grasstool,
+              grasstool_args, stub, scale):
+    """Time grasstool commands on synthetic DEMs
+
+    Parameters:
+        outdir : directory of the DEMs, the command outputs and the results
+    """
+    commands = list(commands) or COMMANDS
+    env = stub_env(scale) if stub else dict(os.environ)
+
+    dems = os.path.join(outdir, 'dems')
+    if not os.path.isdir(dems):
+        os.makedirs(dems)
+
+    records = []
+    for size in sizes or [1000]:
+        for roughness in roughnesses or [0.5]:
+            click.echo(click.style('DEM {0}x{0}, roughness {1}'.format(size, roughness),
+                                   fg='green'))
+            dem = dem_file(dems, size, roughness, pits, quarries, seed)
+            for command in commands:
+                for i in range(repeat):
+                    dst = os.path.join(outdir, 'runs', '{}_{}_{}_{}'.format(
+                        command, size, int(round(roughness * 100)), i))
+                    if not os.path.isdir(dst):
+                        os.makedirs(dst)
+                    path = os.path.join(dst, 'run_report.json')
+                    if os.path.exists(path):
+                        os.remove(path)
+
+                    args = [grasstool] + shlex.split(grasstool_args) + [command, dem, dst]
+                    t0 = time.time()
+                    with open(os.path.join(dst, 'log.txt'), 'w') as log:
+                        code = subprocess.call(args, env=env, stdout=log, stderr=subprocess.STDOUT)
+                    wall = time.time() - t0
+
+                    report = None
+                    if os.path.exists(path):
+                        with open(path) as f:
+                            report = json.load(f)
+                    status = 'ok' if code == 0 else 'failed: {}'.format(code)
+                    click.echo(click.style('{} #{}: {} ({:.1f} s)'.format(
+                        command, i, status, wall), fg='green' if code == 0 else 'red'))
+                    records.append({'command': command, 'size': size, 'roughness': roughness,
+                                    'repeat': i, 'status': status, 'wall': wall,
+                                    'stub': stub, 'report': report})
+
+    with open(os.path.join(outdir, 'results.json'), 'w') as f:
+        json.dump(records, f, indent=1, sort_keys=True)
+
+    with open(os.path.join(outdir, 'results.csv'), 'w') as f:
+        writer = csv.DictWriter(f, FIELDS, extrasaction='ignore')
+        writer.writeheader()
+        for record in records:
+            writer.writerow(summary(record, record['report']))
+
+    if any(record['status'] != 'ok' for record in records):
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    benchmark()
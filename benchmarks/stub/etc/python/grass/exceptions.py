@@ -0,0 +1,12 @@
+"""Stand-in for grass.exceptions"""
+
+
+class CalledModuleError(Exception):
+
+    def __init__(self, module, code, returncode, errors=None):
+        Exception.__init__(self, 'Module run {} {} ended with error {}'.format(
+            module, code, returncode))
+        self.module = module
+        self.code = code
+        self.returncode = returncode
+        self.errors = errors
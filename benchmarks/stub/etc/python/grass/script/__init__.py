@@ -0,0 +1,3 @@
+"""Stand-in for grass.script, see grass.script.core"""
+
+from grass.script.core import *  # noqa: F401,F403
@@ -0,0 +1,231 @@
+"""Stand-in for the grass.script functions wsi_grasstools calls
+
+Modules are started as processes of grass.script.simulate, which spends a
+simulated cost on them and writes their outputs into the mapset as sparse
+files of the size of the rasters, so process spawning, scheduling, cleanup
+and the mapset size behave as with GRASS while the modules themselves cost
+only what the cost table says. Queries such as region, raster_info and
+find_file are answered in process from the mapset files.
+"""
+
+from __future__ import print_function
+
+import os
+import sys
+import shutil
+import subprocess
+
+from grass.exceptions import CalledModuleError
+
+
+# Popen arguments passed through by start_command
+POPEN_ARGS = ['stdin', 'stdout', 'stderr', 'env', 'cwd', 'close_fds']
+
+# region keys in the order of a WIND file
+REGION_KEYS = ['n', 's', 'e', 'w', 'nsres', 'ewres', 'rows', 'cols']
+
+# directory of each map element in a mapset
+ELEMENTS = {'cell': 'cell', 'raster': 'cell', 'vector': 'vector', 'region': 'windows'}
+
+
+def _python_path():
+    path = os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+    paths = [path] + [p for p in os.environ.get('PYTHONPATH', '').split(os.pathsep) if p]
+
+    return os.pathsep.join(paths)
+
+
+def read_rc(path):
+    """Read a GISRC or WIND file of key: value lines"""
+    values = {}
+    with open(path) as f:
+        for line in f:
+            if ':' in line:
+                key, value = line.split(':', 1)
+                values[key.strip()] = value.strip()
+
+    return values
+
+
+def write_rc(path, values, keys=None):
+    with open(path, 'w') as f:
+        for key in keys or sorted(values):
+            f.write('{}: {}\n'.format(key, values[key]))
+
+
+def gisenv(env=None):
+    env = env or os.environ
+    values = read_rc(env['GISRC'])
+
+    return dict((key, values[key]) for key in ['GISDBASE', 'LOCATION_NAME', 'MAPSET'])
+
+
+def mapset_path(mapset=None, env=None):
+    genv = gisenv(env)
+    return os.path.join(genv['GISDBASE'], genv['LOCATION_NAME'], mapset or genv['MAPSET'])
+
+
+def region_path(env=None):
+    env = env or os.environ
+    path = mapset_path(env=env)
+    if env.get('WIND_OVERRIDE'):
+        return os.path.join(path, 'windows', env['WIND_OVERRIDE'])
+
+    return os.path.join(path, 'WIND')
+
+
+def parse_region(values):
+    region = dict((key, float(values[key])) for key in REGION_KEYS)
+    region['rows'] = int(region['rows'])
+    region['cols'] = int(region['cols'])
+    region['cells'] = region['rows'] * region['cols']
+
+    return region
+
+
+def region(env=None):
+    return parse_region(read_rc(region_path(env)))
+
+
+def write_region(path, region):
+    write_rc(path, region, REGION_KEYS)
+
+
+def use_temp_region():
+    name = 'tmp.{}'.format(os.getpid())
+    path = mapset_path()
+    if not os.path.isdir(os.path.join(path, 'windows')):
+        os.makedirs(os.path.join(path, 'windows'))
+    shutil.copy(region_path(), os.path.join(path, 'windows', name))
+    os.environ['WIND_OVERRIDE'] = name
+
+
+def del_temp_region():
+    name = os.environ.pop('WIND_OVERRIDE', None)
+    if name:
+        path = os.path.join(mapset_path(), 'windows', name)
+        if os.path.exists(path):
+            os.remove(path)
+
+
+def _search_path(env=None):
+    path = mapset_path(env=env)
+    mapsets = [gisenv(env)['MAPSET']]
+    if os.path.exists(os.path.join(path, 'SEARCH_PATH')):
+        with open(os.path.join(path, 'SEARCH_PATH')) as f:
+            mapsets.extend(line.strip() for line in f if line.strip())
+    mapsets.append('PERMANENT')
+
+    return mapsets
+
+
+def find_file(name, element='cell', mapset='', env=None):
+    if '@' in name:
+        name, mapset = name.split('@', 1)
+    for candidate in [mapset] if mapset else _search_path(env):
+        path = os.path.join(mapset_path(candidate, env), ELEMENTS.get(element, element), name)
+        if os.path.exists(path):
+            return {'name': name, 'mapset': candidate, 'file': path,
+                    'fullname': '{}@{}'.format(name, candidate)}
+
+    return {'name': '', 'mapset': '', 'file': '', 'fullname': ''}
+
+
+def raster_info(map, env=None):
+    found = find_file(map, element='cell', env=env)
+    if not found['file']:
+        raise CalledModuleError('r.info', {'map': map}, 1)
+    header = read_rc(os.path.join(mapset_path(found['mapset'], env), 'cellhd', found['name']))
+    info = parse_region(header)
+    info.update(datatype=header['datatype'],
+                min=float(header['min']) if header['datatype'] != 'CELL' else int(header['min']),
+                max=float(header['max']) if header['datatype'] != 'CELL' else int(header['max']),
+                north=info['n'], south=info['s'], east=info['e'], west=info['w'])
+
+    return info
+
+
+def make_command(prog, flags='', overwrite=False, quiet=False, verbose=False, **options):
+    args = [prog]
+    if overwrite:
+        args.append('--o')
+    if quiet:
+        args.append('--q')
+    if verbose:
+        args.append('--v')
+    if flags:
+        args.append('-' + flags)
+    for key, value in options.items():
+        if value is None:
+            continue
+        if isinstance(value, (list, tuple)):
+            value = ','.join(str(item) for item in value)
+        args.append('{}={}'.format(key.rstrip('_'), value))
+
+    return args
+
+
+def start_command(prog, flags='', overwrite=False, quiet=False, verbose=False, **kwargs):
+    popen = dict((key, kwargs.pop(key)) for key in POPEN_ARGS if key in kwargs)
+    env = dict(popen.get('env') or os.environ, PYTHONPATH=_python_path())
+    popen['env'] = env
+    args = make_command(prog, flags, overwrite, quiet, verbose, **kwargs)
+
+    return subprocess.Popen([sys.executable, '-m', 'grass.script.simulate'] + args, **popen)
+
+
+def run_command(*args, **kwargs):
+    process = start_command(*args, **kwargs)
+    returncode = process.wait()
+    if returncode:
+        raise CalledModuleError(args[0], kwargs, returncode)
+
+    return returncode
+
+
+def write_command(*args, **kwargs):
+    stdin = kwargs.pop('stdin')
+    process = start_command(*args, stdin=subprocess.PIPE, **kwargs)
+    process.communicate(stdin.encode('utf-8') if not isinstance(stdin, bytes) else stdin)
+    if process.returncode:
+        raise CalledModuleError(args[0], kwargs, process.returncode)
+
+    return process.returncode
+
+
+def parse_key_val(s, sep='=', dflt=None, val_type=None, vsep=None):
+    """Dict of the key=value lines of module output"""
+    result = {}
+    for line in s.splitlines():
+        if not line.strip():
+            continue
+        key, _, value = line.partition(sep)
+        result[key.strip()] = val_type(value.strip()) if val_type else (value.strip() or dflt)
+
+    return result
+
+
+def read_command(*args, **kwargs):
+    """Module output; only g.region -g writes any"""
+    if args[0] == 'g.region':
+        current = region(kwargs.get('env'))
+        return ''.join('{}={}\n'.format(key, current[key]) for key in REGION_KEYS)
+    run_command(*args, **kwargs)
+
+    return ''
+
+
+def parse_command(*args, **kwargs):
+    """Parsed module output of g.region -g and r.univar -g"""
+    if args[0] == 'g.region':
+        current = region(kwargs.get('env'))
+        return dict((key, str(current[key])) for key in REGION_KEYS)
+    if args[0] == 'r.univar':
+        if not find_file(kwargs['map'], env=kwargs.get('env'))['file']:
+            raise CalledModuleError('r.univar', kwargs, 1)
+        run_command(*args, **kwargs)
+        # every cell of the region is taken to hold a value
+        return {'n': str(region(kwargs.get('env'))['cells'])}
+    run_command(*args, **kwargs)
+
+    return {}
@@ -0,0 +1,16 @@
+"""Stand-in for grass.script.setup"""
+
+import os
+import tempfile
+
+
+def init(gisbase, dbase='', location='demolocation', mapset='PERMANENT'):
+    """Write a GISRC for the mapset and make it that of the session"""
+    os.environ['GISBASE'] = gisbase
+    fd, gisrc = tempfile.mkstemp(suffix='.gisrc')
+    with os.fdopen(fd, 'w') as f:
+        f.write('GISDBASE: {}\nLOCATION_NAME: {}\nMAPSET: {}\nGUI: text\n'.format(
+            dbase, location, mapset))
+    os.environ['GISRC'] = gisrc
+
+    return gisrc
@@ -0,0 +1,278 @@
+"""Simulated GRASS module process
+
+Run as python -m grass.script.simulate <module> [flags] [key=value ...].
+The module spends START plus its cost per million cells of the current
+region, scaled by GRASS_STUB_SCALE, on the CPU, then writes the maps named
+by its output parameters as sparse files the size of a raster of the region
+and the files it exports. A module reading a map that does not exist fails,
+as GRASS would.
+"""
+
+from __future__ import print_function, division
+
+import os
+import sys
+import time
+import shutil
+
+from grass.script import core
+
+
+# seconds spent by every module on startup
+START = 0.02
+
+# seconds per million cells, in the proportions of GRASS 7.4 runs
+COSTS = {'r.in.gdal': 0.4,
+         'r.external': 0.05,
+         'r.out.gdal': 0.5,
+         'r.hydrodem': 4.0,
+         'r.fill.dir': 3.0,
+         'r.watershed': 3.0,
+         'r.terraflow': 5.0,
+         'r.stream.extract': 2.0,
+         'r.stream.basins': 0.6,
+         'r.stream.order': 0.6,
+         'r.stream.distance': 1.5,
+         'r.thin': 0.5,
+         'r.to.vect': 1.5,
+         'r.clump': 0.6,
+         'r.stats.zonal': 0.4,
+         'r.mapcalc': 0.3,
+         'r.grow': 0.4,
+         'r.resamp.stats': 0.3,
+         'r.patch': 0.3,
+         'r.reclass': 0.05,
+         'r.path': 1.0,
+         'r.univar': 0.1,
+         'v.in.ogr': 0.3,
+         'v.to.rast': 0.3,
+         'v.out.ogr': 0.6}
+
+# output parameters of each module, as raster or vector maps
+OUTPUTS = {'r.in.gdal': [('output', 'cell')],
+           'r.external': [('output', 'cell')],
+           'r.hydrodem': [('output', 'cell')],
+           'r.fill.dir': [('output', 'cell'), ('direction', 'cell'), ('areas', 'cell')],
+           'r.watershed': [('drainage', 'cell'), ('accumulation', 'cell'),
+                           ('stream', 'cell'), ('basin', 'cell')],
+           'r.terraflow': [('filled', 'cell'), ('direction', 'cell'), ('swatershed', 'cell'),
+                           ('accumulation', 'cell'), ('tci', 'cell')],
+           'r.stream.extract': [('stream_rast', 'cell'), ('stream_vect', 'vector'),
+                                ('direction', 'cell')],
+           'r.stream.basins': [('basins', 'cell')],
+           'r.stream.order': [('strahler', 'cell'), ('shreve', 'cell'), ('horton', 'cell')],
+           'r.stream.distance': [('distance', 'cell'), ('difference', 'cell')],
+           'r.thin': [('output', 'cell')],
+           'r.to.vect': [('output', 'vector')],
+           'r.clump': [('output', 'cell')],
+           'r.stats.zonal': [('output', 'cell')],
+           'r.grow': [('output', 'cell')],
+           'r.resamp.stats': [('output', 'cell')],
+           'r.patch': [('output', 'cell')],
+           'r.reclass': [('output', 'cell')],
+           'v.in.ascii': [('output', 'vector')],
+           'r.path': [('raster_path', 'cell'), ('vector_path', 'vector')],
+           'r.in.bin': [('output', 'cell')],
+           'v.in.ogr': [('output', 'vector')],
+           'v.to.rast': [('output', 'cell')],
+           'r.unpack': [('output', 'cell')],
+           'v.unpack': [('output', 'vector')]}
+
+# modules writing their output parameter as a file
+EXPORTS = ['r.out.gdal', 'r.out.bin', 'v.out.ogr', 'r.pack', 'v.pack']
+
+# modules reading their input parameter from a file
+IMPORTS = ['r.in.gdal', 'r.external', 'r.in.bin', 'v.in.ogr', 'v.in.ascii', 'r.unpack',
+           'v.unpack']
+
+# outputs holding integer values, the others are DCELL
+INTEGER_OUTPUTS = ['drainage', 'stream', 'basin', 'direction', 'stream_rast', 'basins',
+                   'strahler', 'shreve', 'horton', 'raster_path']
+
+# bytes per cell of a raster map and per cell of the region for a vector map
+CELL_BYTES = 4
+VECTOR_BYTES = 0.5
+
+
+def parse_args(args):
+    module, flags, params = args[0], '', {}
+    for arg in args[1:]:
+        if arg.startswith('--'):
+            continue
+        elif arg.startswith('-'):
+            flags += arg[1:]
+        else:
+            key, value = arg.split('=', 1)
+            params[key] = value
+
+    return module, flags, params
+
+
+def spend(seconds):
+    """Keep the CPU busy for seconds"""
+    end = time.time() + seconds
+    x = 0
+    while time.time() < end:
+        for i in range(1000):
+            x += i * i
+
+
+def write_map(name, element, region, datatype='DCELL'):
+    path = core.mapset_path()
+    directory = os.path.join(path, element)
+    if not os.path.isdir(directory):
+        os.makedirs(directory)
+    if element == 'vector':
+        directory = os.path.join(directory, name)
+        if not os.path.isdir(directory):
+            os.makedirs(directory)
+        size, filename = int(region['cells'] * VECTOR_BYTES), os.path.join(directory, 'coor')
+    else:
+        size, filename = region['cells'] * CELL_BYTES, os.path.join(directory, name)
+        if not os.path.isdir(os.path.join(path, 'cellhd')):
+            os.makedirs(os.path.join(path, 'cellhd'))
+        header = dict(region, datatype=datatype, min=0, max=region['cells'])
+        core.write_rc(os.path.join(path, 'cellhd', name), header)
+    with open(filename, 'wb') as f:
+        f.truncate(size)
+
+
+def remove_map(name, element):
+    path = core.mapset_path()
+    target = os.path.join(path, element, name)
+    if os.path.isdir(target):
+        shutil.rmtree(target)
+    elif os.path.exists(target):
+        os.remove(target)
+    if element == 'cell' and os.path.exists(os.path.join(path, 'cellhd', name)):
+        os.remove(os.path.join(path, 'cellhd', name))
+
+
+def copy_map(old, new, element):
+    found = core.find_file(old, element=element)
+    path = core.mapset_path()
+    remove_map(new, element)
+    if element == 'vector':
+        shutil.copytree(found['file'], os.path.join(path, 'vector', new))
+        return
+    source = core.mapset_path(found['mapset'])
+    for directory in ['cell', 'cellhd']:
+        if not os.path.isdir(os.path.join(path, directory)):
+            os.makedirs(os.path.join(path, directory))
+        shutil.copy(os.path.join(source, directory, found['name']),
+                    os.path.join(path, directory, new))
+
+
+def set_region(flags, params, region):
+    """g.region from a raster, bounds and resolutions"""
+    for key in ['raster', 'align']:
+        if key in params:
+            region.update(core.raster_info(params[key].split(',')[0]))
+    for key in ['n', 's', 'e', 'w', 'nsres', 'ewres']:
+        if key in params:
+            region[key] = float(params[key])
+    if 'res' in params:
+        region['nsres'] = region['ewres'] = float(params['res'])
+    region['rows'] = max(int(round((region['n'] - region['s']) / region['nsres'])), 1)
+    region['cols'] = max(int(round((region['e'] - region['w']) / region['ewres'])), 1)
+    if 'save' in params:
+        windows = os.path.join(core.mapset_path(), 'windows')
+        if not os.path.isdir(windows):
+            os.makedirs(windows)
+        core.write_region(os.path.join(windows, params['save']), region)
+    else:
+        core.write_region(core.region_path(), region)
+    if 's' in flags:
+        core.write_region(os.path.join(core.mapset_path(), 'DEFAULT_WIND'), region)
+
+
+def manage(module, flags, params, region):
+    """Modules managing maps, mapsets and the region"""
+    if module == 'g.region':
+        set_region(flags, params, region)
+        if 'g' in flags:
+            print(''.join('{}={}\n'.format(key, region[key]) for key in core.REGION_KEYS), end='')
+    elif module == 'g.remove':
+        for element in params.get('type', 'raster').split(','):
+            for name in params['name'].split(','):
+                remove_map(name, core.ELEMENTS[element])
+    elif module in ('g.rename', 'g.copy'):
+        for element in ['raster', 'vector']:
+            if element in params:
+                old, new = params[element].split(',')
+                copy_map(old, new, core.ELEMENTS[element])
+                if module == 'g.rename':
+                    remove_map(old, core.ELEMENTS[element])
+    elif module == 'g.mapset':
+        genv = core.gisenv()
+        dbase = params.get('dbase', genv['GISDBASE'])
+        location = params.get('location', genv['LOCATION_NAME'])
+        path = os.path.join(dbase, location, params['mapset'])
+        if 'c' in flags and not os.path.isdir(path):
+            os.makedirs(path)
+            permanent = os.path.join(os.path.dirname(path), 'PERMANENT')
+            shutil.copy(os.path.join(permanent, 'DEFAULT_WIND'), os.path.join(path, 'WIND'))
+        if not os.path.isdir(path):
+            print('ERROR: Mapset <{}> does not exist'.format(params['mapset']), file=sys.stderr)
+            return 1
+        # the mapset becomes current, as with GRASS
+        gisrc = core.read_rc(os.environ['GISRC'])
+        gisrc.update(GISDBASE=dbase, LOCATION_NAME=location, MAPSET=params['mapset'])
+        core.write_rc(os.environ['GISRC'], gisrc)
+    elif module == 'g.mapsets' and params.get('operation') == 'add':
+        with open(os.path.join(core.mapset_path(), 'SEARCH_PATH'), 'a') as f:
+            f.write('\n'.join(params['mapset'].split(',')) + '\n')
+    elif module == 'r.mask':
+        if 'r' in flags:
+            remove_map('MASK', 'cell')
+        else:
+            write_map('MASK', 'cell', region, 'CELL')
+
+
+def main(args):
+    module, flags, params = parse_args(args)
+    region = core.region()
+
+    if module.startswith('g.') or module in ('r.mask', 'r.external.out'):
+        spend(START)
+        return manage(module, flags, params, region) or 0
+
+    inputs = []
+    if module not in IMPORTS and 'input' in params:
+        inputs = params['input'].split(',')
+    elif module == 'r.univar':
+        inputs = params['map'].split(',')
+    for name in inputs:
+        element = 'vector' if module.startswith('v.') else 'cell'
+        if not core.find_file(name, element=element)['file']:
+            print('ERROR: {} map <{}> not found'.format(element, name), file=sys.stderr)
+            return 1
+
+    outputs = [(params[key], element, key) for key, element in OUTPUTS.get(module, [])
+               if key in params]
+    if module == 'r.mapcalc':
+        expressions = params.get('expression') or sys.stdin.read()
+        outputs = [(line.split('=', 1)[0].strip(), 'cell', None)
+                   for line in expressions.splitlines() if '=' in line]
+
+    scale = float(os.environ.get('GRASS_STUB_SCALE', 1.0))
+    spend((START + COSTS.get(module, 0.2) * region['cells'] / 1e6) * scale)
+
+    for name, element, key in outputs:
+        write_map(name, element, region, 'CELL' if key in INTEGER_OUTPUTS else 'DCELL')
+    if module == 'r.out.bin':
+        # raw cells, all null, which the null value given stands for
+        with open(params['output'], 'wb') as f:
+            f.truncate(region['cells'] * int(params.get('bytes', CELL_BYTES)))
+    elif module in EXPORTS:
+        with open(params['output'], 'ab') as f:
+            f.truncate(region['cells'] * CELL_BYTES // 2)
+    if module == 'r.univar' and 'g' in flags:
+        # every cell of the region is taken to hold a value
+        print('n={}'.format(region['cells']))
+
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv[1:]))
@@ -0,0 +1,34 @@
+"""Stand-in for grass_session
+
+A session creates a missing location, with a one cell region, or a missing
+mapset when create_opts is given, and makes the mapset current.
+"""
+
+import os
+import shutil
+
+from grass.script import core, setup
+
+
+class Session(object):
+
+    def open(self, gisdb, location, mapset=None, create_opts=None):
+        mapset = mapset or 'PERMANENT'
+        permanent = os.path.join(gisdb, location, 'PERMANENT')
+        path = os.path.join(gisdb, location, mapset)
+        if not os.path.isdir(path):
+            if create_opts is None:
+                raise RuntimeError('Mapset {} not found'.format(path))
+            if not os.path.isdir(permanent):
+                os.makedirs(permanent)
+                region = {'n': 1, 's': 0, 'e': 1, 'w': 0, 'nsres': 1, 'ewres': 1,
+                          'rows': 1, 'cols': 1}
+                core.write_region(os.path.join(permanent, 'DEFAULT_WIND'), region)
+            if not os.path.isdir(path):
+                os.makedirs(path)
+            shutil.copy(os.path.join(permanent, 'DEFAULT_WIND'), os.path.join(path, 'WIND'))
+
+        setup.init(os.environ['GISBASE'], gisdb, location, mapset)
+
+    def close(self):
+        pass
@@ -0,0 +1,160 @@
+"""Synthetic DEMs for benchmarking
+
+Terrain is fractal noise from spectral synthesis: random phases under a
+power law amplitude spectrum whose slope sets the roughness, tilted so the
+surface drains towards one edge. Pits, round closed depressions of a few
+cells, and quarries, flat floored rectangular excavations with steep walls,
+are cut into it, giving the sink filling, conditioning and routing modules
+the depressions they spend most of their time on in real DEMs.
+"""
+
+from __future__ import print_function, division
+
+import os
+
+import numpy as np
+
+
+# origin and CRS of the written DEMs, UTM zone 18N
+ORIGIN = (500000.0, 4500000.0)
+EPSG = 26918
+
+
+def fractal_surface(rows, cols, roughness=0.5, relief=100.0, tilt=0.2, seed=None):
+    """Fractal terrain of rows by cols cells
+
+    Parameters:
+        roughness (float) : 0 for smooth hills to 1 for rugged terrain; the
+            amplitude falls off as frequency ** -(2 - roughness)
+        relief (float) : elevation range of the noise
+        tilt (float) : fall across the rows as a share of relief
+        seed (int) : random seed
+
+    Returns:
+        dem (ndarray) : float32 elevations
+    """
+    rng = np.random.RandomState(seed)
+    fy = np.fft.fftfreq(rows)[:, np.newaxis]
+    fx = np.fft.rfftfreq(cols)[np.newaxis, :]
+    frequency = np.hypot(fx, fy)
+    frequency[0, 0] = 1.0
+
+    spectrum = (rng.normal(size=frequency.shape) + 1j * rng.normal(size=frequency.shape))
+    spectrum *= frequency ** -(2.0 - roughness)
+    spectrum[0, 0] = 0.0
+    dem = np.fft.irfft2(spectrum, s=(rows, cols))
+
+    dem = (dem - dem.min()) / (dem.max() - dem.min()) * relief
+    dem += np.linspace(tilt * relief, 0.0, rows)[:, np.newaxis]
+
+    return dem.astype(np.float32)
+
+
+def plant_pits(dem, count, depth=5.0, radius=3, seed=None):
+    """Cut count round pits of depth and radius in cells into dem"""
+    rng = np.random.RandomState(seed)
+    rows, cols = dem.shape
+    y, x = np.mgrid[-radius:radius + 1, -radius:radius + 1]
+    shape = np.clip(1.0 - (x ** 2 + y ** 2) / (radius + 0.5) ** 2, 0.0, None) * depth
+
+    for _ in range(count):
+        row = rng.randint(radius, rows - radius)
+        col = rng.randint(radius, cols - radius)
+        dem[row - radius:row + radius + 1, col - radius:col + radius + 1] -= shape
+
+    return dem
+
+
+def plant_quarries(dem, count, depth=20.0, size=(10, 40), seed=None):
+    """Cut count flat floored quarries of depth into dem
+
+    Each side is drawn between size[0] and size[1] cells, and the floor lies
+    depth below the lowest cell of the quarry.
+    """
+    rng = np.random.RandomState(seed)
+    rows, cols = dem.shape
+
+    for _ in range(count):
+        height, width = rng.randint(size[0], size[1] + 1, 2)
+        height, width = min(height, rows - 2), min(width, cols - 2)
+        row = rng.randint(1, rows - height)
+        col = rng.randint(1, cols - width)
+        window = dem[row:row + height, col:col + width]
+        window[...] = window.min() - depth
+
+    return dem
+
+
+def depression_counts(size, pits=None, quarries=None):
+    """Pits and quarries of a DEM of size cells a side, filling in the defaults"""
+    if pits is None:
+        pits = size * size // 10000
+    if quarries is None:
+        quarries = max(size * size // 10 ** 6, 1)
+
+    return pits, quarries
+
+
+def synthetic_dem(size, roughness=0.5, pits=None, quarries=None, seed=0):
+    """Square fractal DEM of size cells a side with pits and quarries
+
+    Pits default to one per 10000 cells and quarries to one per million.
+    """
+    pits, quarries = depression_counts(size, pits, quarries)
+    dem = fractal_surface(size, size, roughness, seed=seed)
+    plant_pits(dem, pits, seed=seed + 1)
+    plant_quarries(dem, quarries, size=(max(size // 100, 3), max(size // 25, 5)), seed=seed + 2)
+
+    return dem
+
+
+def write_dem(path, dem, cellsize=1.0):
+    """Write dem as GeoTIFF, or as an ESRI ASCII grid when path ends in .asc
+
+    Returns:
+        path (str) : the written file
+    """
+    rows, cols = dem.shape
+    west, north = ORIGIN
+
+    if path.endswith('.asc'):
+        with open(path, 'w') as f:
+            f.write('ncols {}\nnrows {}\nxllcorner {}\nyllcorner {}\ncellsize {}\n'.format(
+                cols, rows, west, north - rows * cellsize, cellsize))
+            np.savetxt(f, dem, fmt='%.3f')
+        return path
+
+    from osgeo import gdal, osr
+
+    srs = osr.SpatialReference()
+    srs.ImportFromEPSG(EPSG)
+    ds = gdal.GetDriverByName('GTiff').Create(path, cols, rows, 1, gdal.GDT_Float32,
+                                             ['TILED=YES', 'COMPRESS=LZW', 'PREDICTOR=3'])
+    ds.SetGeoTransform((west, cellsize, 0.0, north, 0.0, -cellsize))
+    ds.SetProjection(srs.ExportToWkt())
+    ds.GetRasterBand(1).WriteArray(dem)
+    ds = None
+
+    return path
+
+
+def dem_extension():
+    """GeoTIFF where GDAL is installed, ESRI ASCII grid otherwise"""
+    try:
+        from osgeo import gdal  # noqa: F401
+    except ImportError:
+        return '.asc'
+
+    return '.tif'
+
+
+def dem_file(directory, size, roughness, pits=None, quarries=None, seed=0):
+    """Path of the DEM for the parameters, written unless it exists"""
+    pits, quarries = depression_counts(size, pits, quarries)
+    # the CLIs name the imported map after the file name up to the first dot
+    path = os.path.join(directory, 'dem_{}_r{:03d}_p{}_q{}_s{}{}'.format(
+        size, int(round(roughness * 100)), pits, quarries, seed, dem_extension()))
+    if not os.path.exists(path):
+        write_dem(path, synthetic_dem(size, roughness, pits, quarries, seed))
+
+    return path
@@ -31,16 +31,24 @@ setup(name='wsi-grasstools',
       include_package_data=True,
       install_requires=[
           'click',
-          'click-plugins'
+          'click-plugins',
+          'numpy',
+          'scipy'
       ],
       entry_points='''
           [console_scripts]
           grasstool=wsi_grasstools.cli.grasstool:cli
 
           [wsi_grasstools.subcommands]
+          batch=wsi_grasstools.cli.batch:batch
           hydrolines=wsi_grasstools.cli.hydrolines:hydrolines
+          hydrolines-sweep=wsi_grasstools.cli.sweep:hydrolines_sweep
+          hydrolines-update=wsi_grasstools.cli.update:hydrolines_update
           paths=wsi_grasstools.cli.paths:paths
+          session=wsi_grasstools.cli.session:session
           sinks=wsi_grasstools.cli.sinks:sinks
+          terraflow=wsi_grasstools.cli.terraflow:terraflow
+          warm-pool=wsi_grasstools.cli.warm:warm_pool
       ''',
       keywords='gis, hydrology, mapping',
       classifiers=[
@@ -0,0 +1,81 @@
+"""Test setup
+
+Tests run against GRASS when GISBASE points at an installation, and against
+the stand-in GRASS of benchmarks/stub otherwise. Tests reading map values
+back need GRASS and are skipped on the stand-in.
+"""
+
+import os
+import sys
+import json
+import subprocess
+
+import pytest
+
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+STUB = os.path.join(ROOT, 'benchmarks', 'stub')
+
+if not os.path.isdir(os.path.join(os.environ.get('GISBASE', ''), 'etc', 'python', 'grass')):
+    os.environ['GISBASE'] = STUB
+sys.path.append(os.path.join(os.environ['GISBASE'], 'etc', 'python'))
+
+STUBBED = os.environ['GISBASE'] == STUB
+
+requires_grass = pytest.mark.skipif(STUBBED, reason='needs GRASS, GISBASE is the stand-in')
+
+# runs the grasstool group with one subcommand, registered or not
+DRIVER = """
+import sys
+from importlib import import_module
+from wsi_grasstools.cli.grasstool import cli
+cli.add_command(getattr(import_module('wsi_grasstools.cli.' + sys.argv[1]), sys.argv[2]))
+cli(sys.argv[3:])
+"""
+
+
+@pytest.fixture
+def location(tmp_path):
+    """A temporary location made current, with a 3 by 6 cell region"""
+    from wsi_grasstools.instrument import run_command
+    from wsi_grasstools.manage import initialize
+
+    initialize(os.environ['GISBASE'], str(tmp_path), epsg=26918)
+    run_command('g.region', n=3, s=0, e=6, w=0, res=1)
+
+    return tmp_path
+
+
+@pytest.fixture
+def dem(tmp_path):
+    """A small synthetic DEM"""
+    sys.path.insert(0, os.path.join(ROOT, 'benchmarks'))
+    from terrain import synthetic_dem, write_dem
+
+    return write_dem(str(tmp_path / 'dem.asc'), synthetic_dem(100, seed=1))
+
+
+@pytest.fixture
+def grasstool(tmp_path):
+    """Run a grasstool command in its own process and return its run report
+
+    The command is given by its module and function under wsi_grasstools.cli,
+    followed by its arguments; the database is under tmp_path.
+    """
+    def run(module, command, args, options=()):
+        paths = [ROOT, os.path.join(os.environ['GISBASE'], 'etc', 'python'),
+                 os.environ.get('PYTHONPATH', '')]
+        env = dict(os.environ, PYTHONPATH=os.pathsep.join(paths), HOME=str(tmp_path),
+                   GRASS_STUB_SCALE='0')
+        dbdir = tmp_path / 'grassdata'
+        dbdir.mkdir(exist_ok=True)
+        dst = tmp_path / command
+        dst.mkdir()
+        output = subprocess.check_output(
+            [sys.executable, '-c', DRIVER, module, command, '--dbdir', str(dbdir)] +
+            list(options) + [command.replace('_', '-')] + list(args) + [str(dst)],
+            env=env, stderr=subprocess.STDOUT)
+        with open(str(dst / 'run_report.json')) as f:
+            return json.load(f), output
+
+    return run
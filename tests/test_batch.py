@@ -0,0 +1,21 @@
+import os
+
+from wsi_grasstools.cli.batch import job_args, job_dst
+
+
+def test_job_args_flags(tmp_path):
+    dst = str(tmp_path / 'out')
+    item = {'command': 'hydrolines', 'infile': 'dem.tif', 'dst': dst,
+            'threshold': 5000, 'link': True, 'cog': False, 'overviews': 'false',
+            'check_hand': 'True', 'pyramid': ''}
+    args = job_args(item, None)
+    assert args == ['hydrolines', 'dem.tif', dst, '--check-hand', '--link', '--threshold', '5000']
+    assert job_dst(args) == dst
+    assert not os.path.exists(dst)
+
+
+def test_job_args_paths_positional(tmp_path):
+    item = {'infile': 'dem.tif', 'headfile': 'heads.geojson', 'dst': 'out'}
+    args = job_args(item, 'paths')
+    assert args == ['paths', 'dem.tif', 'heads.geojson', 'out']
+    assert job_dst(args) == 'out'
@@ -0,0 +1,46 @@
+from wsi_grasstools.cache import Cache
+from wsi_grasstools.instrument import REPORT
+from wsi_grasstools.pipeline import Pipeline, Step
+
+REGION = {'n': 3.0, 's': 0.0, 'e': 6.0, 'w': 0.0, 'nsres': 1.0, 'ewres': 1.0,
+          'rows': 3, 'cols': 6}
+
+
+def test_key_follows_what_the_outputs_depend_on(tmp_path):
+    cache = Cache(str(tmp_path / 'cache'), 1e9)
+    source = tmp_path / 'dem.asc'
+    source.write_text(u'1')
+
+    def load(tuning=None, **params):
+        return Step('r.in.gdal', outputs=['dem'], sources=[str(source)], tuning=tuning,
+                    input=str(source), output='dem', **params)
+
+    key = cache.key(load(), [], REGION)
+    assert key not in cache
+    assert cache.key(load(), [], REGION) == key
+    assert cache.key(load(tuning={'memory': 300}), [], REGION) == key
+    assert cache.key(load(flags='o'), [], REGION) != key
+    assert cache.key(load(), ['upstream'], REGION) != key
+    assert cache.key(load(), [], dict(REGION, nsres=0.5)) != key
+
+    source.write_text(u'12')
+    assert cache.key(load(), [], REGION) != key
+
+
+def test_cached_steps_are_restored_not_run(location, tmp_path):
+    from wsi_grasstools.instrument import run_command
+
+    cache = Cache(str(tmp_path / 'cache'), 1e9)
+    first = Step('r.mapcalc', outputs=['a'], expression='a = 1')
+
+    def run(expression):
+        REPORT.pop()
+        second = Step('r.mapcalc', inputs=['a'], outputs=['b'], expression=expression)
+        Pipeline([first, second], cache=cache, keep=['b']).run()
+        run_command('g.remove', flags='f', type='raster', name='a,b')
+        return sorted(record['name'] for record in REPORT.pop())
+
+    assert run('b = a + 1') == ['g.remove', 'r.mapcalc', 'r.mapcalc', 'r.pack', 'r.pack']
+    # a hit restores only the maps kept or read by a step that runs
+    assert run('b = a + 1') == ['g.remove', 'r.unpack']
+    assert run('b = a + 2') == ['g.remove', 'r.mapcalc', 'r.pack', 'r.unpack']
@@ -0,0 +1,22 @@
+import numpy as np
+
+from wsi_grasstools.fill import NATIVE_CELLS, choose_engine, priority_flood
+
+
+def test_priority_flood_fills_to_the_spill_point():
+    dem = np.array([[5, 5, 5, 5, 5],
+                    [5, 2, 1, 3, 5],
+                    [5, 2, 4, 4, 4],
+                    [5, 5, 5, 5, np.nan]])
+    filled = priority_flood(dem)
+    expected = np.array([[5, 5, 5, 5, 5],
+                         [5, 4, 4, 4, 5],
+                         [5, 4, 4, 4, 4],
+                         [5, 5, 5, 5, np.nan]])
+    np.testing.assert_array_equal(filled, expected)
+
+
+def test_large_regions_fill_with_grass():
+    assert choose_engine('native', cells=NATIVE_CELLS) == 'native'
+    assert choose_engine('native', cells=NATIVE_CELLS + 1) == 'grass'
+    assert choose_engine('grass', cells=1) == 'grass'
@@ -0,0 +1,38 @@
+import os
+
+import numpy as np
+
+from conftest import requires_grass
+
+from wsi_grasstools.gdalio import export_raster, raster_type
+
+
+def test_signed_integers_skip_byte():
+    info = {'datatype': 'CELL', 'min': -8, 'max': 8}
+    assert raster_type(info) == ('Int16', -32768)
+
+
+def test_unsigned_integers_take_byte():
+    info = {'datatype': 'CELL', 'min': 0, 'max': 254}
+    assert raster_type(info) == ('Byte', 255)
+
+
+@requires_grass
+def test_negative_cell_map_round_trip(location):
+    from osgeo import gdal
+    from wsi_grasstools.instrument import run_command
+
+    # drainage codes -8..8 and one null cell
+    run_command('r.mapcalc', overwrite=True,
+                expression='dirs = if(row() == 3 && col() == 6, null(), '
+                           '(row() - 1) * 6 + col() - 9)')
+    output = os.path.join(str(location), 'dirs.tif')
+    export_raster('dirs', output)
+
+    ds = gdal.Open(output)
+    band = ds.GetRasterBand(1)
+    assert gdal.GetDataTypeName(band.DataType) == 'Int16'
+    assert band.GetNoDataValue() == -32768
+    expected = np.arange(-8, 10).reshape(3, 6)
+    expected[2, 5] = -32768
+    np.testing.assert_array_equal(band.ReadAsArray(), expected)
@@ -0,0 +1,48 @@
+import numpy as np
+
+from conftest import requires_grass
+
+from wsi_grasstools.hand import height_above_drainage, hand_raster
+
+NAN = np.nan
+
+# the bottom row is the stream; (0, 0) is null, (0, 1) drains into it through
+# (1, 0), (0, 2) into the loop of (1, 2) and (1, 3), (0, 3) out of the region,
+# and (0, 4) reaches the stream in two steps
+ELEVATION = np.array([[NAN, 9, 7, 6, 8],
+                      [5, 4, 3, 3, 6],
+                      [2, 1.5, 1, 0.5, 0.2]])
+DRAINAGE = np.array([[0, 5, 6, 2, 6],
+                     [2, 6, 8, 4, 5],
+                     [8, 8, 8, 8, 8]], dtype=np.int32)
+STREAMS = np.array([[0, 0, 0, 0, 0],
+                    [0, 0, 0, 0, 0],
+                    [1, 1, 1, 1, 1]], dtype=np.int32)
+HAND = np.array([[NAN, NAN, NAN, NAN, 7.5],
+                 [NAN, 2.5, NAN, NAN, 5.5],
+                 [0, 0, 0, 0, 0]])
+
+
+def test_height_above_drainage():
+    hand = height_above_drainage(ELEVATION, DRAINAGE, STREAMS != 0)
+    np.testing.assert_allclose(hand, HAND)
+
+
+@requires_grass
+def test_hand_raster(location):
+    from grass.script import array as garray
+    from wsi_grasstools.instrument import run_command
+
+    run_command('g.region', n=3, s=0, e=5, w=0, res=1)
+    for name, values, null in [('elevation', ELEVATION, -9999),
+                               ('drainage', DRAINAGE, 0),
+                               ('streams', STREAMS, 0)]:
+        grid = garray.array(dtype=values.dtype)
+        grid[...] = np.where(np.isnan(values), null, values)
+        grid.write(name, null=null, overwrite=True)
+
+    hand_raster('elevation', 'drainage', 'streams', 'hand')
+
+    hand = garray.array(dtype=np.float64)
+    hand.read('hand', null=np.nan)
+    np.testing.assert_allclose(np.asarray(hand), HAND)
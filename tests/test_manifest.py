@@ -0,0 +1,41 @@
+from wsi_grasstools.instrument import REPORT, run_command
+from wsi_grasstools.manifest import MANIFEST_NAME, Manifest
+from wsi_grasstools.pipeline import Pipeline
+
+from test_pipeline import calc, exists
+
+
+def test_manifest_reloads_records(tmp_path):
+    path = str(tmp_path / MANIFEST_NAME)
+    manifest = Manifest(path)
+    manifest.record(calc('a'))
+    manifest.remove(['a'])
+    manifest.record(calc('b', 'a'))
+
+    reloaded = Manifest(path)
+    assert calc('a') in reloaded and calc('b', 'a') in reloaded
+    assert calc('b', 'c') not in reloaded
+    assert reloaded.removed == {'a'}
+
+
+def resume(steps):
+    REPORT.pop()
+    Pipeline(steps, clean=True, keep=['c'], checkpoint=True).run()
+    return [record['name'] for record in REPORT.pop() if record['name'] == 'r.mapcalc']
+
+
+def test_resume_runs_the_remaining_steps(location):
+    # an interrupted run, a removed once b had read it
+    assert len(resume([calc('a'), calc('b', 'a')])) == 2
+    assert not exists('a') and exists('b')
+
+    assert len(resume([calc('a'), calc('b', 'a'), calc('c', 'b')])) == 1
+    assert exists('c')
+
+
+def test_resume_reruns_the_producers_of_lost_maps(location):
+    resume([calc('a'), calc('b', 'a')])
+    run_command('g.remove', flags='f', type='raster', name='b')
+
+    # b is gone, so it runs again, and so does a, removed after use
+    assert len(resume([calc('a'), calc('b', 'a'), calc('c', 'b')])) == 3
@@ -0,0 +1,35 @@
+from wsi_grasstools.mapcalc import fuse, mapcalc
+from wsi_grasstools.pipeline import Step
+
+
+def calc(name, inputs, rhs):
+    return Step('r.mapcalc', inputs=inputs, outputs=[name], expression='{} = {}'.format(name, rhs))
+
+
+def test_fuse_inlines_maps_read_by_one_expression():
+    steps = fuse([calc('a', ['dem'], 'dem * 2'), calc('b', ['a'], 'a + 1')])
+    assert len(steps) == 1
+    assert steps[0].inputs == ['dem']
+    assert steps[0].params['expression'] == 'b = (dem * 2) + 1'
+
+
+def test_fuse_keeps_neighbourhood_reads_and_other_readers():
+    a = calc('a', ['dem'], 'dem * 2')
+    b = calc('b', ['a'], 'a[1,0] - a')
+    steps = fuse([a, b])
+    assert [step.outputs for step in steps] == [['a'], ['b']]
+    assert steps[1].params['expression'] == 'b = a[1,0] - a'
+
+    watershed = Step('r.watershed', inputs=['a'], outputs=['dirs'], elevation='a', drainage='dirs')
+    steps = fuse([a, calc('c', ['a'], 'a + 1'), watershed])
+    # a is still written for r.watershed, in one pass with c
+    assert [step.outputs for step in steps] == [['a', 'c'], ['dirs']]
+    assert steps[0].params['expressions'] == ['a = dem * 2', 'c = (dem * 2) + 1']
+
+
+def test_fuse_merges_independent_expressions():
+    steps = fuse([calc('x', ['dem'], 'dem + 1'), calc('y', ['dem'], 'dem - 1')])
+    assert len(steps) == 1
+    assert steps[0].module is mapcalc
+    assert steps[0].outputs == ['x', 'y']
+    assert steps[0].params['expressions'] == ['x = dem + 1', 'y = dem - 1']
@@ -0,0 +1,52 @@
+import pytest
+
+from wsi_grasstools.pipeline import Pipeline, Step
+
+
+def calc(name, *inputs):
+    expression = '{} = {}'.format(name, ' + '.join(inputs) or '1')
+    return Step('r.mapcalc', inputs=inputs, outputs=[name], expression=expression)
+
+
+def exists(name):
+    import grass.script as g
+
+    return bool(g.find_file(name, element='cell')['file'])
+
+
+def test_graph_links_readers_to_writers():
+    a, b, c = calc('a'), calc('b', 'a'), calc('c', 'a', 'b', 'dem')
+    assert Pipeline([c, b, a]).graph() == {a: set(), b: {a}, c: {a, b}}
+
+    with pytest.raises(ValueError):
+        Pipeline([a, calc('a')]).graph()
+
+
+def test_run_follows_dependencies(location):
+    order = []
+
+    def record(name):
+        order.append(name)
+
+    steps = [Step(record, inputs=['b'], outputs=['c'], name='c'),
+             Step(record, inputs=['a'], outputs=['b'], name='b'),
+             Step(record, outputs=['a'], name='a')]
+    Pipeline(steps, jobs=4).run()
+    assert order == ['a', 'b', 'c']
+
+    with pytest.raises(ValueError):
+        Pipeline([calc('a', 'b'), calc('b', 'a')]).run()
+
+
+def test_clean_removes_maps_after_their_last_reader(location):
+    steps = [calc('a'), calc('b', 'a'), calc('c', 'a', 'b')]
+    pipeline = Pipeline(steps, clean=True, keep=['c'])
+    assert pipeline.lifetimes() == {'a': {steps[1], steps[2]}, 'b': {steps[2]}}
+
+    pipeline.run()
+    assert [exists(name) for name in 'abc'] == [False, False, True]
+
+
+def test_intermediates_kept_without_clean(location):
+    Pipeline([calc('a'), calc('b', 'a')]).run()
+    assert exists('a') and exists('b')
@@ -0,0 +1,46 @@
+import os
+import sys
+import subprocess
+
+import grass.script as g
+
+from wsi_grasstools import pool
+
+
+def test_acquire_claims_free_mapsets(tmp_path):
+    gisbase, gisdbdir = os.environ['GISBASE'], str(tmp_path)
+    try:
+        assert pool.acquire(gisbase, gisdbdir, epsg=26918) == ('pool_epsg26918', 'slot_0')
+        assert pool.acquire(gisbase, gisdbdir, epsg=26918) == ('pool_epsg26918', 'slot_1')
+        assert g.gisenv()['MAPSET'] == 'slot_1'
+        open(str(tmp_path / 'pool_epsg26918' / 'slot_0' / 'leftover'), 'w').close()
+    finally:
+        pool.release_all()
+
+    location_path = tmp_path / 'pool_epsg26918'
+    assert os.listdir(str(location_path / pool.LOCK_DIR)) == []
+    assert os.listdir(str(location_path / 'slot_0')) == ['WIND']
+    try:
+        assert pool.acquire(gisbase, gisdbdir, epsg=26918)[1] == 'slot_0'
+    finally:
+        pool.release_all()
+
+
+def test_stale_lock_is_reclaimed(tmp_path):
+    gisbase, gisdbdir = os.environ['GISBASE'], str(tmp_path)
+    location = pool.warm(gisbase, gisdbdir, 1, epsg=26918)
+    location_path = tmp_path / location
+    open(str(location_path / 'slot_0' / 'leftover'), 'w').close()
+
+    # the lock of a process that has exited
+    process = subprocess.Popen([sys.executable, '-c', 'pass'])
+    process.wait()
+    lock = location_path / pool.LOCK_DIR / 'slot_0'
+    lock.mkdir()
+    (lock / 'pid').write_text(u'{}'.format(process.pid))
+
+    try:
+        assert pool.acquire(gisbase, gisdbdir, epsg=26918) == (location, 'slot_0')
+        assert not (location_path / 'slot_0' / 'leftover').exists()
+    finally:
+        pool.release_all()
@@ -0,0 +1,57 @@
+import json
+
+from wsi_grasstools.routing import routing_steps
+
+ROUTING = ['r.watershed', 'r.terraflow']
+
+
+def routing_calls(report):
+    return dict((module['name'], module['calls']) for module in report['modules']
+                if module['name'] in ROUTING)
+
+
+def test_routing_steps_route_once(location):
+    steps = routing_steps('hydem', 'dirs', 'acc', 5000, engine='watershed',
+                          stream='streams', basin='basins')
+    assert [step.name for step in steps] == ['r.watershed']
+    assert sorted(steps[0].outputs) == ['acc', 'basins', 'dirs', 'streams']
+
+    steps = routing_steps('hydem', 'dirs', 'acc', engine='terraflow')
+    assert [step.name for step in steps if step.name in ROUTING] == ['r.terraflow']
+
+
+def test_hydrolines_routes_once(grasstool, dem):
+    report, _ = grasstool('hydrolines', 'hydrolines', [dem])
+    assert routing_calls(report) == {'r.watershed': 1}
+
+
+def test_hydrolines_terraflow_engine_routes_once(grasstool, dem):
+    report, _ = grasstool('hydrolines', 'hydrolines', ['--flow-engine', 'terraflow', dem])
+    assert routing_calls(report) == {'r.terraflow': 1}
+
+
+def test_terraflow_routes_once(grasstool, dem):
+    report, _ = grasstool('terraflow', 'terraflow', [dem])
+    assert routing_calls(report) == {'r.terraflow': 1}
+
+
+def test_paths_routes_once(grasstool, dem, tmp_path):
+    heads = tmp_path / 'heads.geojson'
+    with open(str(heads), 'w') as f:
+        json.dump({'type': 'FeatureCollection', 'features': [
+            {'type': 'Feature', 'properties': {},
+             'geometry': {'type': 'Point', 'coordinates': [500050.0, 4499950.0]}}]}, f)
+
+    report, _ = grasstool('paths', 'paths', [dem, str(heads)], ['--epsg', 'EPSG:26918'])
+    assert routing_calls(report) == {'r.watershed': 1}
+
+
+def test_memory_budget_only_tunes(location):
+    from wsi_grasstools.manifest import step_id
+
+    small, = routing_steps('hydem', 'dirs', 'acc', 5000, engine='watershed', memory=1e-6)
+    large, = routing_steps('hydem', 'dirs', 'acc', 5000, engine='watershed', memory=1e6)
+    assert small.call_params['flags'] == 'am'
+    assert large.call_params['flags'] == 'a'
+    assert small.params == large.params
+    assert step_id(small) == step_id(large)
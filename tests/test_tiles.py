@@ -0,0 +1,46 @@
+import subprocess
+
+import pytest
+
+from wsi_grasstools.tiles import make_tiles, match_ids, min_overlap, tile_offsets
+
+REGION = {'n': 100.0, 's': 0.0, 'e': 100.0, 'w': 0.0, 'nsres': 1.0, 'ewres': 1.0,
+          'rows': 100, 'cols': 100}
+
+
+def test_make_tiles_buffers_within_region():
+    tiles = make_tiles(REGION, 60, 10)
+    assert [tile['name'] for tile in tiles] == ['tile_0_0', 'tile_0_1', 'tile_1_0', 'tile_1_1']
+    assert tiles[0]['core'] == {'n': 100.0, 's': 40.0, 'w': 0.0, 'e': 60.0}
+    assert tiles[0]['buffered'] == {'n': 100.0, 's': 30.0, 'w': 0.0, 'e': 70.0}
+    assert tiles[3]['buffered'] == {'n': 50.0, 's': 0.0, 'w': 50.0, 'e': 100.0}
+
+
+def test_tile_offsets_keep_ids_apart():
+    # tile ids start at 1, so each tile's ids follow the largest before it
+    assert tile_offsets([4, 0, 7, 2]) == [0, 4, 4, 11]
+    assert tile_offsets([]) == []
+
+
+def test_match_ids_merges_chains_into_smallest():
+    # a stream crossing three tiles, and one crossing a single edge
+    mapping = match_ids({(3, 12), (12, 25), (7, 14)})
+    assert mapping == {12: 3, 25: 3, 14: 7}
+    assert match_ids(set()) == {}
+
+
+def test_tiled_hydrolines(grasstool, dem):
+    overlap = str(min_overlap(5000))
+    report, _ = grasstool('hydrolines', 'hydrolines',
+                          ['--tile-size', '50', '--overlap', overlap, dem])
+    calls = dict((module['name'], module['calls']) for module in report['modules'])
+    assert calls['r.watershed'] == 4
+    # one r.stats per strip shared by two of the 2x2 tiles, corners included
+    assert calls['r.stats'] == 6
+
+
+def test_tiled_hydrolines_rejects_native_hand(grasstool, dem):
+    with pytest.raises(subprocess.CalledProcessError) as error:
+        grasstool('hydrolines', 'hydrolines',
+                  ['--tile-size', '50', '--hand-engine', 'native', dem])
+    assert b'--hand-engine' in error.value.output
@@ -0,0 +1,77 @@
+import json
+
+import numpy as np
+
+from wsi_grasstools.tracing import Blocks, merge, trace
+
+# drainage codes: 6 flows south, 7 south-east, 8 east, 0 null
+DRAINAGE = np.array([[6, 6, 0, 6],
+                     [7, 6, 0, 6],
+                     [8, 8, 8, 8],
+                     [0, 0, 0, 0]], dtype=np.int32)
+
+
+def test_trace_merges_at_confluences():
+    paths, merged = trace(DRAINAGE, np.array([0, 1, 3]))
+    assert [path.tolist() for path in paths] == [[0, 4, 9, 10, 11], [1, 5, 9], [3, 7, 11]]
+    # paths advance together, so the third reaches cell 11 before the first
+    assert merged.tolist() == [True, True, False]
+
+
+def test_blocks_read_only_where_paths_go():
+    read = []
+
+    def reader(r0, r1, c0, c1):
+        read.append((r0, c0))
+        return DRAINAGE[r0:r1, c0:c1]
+
+    paths, _ = trace(Blocks(DRAINAGE.shape, reader, size=2), np.array([1]))
+    assert paths[0].tolist() == [1, 5, 9, 10, 11]
+    # the path never enters the top right block
+    assert sorted(read) == [(0, 0), (2, 0), (2, 2)]
+
+
+def test_block_size_does_not_change_paths():
+    rng = np.random.RandomState(3)
+    drainage = rng.randint(0, 9, size=(23, 17)).astype(np.int32)
+    starts = rng.choice(23 * 17, size=40, replace=False)
+
+    whole, whole_merged = trace(drainage, starts)
+    for size in [1, 4, 7]:
+        blocks = Blocks(drainage.shape, lambda r0, r1, c0, c1: drainage[r0:r1, c0:c1], size)
+        paths, merged = trace(blocks, starts)
+        assert [p.tolist() for p in paths] == [p.tolist() for p in whole]
+        assert merged.tolist() == whole_merged.tolist()
+
+
+def test_merge_owns_every_cell_once():
+    rng = np.random.RandomState(5)
+    drainage = rng.randint(1, 9, size=(30, 30)).astype(np.int32)
+    starts = rng.choice(900, size=60, replace=False)
+
+    # traced in two parts, as by two workers
+    traced = []
+    for part in np.array_split(starts, 2):
+        paths, merged = trace(drainage, part)
+        traced.extend(zip(paths, merged.tolist()))
+    paths, owned = merge(traced)
+
+    cells = np.concatenate(owned)
+    assert len(cells) == len(np.unique(cells))
+    for path, own in zip(paths, owned):
+        assert own.tolist() == path[:len(own)].tolist()
+        assert len(path) - len(own) in (0, 1)
+
+
+def test_native_paths_command(grasstool, dem, tmp_path):
+    heads = tmp_path / 'heads.geojson'
+    with open(str(heads), 'w') as f:
+        json.dump({'type': 'FeatureCollection', 'features': [
+            {'type': 'Feature', 'properties': {},
+             'geometry': {'type': 'Point', 'coordinates': [500050.0, 4499950.0]}}]}, f)
+
+    report, _ = grasstool('paths', 'paths', ['--tracer', 'native', dem, str(heads)],
+                          ['--epsg', 'EPSG:26918'])
+    calls = dict((module['name'], module['calls']) for module in report['modules'])
+    assert 'r.path' not in calls
+    assert calls['v.to.rast'] == 1
@@ -0,0 +1,156 @@
+"""Content addressed cache of the maps written by pipeline steps
+
+A step's key is a hash of its module and parameters, the computational region,
+the keys of the steps writing its inputs and the content of the files it
+reads, so a key only matches when the outputs would be recomputed identically.
+Each entry is a directory holding the outputs as r.pack/v.pack files. Entries
+are touched when used and the least recently used are evicted once the cache
+grows beyond its size limit.
+"""
+
+from __future__ import print_function
+
+import os
+import json
+import shutil
+import hashlib
+
+import grass.script as g
+
+from wsi_grasstools.instrument import run_command
+
+
+# chunk size for hashing source files
+BLOCK_SIZE = 1 << 20
+
+
+def file_digest(path):
+    """Return the sha256 hex digest of the content of a file"""
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(BLOCK_SIZE), b''):
+            digest.update(block)
+
+    return digest.hexdigest()
+
+
+def dir_size(path):
+    """Total size in bytes of the files under a directory"""
+    size = 0
+    for root, dirs, files in os.walk(path):
+        for name in files:
+            size += os.path.getsize(os.path.join(root, name))
+
+    return size
+
+
+class Cache(object):
+    """Persistent store of step outputs
+
+    Parameters:
+        path (str) : cache directory, created if missing
+        max_size (float) : size limit in bytes
+    """
+
+    def __init__(self, path, max_size):
+        self.path = os.path.abspath(path)
+        self.max_size = max_size
+        self._digests = {}
+        if not os.path.isdir(self.path):
+            os.makedirs(self.path)
+
+    def source_digest(self, path):
+        """Digest of a source file, remembered while its size and mtime hold"""
+        path = os.path.abspath(path)
+        stat = os.stat(path)
+        index_path = os.path.join(self.path, 'sources.json')
+        if not self._digests and os.path.exists(index_path):
+            with open(index_path) as f:
+                self._digests = json.load(f)
+
+        known = self._digests.get(path)
+        if known and known[:2] == [stat.st_size, stat.st_mtime]:
+            return known[2]
+
+        digest = file_digest(path)
+        self._digests[path] = [stat.st_size, stat.st_mtime, digest]
+        with open(index_path, 'w') as f:
+            json.dump(self._digests, f)
+
+        return digest
+
+    def key(self, step, upstream, region):
+        """Key of a step given the keys of the steps writing its inputs"""
+        digest = hashlib.sha256()
+        digest.update(step.name.encode('utf-8'))
+        digest.update(json.dumps(step.params, sort_keys=True).encode('utf-8'))
+        digest.update(json.dumps(region, sort_keys=True).encode('utf-8'))
+        for key in upstream:
+            digest.update(key.encode('utf-8'))
+        for source in step.sources:
+            digest.update(self.source_digest(source).encode('utf-8'))
+
+        return digest.hexdigest()
+
+    def _entry(self, key):
+        return os.path.join(self.path, key)
+
+    def __contains__(self, key):
+        return os.path.exists(os.path.join(self._entry(key), 'entry.json'))
+
+    def restore(self, key):
+        """Unpack the maps of an entry into the current mapset"""
+        entry = self._entry(key)
+        with open(os.path.join(entry, 'entry.json')) as f:
+            maps = json.load(f)['maps']
+
+        for name, kind in maps.items():
+            module = 'r.unpack' if kind == 'raster' else 'v.unpack'
+            run_command(module, overwrite=True,
+                        input=os.path.join(entry, name + '.pack'),
+                        output=name)
+
+        os.utime(entry, None)
+
+    def store(self, key, outputs):
+        """Pack the maps written by a step into a new entry"""
+        entry = self._entry(key)
+        tmp = '{}.tmp{}'.format(entry, os.getpid())
+        os.makedirs(tmp)
+
+        maps = {}
+        for name in outputs:
+            if g.find_file(name, element='cell')['file']:
+                maps[name] = 'raster'
+                module = 'r.pack'
+            else:
+                maps[name] = 'vector'
+                module = 'v.pack'
+            run_command(module, overwrite=True,
+                        input=name,
+                        output=os.path.join(tmp, name + '.pack'))
+
+        with open(os.path.join(tmp, 'entry.json'), 'w') as f:
+            json.dump({'maps': maps, 'size': dir_size(tmp)}, f)
+
+        if os.path.exists(entry):
+            shutil.rmtree(entry)
+        os.rename(tmp, entry)
+        self.evict()
+
+    def evict(self):
+        """Remove the least recently used entries beyond the size limit"""
+        entries = []
+        for key in os.listdir(self.path):
+            meta = os.path.join(self.path, key, 'entry.json')
+            if os.path.exists(meta):
+                with open(meta) as f:
+                    size = json.load(f)['size']
+                entries.append((os.path.getmtime(os.path.join(self.path, key)), size, key))
+
+        total = sum(size for _, size, _ in entries)
+        for _, size, key in sorted(entries):
+            if total <= self.max_size:
+                break
+            shutil.rmtree(self._entry(key))
+            total -= size
@@ -0,0 +1,185 @@
+from __future__ import print_function, division
+
+import os
+import sys
+import csv
+import json
+import time
+import multiprocessing
+
+import click
+
+from wsi_grasstools.manage_session import time_diff
+from wsi_grasstools.resources import worker_count
+
+
+# positional arguments of the subcommands, in order
+POSITIONAL = {'paths': ['infile', 'headfile', 'dst']}
+DEFAULT_POSITIONAL = ['infile', 'dst']
+
+# manifest values read as a flag given or left out, as CSV holds them
+FLAG_VALUES = {'true': True, 'false': False}
+
+# group options passed on to every job
+GROUP_OPTIONS = ['dbdir', 'scratch', 'epsg', 'cache_dir', 'cache_size']
+
+
+def read_manifest(path):
+    """Read a list of jobs from a CSV or JSON manifest"""
+    with open(path) as f:
+        if path.lower().endswith('.csv'):
+            return [dict(row) for row in csv.DictReader(f)]
+        return json.load(f)
+
+
+def job_args(item, command):
+    """Build the grasstool arguments of one manifest item
+
+    The item names the subcommand in its command field, or uses command. Its
+    infile, headfile and dst fields fill the positional arguments; any other
+    field is passed as the option of the same name, and a true or false
+    field as a flag given or left out.
+    """
+    item = dict(item)
+    command = item.pop('command', None) or command
+    if not command:
+        raise click.UsageError('No command given for manifest item {}'.format(item))
+
+    names = POSITIONAL.get(command, DEFAULT_POSITIONAL)
+    missing = [name for name in names if not item.get(name)]
+    if missing:
+        raise click.UsageError('Manifest item {} is missing {}'.format(item, ', '.join(missing)))
+
+    positional = [str(item.pop(name)) for name in names]
+
+    args = [command] + positional
+    for name, value in sorted(item.items()):
+        if value is None or value == '':
+            continue
+        option = '--' + name.replace('_', '-')
+        flag = value if isinstance(value, bool) else FLAG_VALUES.get(str(value).lower())
+        if flag is True:
+            args.append(option)
+        elif flag is None:
+            args.extend([option, str(value)])
+
+    return args
+
+
+def job_dst(args):
+    """The output directory among the arguments built by job_args"""
+    return args[len(POSITIONAL.get(args[0], DEFAULT_POSITIONAL))]
+
+
+def _run_job(task):
+    index, args, dst, log_dir = task
+
+    if log_dir:
+        log = open(os.path.join(log_dir, 'job_{}.log'.format(index)), 'w')
+        sys.stdout.flush()
+        sys.stderr.flush()
+        os.dup2(log.fileno(), 1)
+        os.dup2(log.fileno(), 2)
+
+    from wsi_grasstools.cli.grasstool import cli
+
+    start = time.time()
+    try:
+        if not os.path.isdir(dst):
+            os.makedirs(dst)
+        cli.main(args=args, prog_name='grasstool', standalone_mode=False)
+        status = 'ok'
+    except SystemExit as e:
+        status = 'failed: exit {}'.format(e.code)
+    except Exception as e:
+        status = 'failed: {}'.format(e)
+    finally:
+        # the worker exits without running atexit handlers
+        from wsi_grasstools.pool import release_all
+        release_all()
+
+    return index, status, start, time.time()
+
+
+def write_summary(path, rows):
+    fields = ['job', 'command', 'infile', 'status', 'start', 'end', 'seconds']
+    with open(path, 'w') as f:
+        if path.lower().endswith('.json'):
+            json.dump(rows, f, indent=2)
+        else:
+            writer = csv.DictWriter(f, fieldnames=fields)
+            writer.writeheader()
+            writer.writerows(rows)
+
+
+@click.command(options_metavar='<options>')
+@click.argument('manifest', nargs=1, type=click.Path(exists=True))
+@click.option('--command', nargs=1, default=None,
+              help="Subcommand for manifest items without a command field")
+@click.option('--job-memory', nargs=1, default=2048,
+              help="Memory needed by one job in MB, limits the number of workers")
+@click.option('--summary', nargs=1, default=None, type=click.Path(),
+              help="CSV or JSON file of job status and timing")
+@click.option('--log-dir', nargs=1, default=None, type=click.Path(exists=True, file_okay=False),
+              help="Directory for per-job log files")
+@click.pass_context
+def batch(ctx, manifest, command, job_memory, summary, log_dir):
+    """Run a subcommand over every item of a manifest
+
+    Each manifest item names its inputs and options. Items run in parallel
+    worker processes, as many as the processors and memory allow, and each in
+    its own location and mapset.
+
+    Parameters:
+        manifest : CSV or JSON list of jobs
+        command : default subcommand
+        job_memory : memory needed by one job in MB
+        summary : status and timing file, defaults to batch_summary.csv next to manifest
+        log_dir : directory for per-job logs
+    """
+
+    t0 = time.time()
+
+    items = [job_args(item, command) for item in read_manifest(manifest)]
+
+    workers = worker_count(job_memory * 1024 ** 2, limit=len(items))
+    jobs = max(ctx.obj['jobs'] // workers, 1)
+
+    params = ctx.parent.params
+    group_args = ['--jobs', str(jobs), '--memory', str(job_memory)]
+    for name in GROUP_OPTIONS:
+        if params.get(name) is not None:
+            group_args.extend(['--' + name.replace('_', '-'), str(params[name])])
+    for name in ['pool', 'keep_intermediates', 'keep_location', 'checkpoint', 'verbose']:
+        if params.get(name):
+            group_args.append('--' + name.replace('_', '-'))
+
+    tasks = [(i, group_args + ['--mapset', 'job_{}'.format(i)] + args, job_dst(args), log_dir)
+             for i, args in enumerate(items)]
+
+    click.echo(click.style('Running {} jobs on {} workers'.format(len(tasks), workers), fg='green'))
+    rows = []
+    pool = multiprocessing.Pool(processes=workers, maxtasksperchild=1)
+    try:
+        for index, status, start, end in pool.imap_unordered(_run_job, tasks):
+            args = items[index]
+            rows.append({'job': index, 'command': args[0], 'infile': args[1], 'status': status,
+                         'start': time.strftime('%Y-%m-%dT%H:%M:%S', time.localtime(start)),
+                         'end': time.strftime('%Y-%m-%dT%H:%M:%S', time.localtime(end)),
+                         'seconds': round(end - start, 1)})
+            fg = 'green' if status == 'ok' else 'red'
+            click.echo(click.style('job {} {}: {}'.format(index, args[1], status), fg=fg))
+    finally:
+        pool.close()
+        pool.join()
+
+    if summary is None:
+        summary = os.path.join(os.path.dirname(os.path.abspath(manifest)), 'batch_summary.csv')
+    write_summary(summary, sorted(rows, key=lambda row: row['job']))
+
+    failed = len([row for row in rows if row['status'] != 'ok'])
+    click.echo(click.style('{} of {} jobs failed'.format(failed, len(rows)),
+                           fg='red' if failed else 'green'))
+    elapsed = time_diff(t0, time.time())
+    click.echo(click.style('Finished in:', fg='green'))
+    click.echo(click.style(elapsed, fg='green'))
@@ -1,12 +1,14 @@
+import os
 import sys
 import logging
+import multiprocessing
 from pkg_resources import iter_entry_points
 
 import click
 from click_plugins import with_plugins
 
 import wsi_grasstools
-from wsi_grasstools.manage_session import initialize
+from wsi_grasstools.manage_session import clean, initialize
 
 logger = logging.getLogger(__name__)
 
@@ -14,13 +16,35 @@ logger = logging.getLogger(__name__)
 @with_plugins(iter_entry_points('wsi_grasstools.subcommands'))
 @click.group()
 @click.option('--dbdir', 'dbdir', nargs=1, default=None)
+@click.option('--scratch', 'scratch', nargs=1, default=None, envvar='WSI_GRASSTOOLS_SCRATCH',
+              type=click.Path(exists=True, file_okay=False),
+              help="Fast local GRASS database for the temporary location, e.g. an SSD or tmpfs")
 @click.option('--location', 'location', nargs=1, default=None)
 @click.option('--mapset', 'mapset', nargs=1, default=None)
 @click.option('--epsg', 'epsg', nargs=1, default=None)
+@click.option('-j', '--jobs', 'jobs', nargs=1, default=multiprocessing.cpu_count(),
+              help="Maximum number of GRASS processes to run at once")
+@click.option('--memory', 'memory', nargs=1, default=None, type=float,
+              help="Memory budget in MB, defaults to the available memory")
+@click.option('--cache-dir', 'cache_dir', nargs=1, default=None, envvar='WSI_GRASSTOOLS_CACHE',
+              type=click.Path(file_okay=False), help="Directory caching intermediate maps across runs")
+@click.option('--cache-size', 'cache_size', nargs=1, default=20.0,
+              help="Cache size limit in GB")
+@click.option('--pool', 'pool', default=False, is_flag=True,
+              help="Run in a mapset of a ready location for the CRS of the input")
+@click.option('--keep-intermediates', 'keep_intermediates', default=False, is_flag=True,
+              help="Keep intermediate maps instead of removing them once no step reads them")
+@click.option('--keep-location', 'keep_location', default=False, is_flag=True,
+              help="Keep the temporary location once the command has finished")
+@click.option('--checkpoint', 'checkpoint', default=False, is_flag=True,
+              help="Record completed steps in a persistent location so the run can be resumed")
+@click.option('--resume', 'resume', nargs=1, default=None,
+              help="Resume a checkpointed run in its location, skipping the completed steps")
 @click.option('-v', '--verbose', default=False, is_flag=True, help="Enables verbose mode")
 @click.version_option(version=wsi_grasstools.__version__, message='%(version)s')
 @click.pass_context
-def cli(ctx, dbdir, location, mapset, epsg, verbose):
+def cli(ctx, dbdir, scratch, location, mapset, epsg, jobs, memory, cache_dir, cache_size, pool,
+        keep_intermediates, keep_location, checkpoint, resume, verbose):
     ctx.obj = {}
     ctx.obj['verbose'] = verbose
     if verbose:
@@ -28,9 +52,39 @@ def cli(ctx, dbdir, location, mapset, epsg, verbose):
     else:
         logging.basicConfig(stream=sys.stderr, level=logging.ERROR)
 
-    dbdir, location, mapset = initialize(dbdir, location, mapset)
+    if resume:
+        location = resume
+        checkpoint = True
+    temporary = location is None and not pool and not checkpoint
+    scratch = scratch if temporary else None
+    dbdir, location, mapset = initialize(scratch or dbdir, location, mapset)
+    if resume:
+        from wsi_grasstools.manifest import MANIFEST_NAME
+        if not os.path.isdir(os.path.join(dbdir, location)):
+            raise click.BadParameter('location {} not found in {}'.format(location, dbdir),
+                                     param_hint='--resume')
+        if not os.path.isfile(os.path.join(dbdir, location, mapset, MANIFEST_NAME)):
+            raise click.BadParameter('no checkpointed run in mapset {} of location {}'.format(
+                mapset, location), param_hint='--resume')
+    if checkpoint and not resume:
+        click.echo(click.style('Checkpointing in location {0}, resume with --resume {0}'.format(
+            location), fg='yellow'))
+    if temporary and not keep_location:
+        # runs on success, failure and Ctrl-C alike
+        ctx.call_on_close(lambda: clean(os.path.join(dbdir, location)))
 
     ctx.obj['dbdir'] = dbdir
+    ctx.obj['scratch'] = bool(scratch)
     ctx.obj['location'] = location
     ctx.obj['mapset'] = mapset
     ctx.obj['epsg'] = epsg
+    ctx.obj['jobs'] = jobs
+    ctx.obj['memory'] = memory
+    ctx.obj['pool'] = pool
+
+    cache = None
+    if cache_dir:
+        from wsi_grasstools.cache import Cache
+        cache = Cache(cache_dir, cache_size * 1024 ** 3)
+    ctx.obj['pipeline'] = {'jobs': jobs, 'cache': cache, 'clean': not keep_intermediates,
+                           'checkpoint': checkpoint}
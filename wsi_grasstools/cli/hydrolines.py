@@ -1,14 +1,150 @@
 from __future__ import print_function
 
 import os
-from time import clock
+import time
 
 import click
 
 from wsi_grasstools.manage import initialize, setup_env, time_diff
 gisbase, gisdbdir = setup_env()
 
-import grass.script as g
+from wsi_grasstools import tiles
+from wsi_grasstools.gdalio import ExternalOutput, export_step, load_step, vector_export_steps
+from wsi_grasstools.hand import hand_steps
+from wsi_grasstools.instrument import REPORT
+from wsi_grasstools.pipeline import Pipeline, Step
+from wsi_grasstools.pyramid import (TOLERANCE, agreement, coarse_network, remove_corridor,
+                                    savings, set_corridor)
+from wsi_grasstools.routing import ENGINES, region_cells, routing_steps
+
+
+def drainage_steps(dem, mod, size, threshold=None, memory=None, engine='auto', stream_dir=None):
+    """Condition the DEM and route flow over it
+
+    The directions and accumulation do not depend on threshold, which may be
+    left out when the steps are shared by several thresholds. Flow is routed
+    by engine within the memory budget in MB.
+    """
+    steps = [
+        Step('r.hydrodem', inputs=[dem], outputs=['hydem'],
+             message='Running hydrodem',
+             input=dem,
+             output='hydem',
+             mod=mod,
+             size=size)
+    ]
+    steps.extend(routing_steps('hydem', 'dirs', 'acc', threshold,
+                               engine=engine, memory=memory, directory=stream_dir))
+
+    return steps
+
+
+def extract_steps(dem, threshold, d8cut, mexp, stream_length, hand_engine='grass',
+                  check_hand=False):
+    """Extract streams, then delineate basins and height above the streams"""
+    steps = [
+        Step('r.stream.extract', inputs=['hydem', 'acc'],
+             outputs=['dirs_', 'hydem_streams', 'hydem_streams_vec'],
+             message='Running stream extract',
+             elevation='hydem',
+             accumulation='acc',
+             direction='dirs_',
+             threshold=threshold,
+             d8cut=d8cut,
+             mexp=mexp,
+             stream_length=stream_length,
+             stream_rast='hydem_streams',
+             stream_vect='hydem_streams_vec'),
+
+        Step('r.stream.basins', inputs=['dirs', 'hydem_streams'], outputs=['basins_elem'],
+             dir='dirs',
+             stream='hydem_streams',
+             basins='basins_elem'),
+
+        Step('r.stream.basins', inputs=['dirs', 'hydem_streams'], outputs=['basins_last'],
+             flags='l',
+             dir='dirs',
+             stream='hydem_streams',
+             basins='basins_last')
+    ]
+    steps.extend(hand_steps(dem, 'dirs', 'hydem_streams', 'above_stream',
+                            hand_engine, check_hand))
+
+    return steps
+
+
+def network_steps():
+    """Order the stream network and convert streams and basins to vector"""
+    return [
+        Step('r.stream.order', inputs=['hydem_streams', 'dirs_'], outputs=['strahler'],
+             stream_rast='hydem_streams',
+             direction='dirs_',
+             strahler='strahler'),
+
+        Step('r.to.vect', inputs=['strahler'], outputs=['strahler_vec'],
+             input='strahler',
+             output='strahler_vec',
+             type='line'),
+
+        Step('r.to.vect', inputs=['basins_elem'], outputs=['basin_elem_vec'],
+             input='basins_elem',
+             output='basin_elem_vec',
+             type='area'),
+
+        Step('r.to.vect', inputs=['basins_last'], outputs=['basin_last_vec'],
+             input='basins_last',
+             output='basin_last_vec',
+             type='area')
+    ]
+
+
+def drainage_export_steps(dst, **options):
+    """Write the flow accumulation and direction rasters to dst
+
+    Parameters:
+        options : export_raster overviews and cog
+    """
+    return [
+        export_step('acc', os.path.join(dst, 'fac.tif'), message='Exporting', **options),
+        export_step('dirs', os.path.join(dst, 'dirs.tif'), **options)
+    ]
+
+
+def stream_export_steps(dst, vector_format='shp', **options):
+    """Write the stream, basin and height above stream products to dst
+
+    Parameters:
+        vector_format (str) : shp, gpkg or fgb
+        options : export_raster overviews and cog
+    """
+    layers = [('hydem_streams_vec', 'stream_ln', 'line'),
+              ('strahler_vec', 'strahler_ln', 'line'),
+              ('basin_last_vec', 'basin_last_ply', 'area'),
+              ('basin_elem_vec', 'basin_elem_ply', 'area')]
+
+    steps = vector_export_steps(layers, dst, 'hydrolines', vector_format)
+    steps.append(export_step('above_stream', os.path.join(dst, 'hand.tif'), float32=True, **options))
+
+    return steps
+
+
+def analysis_steps(dem, dst, params):
+    """All steps from the DEM to the exported products
+
+    Parameters:
+        dem (str) : elevation raster
+        dst (str) : output directory
+        params (dict) : hydrolines options by name, and the memory budget
+    """
+    options = dict(overviews=params['overviews'], cog=params['cog'])
+    return (drainage_steps(dem, params['mod'], params['size'], params['threshold'],
+                           params.get('memory'), params['flow_engine'], params['stream_dir']) +
+            extract_steps(dem, params['threshold'], params['d8cut'],
+                          params['mexp'], params['stream_length'],
+                          params['hand_engine'], params['check_hand']) +
+            network_steps() +
+            drainage_export_steps(dst, **options) +
+            stream_export_steps(dst, params['vector_format'], **options))
 
 
 @click.command(options_metavar='<options>')
@@ -24,8 +160,36 @@ import grass.script as g
               help="r.stream.extract mexp parameter")
 @click.option('--stream-length', nargs=1, default=100,
               help="r.stream.extract stream_length parameter")
+@click.option('--flow-engine', nargs=1, default='auto', type=click.Choice(ENGINES),
+              help="Route flow with r.watershed, r.terraflow or by DEM size and memory")
+@click.option('--stream-dir', nargs=1, default=None, type=click.Path(exists=True, file_okay=False),
+              help="r.terraflow directory for temporary files")
+@click.option('--hand-engine', nargs=1, default='grass', type=click.Choice(['native', 'grass']),
+              help="Height above streams by pointer jumping or with r.stream.distance")
+@click.option('--check-hand', default=False, is_flag=True,
+              help="Compare the native height above streams with r.stream.distance")
+@click.option('--tile-size', nargs=1, default=None, type=int,
+              help="Process the DEM in square tiles of this many cells")
+@click.option('--overlap', nargs=1, default=500,
+              help="Buffer around each tile in cells, at least the square root of --threshold")
+@click.option('--pyramid', nargs=1, default=None, type=int,
+              help="Extract streams this many times coarser first, then at full resolution near them")
+@click.option('--corridor', nargs=1, default=50,
+              help="Cells around the coarse streams processed at full resolution")
+@click.option('--pyramid-check', default=False, is_flag=True,
+              help="Compare the pyramid streams with a full resolution run")
+@click.option('--link', default=False, is_flag=True,
+              help="Link the input with r.external and write rasters with r.external.out")
+@click.option('--overviews', default=False, is_flag=True,
+              help="Add internal overviews to the exported rasters")
+@click.option('--cog', default=False, is_flag=True,
+              help="Export rasters as Cloud Optimized GeoTIFF")
+@click.option('--vector-format', nargs=1, default='shp', type=click.Choice(['shp', 'gpkg', 'fgb']),
+              help="Write vectors as Shapefiles, one GeoPackage or FlatGeobuf files")
 @click.pass_context
-def hydrolines(ctx, infile, dst, mod, size, threshold, d8cut, mexp, stream_length):
+def hydrolines(ctx, infile, dst, mod, size, threshold, d8cut, mexp, stream_length,
+               flow_engine, stream_dir, hand_engine, check_hand, tile_size, overlap,
+               pyramid, corridor, pyramid_check, link, overviews, cog, vector_format):
     """Create stream centerlines and other products
 
     Parameters:
@@ -35,131 +199,128 @@ def hydrolines(ctx, infile, dst, mod, size, threshold, d8cut, mexp, stream_lengt
         d8cut : r.stream.extract d8cut
         mexp : r.stream.extract mexp
         stream_length : r.stream.extract stream_length
+        flow_engine : auto, watershed or terraflow
+        stream_dir : r.terraflow temporary directory
+        hand_engine : native or grass r.stream.distance
+        check_hand : report the difference of native and r.stream.distance heights
+        tile_size : tile edge length in cells; tiles are run in parallel with
+            r.watershed and r.stream.distance
+        overlap : hydrologic buffer around each tile in cells; accumulation
+            is local to each buffered tile, so drainage longer than overlap
+            differs from a run without tiles
+        pyramid : coarsening factor of the coarse-to-fine extraction
+        corridor : cells around the coarse streams run at full resolution
+        pyramid_check : report agreement with a full resolution run
+        link : link the DEM and write the rasters in place through GDAL
+        overviews : add overviews to the exported rasters
+        cog : export the rasters as COG
+        vector_format : shp, gpkg or fgb
     """
 
-    t0 = clock()
+    t0 = time.time()
+
+    if pyramid and tile_size:
+        raise click.UsageError('--pyramid and --tile-size cannot be combined')
+    if tile_size and overlap < tiles.min_overlap(threshold):
+        # accumulation is local to each tile, see wsi_grasstools.tiles
+        raise click.BadParameter('must be at least {} cells, the side of the drainage area '
+                                 'of a stream head, for --threshold {}'.format(
+                                     tiles.min_overlap(threshold), threshold),
+                                 param_hint='--overlap')
+    if tile_size:
+        # tiles route flow with r.watershed and take heights from r.stream.distance
+        for hint, given in [('--flow-engine', flow_engine == 'terraflow'),
+                            ('--hand-engine', hand_engine == 'native'),
+                            ('--check-hand', check_hand)]:
+            if given:
+                raise click.BadParameter('cannot be combined with --tile-size', param_hint=hint)
 
-    location, mapset = initialize(gisbase, gisdbdir,
+    location, mapset = initialize(gisbase, ctx.obj['dbdir'],
                                   location=ctx.obj['location'],
                                   mapset=ctx.obj['mapset'],
                                   infile=infile,
-                                  epsg=ctx.obj['epsg'])
+                                  epsg=ctx.obj['epsg'],
+                                  pool=ctx.obj['pool'],
+                                  scratch=ctx.obj['scratch'])
 
     fname = os.path.basename(infile).split('.')[0]
 
     click.echo(click.style('Loading DEM', fg='green'))
     click.echo(click.style('GRASS layer: {}'.format(fname), fg='green'))
-    g.run_command('r.in.gdal', input=infile,
-                  output=fname, overwrite=True)
-
-    click.echo(click.style('Running hydrodem', fg='green'))
-    g.run_command('r.hydrodem', input=fname, overwrite=True,
-                  output='hydem',
-                  mod=mod,
-                  size=size)
-
-    click.echo(click.style('Running watershed directions', fg='green'))
-    g.run_command('r.watershed', flags='am', overwrite=True,
-                  elevation='hydem',
-                  threshold=threshold,
-                  drainage='dirs')
-
-    click.echo(click.style('Running watershed accumulation', fg='green'))
-    g.run_command('r.watershed', flags='am', overwrite=True,
-                  elevation='hydem',
-                  threshold=threshold,
-                  accumulation='acc')
-
-    click.echo(click.style('Running stream extract', fg='green'))
-    g.run_command('r.stream.extract', overwrite=True,
-                  elevation='hydem',
-                  accumulation='acc',
-                  direction='dirs_',
-                  threshold=threshold,
-                  d8cut=d8cut,
-                  mexp=mexp,
-                  stream_length=stream_length,
-                  stream_rast='hydem_streams',
-                  stream_vect='hydem_streams_vec')
-
-    g.run_command('r.stream.order', overwrite=True,
-                  stream_rast='hydem_streams',
-                  direction='dirs_',
-                  strahler='strahler')
-
-    g.run_command('r.to.vect', overwrite=True,
-                  input='strahler',
-                  output='strahler_vec',
-                  type='line')
-
-    g.run_command('r.stream.basins', overwrite=True,
-                  dir='dirs',
-                  stream='hydem_streams',
-                  basins='basins_elem')
-
-    g.run_command('r.stream.basins', overwrite=True,
-                  flags='l',
-                  dir='dirs',
-                  stream='hydem_streams',
-                  basins='basins_last')
-
-    g.run_command('r.to.vect', overwrite=True,
-                  input='basins_elem',
-                  output='basin_elem_vec',
-                  type='area')
-
-    g.run_command('r.to.vect', overwrite=True,
-                  input='basins_last',
-                  output='basin_last_vec',
-                  type='area')
-
-    g.run_command('r.stream.distance', overwrite=True,
-                  stream_rast='hydem_streams',
-                  direction='dirs',
-                  elevation=fname,
-                  method='downstream',
-                  difference='above_stream')
-
-    click.echo(click.style('Exporting', fg='green'))
-    g.run_command('r.out.gdal', overwrite=True,
-                  input='acc', type='Float64',
-                  output=os.path.join(dst, 'fac.tif'),
-                  format='GTiff', createopt='TFW=YES,COMPRESS=LZW')
-
-    g.run_command('r.out.gdal', overwrite=True,
-                  input="dirs", type='Float64',
-                  output=os.path.join(dst, 'dirs.tif'),
-                  format='GTiff', createopt='TFW=YES,COMPRESS=LZW')
-
-    g.run_command('v.out.ogr', overwrite=True,
-                  input='hydem_streams_vec',
-                  output=os.path.join(dst, 'stream_ln.shp'),
-                  format='ESRI_Shapefile',
-                  type='line')
-
-    g.run_command('v.out.ogr', overwrite=True,
-                  input='strahler_vec',
-                  output=os.path.join(dst, 'strahler_ln.shp'),
-                  format='ESRI_Shapefile',
-                  type='line')
-
-    g.run_command('v.out.ogr', overwrite=True,
-                  input='basin_last_vec',
-                  output=os.path.join(dst, 'basin_last_ply.shp'),
-                  format='ESRI_Shapefile',
-                  type='area')
-
-    g.run_command('v.out.ogr', overwrite=True,
-                  input='basin_elem_vec',
-                  output=os.path.join(dst, 'basin_elem_ply.shp'),
-                  format='ESRI_Shapefile',
-                  type='area')
-
-    g.run_command('r.out.gdal', overwrite=True,
-                  input='above_stream', type='Float64',
-                  output=os.path.join(dst, 'hand.tif'),
-                  format='GTiff', createopt='TFW=YES,COMPRESS=LZW')
-
-    elapsed = time_diff(t0, clock())
+    load = load_step(infile, fname, link)
+
+    pipeline = Pipeline(**ctx.obj['pipeline'])
+    if tile_size:
+        Pipeline([load]).run()
+
+        click.echo(click.style('Running tiles', fg='green'))
+        click.echo(click.style('Flow accumulation only counts cells within {} cells of each tile, '
+                               'so fac.tif differs from an untiled run for longer drainage'.format(
+                                   overlap), fg='red'))
+        tiles.run_tiled(gisbase, ctx.obj['dbdir'], location, fname,
+                        tile_size, overlap, ctx.obj['jobs'],
+                        dict(mod=mod, size=size, threshold=threshold, d8cut=d8cut,
+                             mexp=mexp, stream_length=stream_length,
+                             memory=ctx.obj['memory']))
+
+        pipeline.add(Step('r.thin', inputs=['hydem_streams'], outputs=['hydem_streams_thin'],
+                          input='hydem_streams',
+                          output='hydem_streams_thin'))
+
+        # the matched stream ids become the categories, as r.stream.extract writes them
+        pipeline.add(Step('r.to.vect', inputs=['hydem_streams_thin'], outputs=['hydem_streams_vec'],
+                          flags='v',
+                          input='hydem_streams_thin',
+                          output='hydem_streams_vec',
+                          type='line'))
+
+        pipeline.extend(network_steps())
+        pipeline.extend(drainage_export_steps(dst, overviews=overviews, cog=cog))
+        pipeline.extend(stream_export_steps(dst, vector_format, overviews=overviews, cog=cog))
+    elif pyramid:
+        Pipeline([load]).run()
+
+        click.echo(click.style('Extracting coarse streams', fg='green'))
+        cells = region_cells()
+        coarse_cells = coarse_network(fname, pyramid, threshold, ctx.obj['memory'])
+        corridor_cells = set_corridor(corridor)
+        click.echo(click.style('Full resolution cells: {} of {}, saving {:.1%}'.format(
+            corridor_cells, cells, savings(cells, coarse_cells, corridor_cells)), fg='green'))
+
+        # the cache keys do not cover the MASK
+        pipeline = Pipeline(keep=['hydem_streams'] if pyramid_check else [],
+                            **dict(ctx.obj['pipeline'], cache=None))
+        pipeline.extend(analysis_steps(fname, dst, dict(ctx.params, memory=ctx.obj['memory'])))
+    else:
+        pipeline.add(load)
+        pipeline.extend(analysis_steps(fname, dst, dict(ctx.params, memory=ctx.obj['memory'])))
+
+    output = ExternalOutput(dst) if link else None
+    if output:
+        pipeline.steps = output.apply(pipeline.steps)
+    try:
+        pipeline.run()
+        if output:
+            output.finish()
+    finally:
+        if pyramid:
+            remove_corridor(ctx.obj['pipeline']['clean'])
+        if output:
+            output.close()
+
+    if pyramid and pyramid_check:
+        click.echo(click.style('Running full resolution check', fg='green'))
+        stats = agreement(gisbase, ctx.obj['dbdir'], location, fname, 'hydem_streams',
+                          dict(ctx.params, memory=ctx.obj['memory']),
+                          clean=ctx.obj['pipeline']['clean'])
+        click.echo(click.style('Stream cells within {} cells of the other run: pyramid {:.1%} of {}, '
+                               'full resolution {:.1%} of {}'.format(
+                                   TOLERANCE, stats['precision'], stats['cells'],
+                                   stats['recall'], stats['reference_cells']), fg='yellow'))
+
+    REPORT.write(os.path.join(dst, 'run_report.json'), command='hydrolines',
+                 wall=time.time() - t0)
+
+    elapsed = time_diff(t0, time.time())
     click.echo(click.style('Finished in:', fg='green'))
     click.echo(click.style(elapsed, fg='green'))
@@ -1,11 +1,12 @@
 from __future__ import print_function
 
 import os
-from time import clock
+import time
 
 import click
 
 from wsi_grasstools.manage_session import time_diff
+from wsi_grasstools.resources import check_disk
 
 
 @click.command(options_metavar='<options>')
@@ -14,8 +15,25 @@ from wsi_grasstools.manage_session import time_diff
 @click.argument('dst', nargs=1, type=click.Path(exists=True))
 @click.option('--threshold', nargs=1, default=5000,
               help="r.watershed threshold parameter")
+@click.option('--tracer', nargs=1, default='grass', type=click.Choice(['native', 'grass']),
+              help="Trace paths in batches, reading only the drainage blocks they cross, or with r.path")
+@click.option('--workers', nargs=1, default=1,
+              help="Processes the head points are split across by the native tracer")
+@click.option('--hand-engine', nargs=1, default='grass', type=click.Choice(['native', 'grass']),
+              help="Height above streams by pointer jumping or with r.stream.distance")
+@click.option('--check-hand', default=False, is_flag=True,
+              help="Compare the native height above streams with r.stream.distance")
+@click.option('--link', default=False, is_flag=True,
+              help="Link the input with r.external and write rasters with r.external.out")
+@click.option('--overviews', default=False, is_flag=True,
+              help="Add internal overviews to the exported rasters")
+@click.option('--cog', default=False, is_flag=True,
+              help="Export rasters as Cloud Optimized GeoTIFF")
+@click.option('--vector-format', nargs=1, default='shp', type=click.Choice(['shp', 'gpkg', 'fgb']),
+              help="Write vectors as Shapefiles, one GeoPackage or FlatGeobuf files")
 @click.pass_context
-def paths(ctx, infile, headfile, dst, threshold):
+def paths(ctx, infile, headfile, dst, threshold, tracer, workers, hand_engine, check_hand, link,
+          overviews, cog, vector_format):
     """Create stream centerlines and other products
 
     Parameters:
@@ -25,17 +43,32 @@ def paths(ctx, infile, headfile, dst, threshold):
         d8cut : r.stream.extract d8cut
         mexp : r.stream.extract mexp
         stream_length : r.stream.extract stream_length
+        tracer : native or grass r.path
+        workers : native tracer processes
+        hand_engine : native or grass r.stream.distance
+        check_hand : report the difference of native and r.stream.distance heights
+        overviews : add overviews to the exported rasters
+        cog : export the rasters as COG
+        vector_format : shp, gpkg or fgb
     """
 
-    t0 = clock()
+    t0 = time.time()
 
     fname = os.path.basename(infile).split('.')[0]
     hname = os.path.basename(headfile).split('.')[0]
+    if ctx.obj['scratch']:
+        check_disk(ctx.obj['dbdir'], infile)
 
     from grass_session import Session
     import grass.script as g
     from grass.script import core as gcore
     import grass.script.setup as gsetup
+    from wsi_grasstools.gdalio import ExternalOutput, export_step, load_step, vector_export_steps
+    from wsi_grasstools.pipeline import Pipeline, Step
+    from wsi_grasstools.routing import routing_steps
+    from wsi_grasstools.tracing import trace_step
+    from wsi_grasstools.hand import hand_steps
+    from wsi_grasstools.instrument import REPORT
 
     PERMANENT = Session()
     PERMANENT.open(gisdb=ctx.obj['dbdir'],
@@ -51,17 +84,13 @@ def paths(ctx, infile, headfile, dst, threshold):
 
     click.echo(click.style('Loading DEM', fg='green'))
     click.echo(click.style('GRASS layer: {}'.format(fname), fg='green'))
-    g.run_command('r.in.gdal', input=infile,
-                  output=fname, overwrite=True)
+    pipeline = Pipeline(**ctx.obj['pipeline'])
+    pipeline.add(load_step(infile, fname, link))
 
-    g.run_command('v.in.ogr', input=headfile,
-                  output=hname, overwrite=True)
+    pipeline.add(Step('v.in.ogr', outputs=[hname], sources=[headfile], input=headfile, output=hname))
 
-    click.echo(click.style('Running watershed directions', fg='green'))
-    g.run_command('r.watershed', flags='ams', overwrite=True,
-                  elevation='fname',
-                  threshold=threshold,
-                  drainage='dirs')
+    pipeline.extend(routing_steps(fname, 'dirs', threshold=threshold, flags='as',
+                                  memory=ctx.obj['memory']))
 
     """
     click.echo(click.style('Running watershed accumulation', fg='green'))
@@ -71,50 +100,53 @@ def paths(ctx, infile, headfile, dst, threshold):
                   accumulation='acc')
     """
 
-    click.echo(click.style('Running path tracing', fg='green'))
-    g.run_command('r.path', overwrite=True,
-                  input='dirs',
-                  start_points='hname',
-                  raster_path='dem_stream',
-                  vector_path='dem_stream_vec')
-
-    g.run_command('r.stream.order', overwrite=True,
-                  stream_rast='dem_stream',
-                  direction='dirs',
-                  strahler='strahler')
-
-    g.run_command('r.to.vect', overwrite=True,
-                  input='strahler',
-                  output='dem_strahler_vec',
-                  type='line')
-
-    g.run_command('r.stream.distance', overwrite=True,
-                  stream_rast='dem_stream',
-                  direction='dirs',
-                  elevation=fname,
-                  method='downstream',
-                  difference='above_stream')
-
-    click.echo(click.style('Exporting...', fg='green'))
-    g.run_command('v.out.ogr', overwrite=True,
-                  input='dem_streams_vec',
-                  output=os.path.join(dst, 'stream_ln.shp'),
-                  format='ESRI_Shapefile',
-                  type='line')
-
-    g.run_command('v.out.ogr', overwrite=True,
-                  input='strahler_vec',
-                  output=os.path.join(dst, 'strahler_ln.shp'),
-                  format='ESRI_Shapefile',
-                  type='line')
-
-    g.run_command('r.out.gdal', overwrite=True,
-                  input='above_stream', type='Float64',
-                  output=os.path.join(dst, 'hand.tif'),
-                  format='GTiff', createopt='TFW=YES,COMPRESS=LZW')
+    if tracer == 'native':
+        pipeline.add(trace_step('dirs', hname, 'dem_stream', 'dem_stream_vec', workers,
+                                message='Running path tracing'))
+    else:
+        pipeline.add(Step('r.path', inputs=['dirs', hname], outputs=['dem_stream', 'dem_stream_vec'],
+                          message='Running path tracing',
+                          input='dirs',
+                          start_points=hname,
+                          raster_path='dem_stream',
+                          vector_path='dem_stream_vec'))
+
+    pipeline.add(Step('r.stream.order', inputs=['dem_stream', 'dirs'], outputs=['strahler'],
+                      stream_rast='dem_stream',
+                      direction='dirs',
+                      strahler='strahler'))
+
+    pipeline.add(Step('r.to.vect', inputs=['strahler'], outputs=['dem_strahler_vec'],
+                      input='strahler',
+                      output='dem_strahler_vec',
+                      type='line'))
+
+    pipeline.extend(hand_steps(fname, 'dirs', 'dem_stream', 'above_stream',
+                               hand_engine, check_hand))
+
+    pipeline.extend(vector_export_steps([('dem_stream_vec', 'stream_ln', 'line'),
+                                         ('dem_strahler_vec', 'strahler_ln', 'line')],
+                                        dst, 'paths', vector_format, message='Exporting...'))
+
+    pipeline.add(export_step('above_stream', os.path.join(dst, 'hand.tif'),
+                             float32=True, overviews=overviews, cog=cog))
+
+    output = ExternalOutput(dst) if link else None
+    if output:
+        pipeline.steps = output.apply(pipeline.steps)
+    try:
+        pipeline.run()
+        if output:
+            output.finish()
+    finally:
+        if output:
+            output.close()
 
     user.close()
 
-    elapsed = time_diff(t0, clock())
+    REPORT.write(os.path.join(dst, 'run_report.json'), command='paths',
+                 wall=time.time() - t0)
+
+    elapsed = time_diff(t0, time.time())
     click.echo(click.style('Finished in:', fg='green'))
     click.echo(click.style(elapsed, fg='green'))
@@ -0,0 +1,155 @@
+from __future__ import print_function, division
+
+import os
+import time
+import importlib
+import multiprocessing
+
+import click
+
+from wsi_grasstools.manage_session import time_diff
+from wsi_grasstools.resources import check_disk, memory_budget
+
+
+# subcommands that can run on a shared DEM; each module has analysis_steps
+ANALYSES = ['hydrolines', 'sinks', 'terraflow']
+
+
+def _module(name):
+    return importlib.import_module('wsi_grasstools.cli.{}'.format(name))
+
+
+def analysis_params(name, overrides):
+    """Defaults of a subcommand's options, updated by overrides
+
+    Parameters:
+        name (str) : subcommand name
+        overrides (list) : (option, value) string pairs
+
+    Returns:
+        params (dict) : option values by name
+    """
+    command = getattr(_module(name), name)
+    options = dict((param.name, param) for param in command.params)
+    params = dict((param.name, param.default) for param in command.params)
+    for key, value in overrides:
+        key = key.replace('-', '_')
+        if key not in options:
+            raise click.BadParameter('{} has no option {}'.format(name, key))
+        params[key] = options[key].type.convert(value, options[key], None)
+
+    return params
+
+
+def _run_analysis(task):
+    dbdir, location, name, dem, dst, params, jobs = task
+
+    from grass_session import Session
+    from wsi_grasstools.instrument import REPORT
+    from wsi_grasstools.pipeline import Pipeline
+
+    t0 = time.time()
+    user = Session()
+    user.open(gisdb=dbdir, location=location, mapset=name, create_opts='')
+    try:
+        Pipeline(_module(name).analysis_steps(dem, dst, params), jobs=jobs).run()
+        status = 'ok'
+    except Exception as e:
+        status = 'failed: {}'.format(e)
+    finally:
+        user.close()
+
+    return name, status, time_diff(t0, time.time()), REPORT.pop()
+
+
+@click.command(options_metavar='<options>')
+@click.argument('infile', nargs=1, type=click.Path(exists=True))
+@click.argument('dst', nargs=1, type=click.Path(exists=True))
+@click.option('--run', 'analyses', multiple=True, type=click.Choice(ANALYSES),
+              help="Analysis to run; repeat for several, defaults to all")
+@click.option('-o', '--option', 'options', multiple=True,
+              help="Analysis option as analysis.option=value, e.g. hydrolines.threshold=3000")
+@click.option('--link', default=False, is_flag=True,
+              help="Link the DEM with r.external instead of importing it")
+@click.pass_context
+def session(ctx, infile, dst, analyses, options, link):
+    """Run several analyses concurrently on one imported DEM
+
+    The DEM is imported, or linked, once into PERMANENT of a new location.
+    Each analysis then runs in its own mapset of that location from a worker
+    process, reads the DEM from PERMANENT and writes its products to a
+    directory named after it under dst.
+
+    Parameters:
+        analyses : hydrolines, sinks and/or terraflow
+        options : option values for the analyses
+        link : read the DEM in place through r.external
+    """
+
+    t0 = time.time()
+
+    analyses = list(analyses) or ANALYSES
+    overrides = dict((name, []) for name in analyses)
+    for option in options:
+        try:
+            key, value = option.split('=', 1)
+            name, key = key.split('.', 1)
+        except ValueError:
+            raise click.BadParameter('{} is not analysis.option=value'.format(option))
+        if name in overrides:
+            overrides[name].append((key, value))
+    params = dict((name, analysis_params(name, overrides[name])) for name in analyses)
+    for name in analyses:
+        params[name]['memory'] = memory_budget(ctx.obj['memory'], share=len(analyses))
+
+    from grass_session import Session
+    from wsi_grasstools.gdalio import load_step
+    from wsi_grasstools.instrument import REPORT, run_command
+    from wsi_grasstools.pipeline import Pipeline
+
+    fname = os.path.basename(infile).split('.')[0]
+    epsg = ctx.obj['epsg']
+    if ctx.obj['scratch']:
+        check_disk(ctx.obj['dbdir'], infile)
+
+    PERMANENT = Session()
+    PERMANENT.open(gisdb=ctx.obj['dbdir'],
+                   location=ctx.obj['location'],
+                   create_opts='EPSG:{}'.format(epsg) if epsg else infile)
+    try:
+        click.echo(click.style('Loading DEM', fg='green'))
+        click.echo(click.style('GRASS layer: {}'.format(fname), fg='green'))
+        Pipeline([load_step(infile, fname, link)]).run()
+
+        # new mapsets start from the default region
+        run_command('g.region', flags='s', raster=fname)
+    finally:
+        PERMANENT.close()
+
+    tasks = []
+    for name in analyses:
+        outdir = os.path.join(dst, name)
+        if not os.path.isdir(outdir):
+            os.makedirs(outdir)
+        tasks.append((ctx.obj['dbdir'], ctx.obj['location'], name, '{}@PERMANENT'.format(fname),
+                      outdir, params[name], max(ctx.obj['jobs'] // len(analyses), 1)))
+
+    click.echo(click.style('Running {}'.format(', '.join(analyses)), fg='green'))
+    pool = multiprocessing.Pool(processes=len(tasks))
+    try:
+        results = pool.map(_run_analysis, tasks)
+    finally:
+        pool.close()
+        pool.join()
+
+    for name, status, elapsed, records in results:
+        REPORT.extend(records)
+        fg = 'green' if status == 'ok' else 'red'
+        click.echo(click.style('{}: {} ({})'.format(name, status, elapsed), fg=fg))
+
+    REPORT.write(os.path.join(dst, 'run_report.json'), command='session',
+                 wall=time.time() - t0)
+
+    elapsed = time_diff(t0, time.time())
+    click.echo(click.style('Finished in:', fg='green'))
+    click.echo(click.style(elapsed, fg='green'))
@@ -1,14 +1,113 @@
 from __future__ import print_function
 
 import os
-from time import clock
+import time
 
 import click
 
 from wsi_grasstools.manage import initialize, setup_env, time_diff
 gisbase, gisdbdir = setup_env()
 
-import grass.script as g
+from wsi_grasstools.depressions import sink_step
+from wsi_grasstools.fill import NATIVE_CELLS, choose_engine, fill_step
+from wsi_grasstools.gdalio import ExternalOutput, load_step, vector_export_steps
+from wsi_grasstools.instrument import REPORT
+from wsi_grasstools.mapcalc import fuse
+from wsi_grasstools.pipeline import Pipeline, Step
+
+
+def analysis_steps(dem, dst, params):
+    """All steps from the DEM to the exported sinks
+
+    Parameters:
+        dem (str) : elevation raster
+        dst (str) : output directory
+        params (dict) : sinks options by name
+    """
+    steps = []
+
+    engine = choose_engine(params['fill_engine'])
+    if engine != params['fill_engine']:
+        click.echo(click.style('The region holds more than {} cells, filling with r.fill.dir '
+                               'instead of priority-flood'.format(NATIVE_CELLS), fg='red'))
+    if engine == 'native':
+        # fills every depression in one pass
+        outdem = 'filled_dem'
+        steps.append(fill_step(dem, outdem, message='Executing priority-flood fill'))
+    else:
+        # takes long to fill sinks if there are many and does not fill completely
+        for i in range(params['passes']):
+            if i == 0:
+                indem = dem
+            else:
+                indem = 'fill_pass_{}'.format(i-1)
+            outdem = 'fill_pass_{}'.format(i)
+
+            steps.append(Step('r.fill.dir', inputs=[indem], outputs=[outdem, 'dir_{}'.format(i)],
+                              message='Executing fill pass {}'.format(i),
+                              input=indem,
+                              output=outdem,
+                              direction='dir_{}'.format(i)))
+
+    if params['label_engine'] == 'native':
+        # depth, clumps and clump statistics from one read of the rasters
+        steps.append(sink_step(dem, outdem, 'sink_target', 'sink_mask',
+                               params['min_depth'], params['mask_depth'],
+                               os.path.join(dst, 'sinks.csv'),
+                               message='Labeling sinks'))
+    else:
+        # calculate the difference between filled and unfilled elevation rasters
+        steps.append(Step('r.mapcalc', inputs=[outdem, dem], outputs=['diff'],
+                          expression='diff = {} - {}'.format(outdem, dem)))
+
+        steps.append(Step('r.mapcalc', inputs=['diff'], outputs=['sinks'],
+                          expression='sinks = if(diff > 0.0, 1, null() )'))
+
+        steps.append(Step('r.clump', inputs=['sinks'], outputs=['sink_clump'],
+                          input='sinks',
+                          output='sink_clump',
+                          flags='d'))
+
+        # assign the max depth to each clump; sink_max carries the depth value
+        steps.append(Step('r.stats.zonal', inputs=['sink_clump', 'diff'], outputs=['sink_max'],
+                          base='sink_clump',
+                          cover='diff',
+                          method='max',
+                          output='sink_max'))
+
+        # ignore sinks that are not very deep; sink_target carries the clump value
+        expr = 'sink_target = if(sink_max > {0}, sink_clump, null() )'.format(params['min_depth'])
+        steps.append(Step('r.mapcalc', inputs=['sink_max', 'sink_clump'], outputs=['sink_target'],
+                          expression=expr))
+
+        # very deep sinks are most likely quarries to mask
+        expr = 'sink_mask = if(sink_max > {0}, sink_clump, null() )'.format(params['mask_depth'])
+        steps.append(Step('r.mapcalc', inputs=['sink_max', 'sink_clump'], outputs=['sink_mask'],
+                          expression=expr))
+
+    """
+    RUN EXPORTS
+    """
+    # native sink ids become the categories, matching the cat of sinks.csv
+    flags = 'v' if params['label_engine'] == 'native' else ''
+    steps.append(Step('r.to.vect', inputs=['sink_target'], outputs=['sinks_vec'],
+                      message='Converting to vector',
+                      flags=flags,
+                      input='sink_target',
+                      output='sinks_vec',
+                      type='area'))
+
+    steps.append(Step('r.to.vect', inputs=['sink_mask'], outputs=['sinks_mask_vec'],
+                      flags=flags,
+                      input='sink_mask',
+                      output='sinks_mask_vec',
+                      type='area'))
+
+    steps.extend(vector_export_steps([('sinks_vec', 'sinks', 'area'),
+                                      ('sinks_mask_vec', 'sinks_mask', 'area')],
+                                     dst, 'sinks', params['vector_format'], message='Exporting'))
+
+    return fuse(steps)
 
 
 @click.command(options_metavar='<options>')
@@ -20,8 +119,18 @@ import grass.script as g
               help="Depth above which sinks will be added to the sink mask.")
 @click.option('--passes', nargs=1, default=1,
               help="Number of passes to fill depressions.")
+@click.option('--fill-engine', nargs=1, default='grass', type=click.Choice(['native', 'grass']),
+              help="Fill depressions by priority-flood in one pass, up to 10 million cells, "
+                   "or with r.fill.dir.")
+@click.option('--label-engine', nargs=1, default='grass', type=click.Choice(['native', 'grass']),
+              help="Label and measure sinks from arrays in one pass or with r.clump and r.stats.zonal.")
+@click.option('--link', default=False, is_flag=True,
+              help="Link the input with r.external and write rasters with r.external.out")
+@click.option('--vector-format', nargs=1, default='shp', type=click.Choice(['shp', 'gpkg', 'fgb']),
+              help="Write vectors as Shapefiles, one GeoPackage or FlatGeobuf files")
 @click.pass_context
-def sinks(ctx, infile, dst, min_depth, mask_depth, passes):
+def sinks(ctx, infile, dst, min_depth, mask_depth, passes, fill_engine, label_engine, link,
+          vector_format):
     """Create sink mask and breach locations
 
     References:
@@ -30,136 +139,48 @@ def sinks(ctx, infile, dst, min_depth, mask_depth, passes):
     Parameters:
         min_depth (float) : write only sinks above the minimum depth
         max_depth (float) : maximum depth of sink to fill; depths greater than sinks_max are added to a sink mask
+        passes (int) : number of r.fill.dir passes
+        fill_engine (str) : native priority-flood, which gives way to r.fill.dir
+            above 10 million cells, or grass r.fill.dir
+        label_engine (str) : native labeling, which also writes sinks.csv, or grass r.clump
+        vector_format (str) : shp, gpkg or fgb
 
     """
 
-    t0 = clock()
+    t0 = time.time()
 
-    location, mapset = initialize(gisbase, gisdbdir,
+    location, mapset = initialize(gisbase, ctx.obj['dbdir'],
                                   location=ctx.obj['location'],
                                   mapset=ctx.obj['mapset'],
                                   infile=infile,
-                                  epsg=ctx.obj['epsg'])
+                                  epsg=ctx.obj['epsg'],
+                                  pool=ctx.obj['pool'],
+                                  scratch=ctx.obj['scratch'])
 
     fname = os.path.basename(infile).split('.')[0]
 
     click.echo(click.style('Loading DEM', fg='cyan'))
     click.echo(click.style('GRASS layer: {}'.format(fname), fg='cyan'))
-    g.run_command('r.in.gdal', input=infile,
-                  output=fname, overwrite=True)
-
-    # takes long to fill sinks if there are many and does not fill completely
-    """click.echo(click.style('Identifying sinks', fg='cyan'))
-    i = 0
-    while i < passes:
-        if i == 0:
-            indem = fname
-        else:
-            indem = 'fill_pass_{}'.format(i-1)
-        if i < passes - 1:
-            outdem = 'fill_pass_{}'.format(i)
-        else:
-            outdem = 'filled_dem'
-        click.echo(click.style('Executing fill pass {}'.format(i), fg='cyan'))
-        g.run_command('r.fill.dir', overwrite=True,
-                      input=indem,
-                      output=outdem,
-                      direction='dir')
-        i += 1
-      """
-
-    # takes long to fill sinks if there are many and does not fill completely
-    click.echo(click.style('Identifying sinks', fg='cyan'))
-    for i in range(passes):
-        if i == 0:
-            indem = fname
-        else:
-            indem = 'fill_pass_{}'.format(i-1)
-        outdem = 'fill_pass_{}'.format(i)
-
-        click.echo(click.style('Executing fill pass {}'.format(i), fg='cyan'))
-        g.run_command('r.fill.dir', overwrite=True,
-                      input=indem,
-                      output=outdem,
-                      direction='dir')
-
-    # calculate the difference between filled and unfilled elevation rasters
-    expr = '$diff = $indem1 - $indem2'
-    g.mapcalc(expr, overwrite=True,
-              diff='diff',
-              indem1=outdem,
-              indem2=fname)
-
-    expr = '$sinks = if($diff > 0.0, 1, null() )'
-    g.mapcalc(expr, overwrite=True,
-              sinks='sinks',
-              diff='diff')
-
-    g.run_command('r.clump', overwrite=True,
-                  input='sinks',
-                  output='sink_clump',
-                  flags='d')
-
-    # assign the max depth to each clump; sink_max carries the depth value
-    g.run_command('r.stats.zonal', overwrite=True,
-                  base='sink_clump',
-                  cover='diff',
-                  method='max',
-                  output='sink_max')
-
-    # ignore sinks that are not very deep; sink_target carries the clump value
-    expr = '$sink_target = if($sink_max > {0}, $sink_clump, null() )'.format(min_depth)
-    g.mapcalc(expr, overwrite=True,
-              sink_target='sink_target',
-              sink_clump='sink_clump',
-              sink_max='sink_max')
-
-    # very deep sinks are most likely quarries to mask
-    expr = '$sink_mask = if($sink_max > {0}, $sink_clump, null() )'.format(mask_depth)
-    g.mapcalc(expr, overwrite=True,
-              sink_mask='sink_mask',
-              sink_clump='sink_clump',
-              sink_max='sink_max')
-
-    """
-    RUN EXPORTS
-    """
-    click.echo(click.style('Converting to vector', fg='green'))
-    g.run_command('r.to.vect',
-                  input='sink_target',
-                  output='sinks_vec',
-                  type='area')
-
-    g.run_command('r.to.vect',
-                  input='sink_mask',
-                  output='sinks_mask_vec',
-                  type='area')
-
-    click.echo(click.style('Exporting', fg='green'))
-    g.run_command('v.out.ogr', overwrite=True,
-                  input='sinks_vec',
-                  output=os.path.join(dst, 'sinks.shp'),
-                  format='ESRI_Shapefile',
-                  type='area')
-
-    g.run_command('v.out.ogr', overwrite=True,
-                  input='sinks_mask_vec',
-                  output=os.path.join(dst, 'sinks_mask.shp'),
-                  format='ESRI_Shapefile',
-                  type='area')
-
-    """
-    g.run_command('r.out.gdal', overwrite=True,
-                  input='sink_target', type='Float64',
-                  output=os.path.join(dst, 'sink_target.tif'),
-                  format='GTiff', createopt='TFW=YES,COMPRESS=LZW')
-
-    g.run_command('r.out.gdal', overwrite=True,
-                  input='sink_mask', type='Float64',
-                  output=os.path.join(dst, 'sink_mask.tif'),
-                  format='GTiff', createopt='TFW=YES,COMPRESS=LZW')
-    """
+    pipeline = Pipeline(fg='cyan', **ctx.obj['pipeline'])
+    pipeline.add(load_step(infile, fname, link))
 
-    elapsed = time_diff(t0, clock())
+    click.echo(click.style('Identifying sinks', fg='cyan'))
+    pipeline.extend(analysis_steps(fname, dst, ctx.params))
+
+    output = ExternalOutput(dst) if link else None
+    if output:
+        pipeline.steps = output.apply(pipeline.steps)
+    try:
+        pipeline.run()
+        if output:
+            output.finish()
+    finally:
+        if output:
+            output.close()
+
+    REPORT.write(os.path.join(dst, 'run_report.json'), command='sinks',
+                 wall=time.time() - t0)
+
+    elapsed = time_diff(t0, time.time())
     click.echo(click.style('Finished in:', fg='green'))
     click.echo(click.style(elapsed, fg='green'))
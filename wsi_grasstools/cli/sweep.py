@@ -0,0 +1,177 @@
+from __future__ import print_function
+
+import os
+import csv
+import json
+import shutil
+import itertools
+import multiprocessing
+import time
+
+import click
+
+from wsi_grasstools.manage import initialize, init_mapset, setup_env, time_diff
+gisbase, gisdbdir = setup_env()
+
+from wsi_grasstools.instrument import REPORT, run_command
+from wsi_grasstools.pipeline import Pipeline, Step
+from wsi_grasstools.cli.hydrolines import (drainage_steps, extract_steps, network_steps,
+                                           drainage_export_steps, stream_export_steps)
+
+
+# swept parameters, their types and defaults
+PARAMETERS = [('threshold', int, 5000),
+              ('d8cut', int, 1000000),
+              ('mexp', float, 1.2),
+              ('stream_length', int, 100)]
+
+
+def grid(values):
+    """Expand lists of parameter values into every combination of them"""
+    names = [name for name, _, _ in PARAMETERS if values.get(name)]
+    return [dict(zip(names, combination))
+            for combination in itertools.product(*[values[name] for name in names])]
+
+
+def read_sweep(path):
+    """Read parameter combinations from a sweep file
+
+    A CSV file holds one combination per row. A JSON file holds either a list
+    of combinations or an object of parameter lists to expand into a grid.
+    """
+    with open(path) as f:
+        if path.lower().endswith('.csv'):
+            return [dict((k, v) for k, v in row.items() if v) for row in csv.DictReader(f)]
+        sweep = json.load(f)
+
+    if isinstance(sweep, dict):
+        return grid(sweep)
+
+    return sweep
+
+
+def complete(combination):
+    """Fill in defaults, convert types and name a combination"""
+    params = {}
+    for name, kind, default in PARAMETERS:
+        params[name] = kind(combination.get(name, default))
+    params['name'] = '_'.join('{}{}'.format(name, params[name]) for name, _, _ in PARAMETERS)
+
+    return params
+
+
+def _run_combination(task):
+    gisdbdir, location, shared, dem, index, params, dst, vector_format = task
+
+    t0 = time.time()
+    mapset = '{}_sweep_{}'.format(shared, index)
+    outdir = os.path.join(dst, params['name'])
+    if not os.path.isdir(outdir):
+        os.makedirs(outdir)
+
+    try:
+        init_mapset(gisbase, gisdbdir, location, mapset)
+        run_command('g.mapsets', operation='add', mapset=shared)
+
+        pipeline = Pipeline()
+        pipeline.extend(extract_steps(dem, params['threshold'], params['d8cut'],
+                                      params['mexp'], params['stream_length']))
+        pipeline.extend(network_steps())
+        pipeline.extend(stream_export_steps(outdir, vector_format))
+        pipeline.run()
+        status = 'ok'
+    except Exception as e:
+        status = 'failed: {}'.format(e)
+    finally:
+        shutil.rmtree(os.path.join(gisdbdir, location, mapset), ignore_errors=True)
+
+    return params['name'], status, time_diff(t0, time.time()), REPORT.pop()
+
+
+@click.command('hydrolines-sweep', options_metavar='<options>')
+@click.argument('infile', nargs=1, type=click.Path(exists=True))
+@click.argument('dst', nargs=1, type=click.Path(exists=True))
+@click.option('--mod', nargs=1, default=10, help="r.hydrodem mod parameter")
+@click.option('--size', nargs=1, default=40, help="r.hydrodem size parameter")
+@click.option('--threshold', multiple=True, type=int,
+              help="r.stream.extract threshold value; repeat to sweep")
+@click.option('--d8cut', multiple=True, type=int,
+              help="r.stream.extract d8cut value; repeat to sweep")
+@click.option('--mexp', multiple=True, type=float,
+              help="r.stream.extract mexp value; repeat to sweep")
+@click.option('--stream-length', multiple=True, type=int,
+              help="r.stream.extract stream_length value; repeat to sweep")
+@click.option('--sweep-file', nargs=1, default=None, type=click.Path(exists=True),
+              help="JSON or CSV file of parameter combinations")
+@click.option('--vector-format', nargs=1, default='shp', type=click.Choice(['shp', 'gpkg', 'fgb']),
+              help="Write vectors as Shapefiles, one GeoPackage or FlatGeobuf files")
+@click.pass_context
+def hydrolines_sweep(ctx, infile, dst, mod, size, threshold, d8cut, mexp, stream_length,
+                     sweep_file, vector_format):
+    """Create stream centerlines for many stream extraction parameters
+
+    The DEM is imported, conditioned and routed once. Stream extraction,
+    ordering, basins and height above stream then run for every combination
+    of the swept parameters in parallel mapsets, each writing its products to
+    its own directory under dst. Flow accumulation and directions are written
+    to dst.
+
+    Parameters:
+        mod : r.hydrodem mod
+        size : r. hydrodem size
+        threshold : r.stream.extract threshold values
+        d8cut : r.stream.extract d8cut values
+        mexp : r.stream.extract mexp values
+        stream_length : r.stream.extract stream_length values
+        sweep_file : file of combinations, used instead of the value lists
+        vector_format : shp, gpkg or fgb
+    """
+
+    t0 = time.time()
+
+    if sweep_file:
+        combinations = read_sweep(sweep_file)
+    else:
+        combinations = grid({'threshold': threshold, 'd8cut': d8cut,
+                             'mexp': mexp, 'stream_length': stream_length})
+    combinations = [complete(combination) for combination in combinations]
+
+    location, mapset = initialize(gisbase, ctx.obj['dbdir'],
+                                  location=ctx.obj['location'],
+                                  mapset=ctx.obj['mapset'],
+                                  infile=infile,
+                                  epsg=ctx.obj['epsg'],
+                                  pool=ctx.obj['pool'],
+                                  scratch=ctx.obj['scratch'])
+
+    fname = os.path.basename(infile).split('.')[0]
+
+    click.echo(click.style('Loading DEM', fg='green'))
+    click.echo(click.style('GRASS layer: {}'.format(fname), fg='green'))
+    pipeline = Pipeline(keep=[fname, 'hydem', 'dirs', 'acc'], **ctx.obj['pipeline'])
+    pipeline.add(Step('r.in.gdal', outputs=[fname], sources=[infile], input=infile, output=fname))
+    pipeline.extend(drainage_steps(fname, mod, size, memory=ctx.obj['memory']))
+    pipeline.extend(drainage_export_steps(dst))
+    pipeline.run()
+
+    click.echo(click.style('Running {} combinations'.format(len(combinations)), fg='green'))
+    tasks = [(ctx.obj['dbdir'], location, mapset, fname, i, params, dst, vector_format)
+             for i, params in enumerate(combinations)]
+    pool = multiprocessing.Pool(processes=max(min(ctx.obj['jobs'], len(tasks)), 1))
+    try:
+        results = pool.map(_run_combination, tasks)
+    finally:
+        pool.close()
+        pool.join()
+
+    for name, status, elapsed, records in results:
+        REPORT.extend(records)
+        fg = 'green' if status == 'ok' else 'red'
+        click.echo(click.style('{}: {} ({})'.format(name, status, elapsed), fg=fg))
+
+    REPORT.write(os.path.join(dst, 'run_report.json'), command='hydrolines-sweep',
+                 wall=time.time() - t0)
+
+    elapsed = time_diff(t0, time.time())
+    click.echo(click.style('Finished in:', fg='green'))
+    click.echo(click.style(elapsed, fg='green'))
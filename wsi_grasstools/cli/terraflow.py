@@ -2,96 +2,124 @@ from __future__ import print_function
 
 import sys
 import os
-from time import clock
+import time
 
 import click
 
 from wsi_grasstools.manage import initialize, setup_env, time_diff
 gisbase, gisdbdir = setup_env()
 
-import grass.script as g
+from wsi_grasstools.gdalio import ExternalOutput, export_step, load_step
+from wsi_grasstools.instrument import REPORT
+from wsi_grasstools.mapcalc import fuse
+from wsi_grasstools.pipeline import Pipeline, Step
+from wsi_grasstools.routing import ENGINES, routing_steps
+
+
+def analysis_steps(dem, dst, params):
+    """All steps from the DEM to the exported rasters
+
+    Parameters:
+        dem (str) : elevation raster, its name prefixes the output files
+        dst (str) : output directory
+        params (dict) : terraflow options by name, and the memory budget
+    """
+    name = dem.split('@')[0]
+    steps = []
+
+    steps.extend(routing_steps(dem, 'dra', 'acc', params['threshold'],
+                               engine=params['flow_engine'],
+                               memory=params.get('memory'),
+                               directory=params['stream_dir']))
+
+    steps.append(Step('r.mapcalc', inputs=['dra'], outputs=['outlets'],
+                      message='Identify outlets by negative flow direction',
+                      expression='outlets = if(dra >= 0,null(),1)'))
+
+    steps.append(Step('r.to.vect', inputs=['outlets'], outputs=['outlets_vec'],
+                      message='Convert outlet raster to vector',
+                      input='outlets', output='outlets_vec',
+                      type='point'))
+
+    steps.append(Step('r.stream.basins', inputs=['dra', 'outlets_vec'], outputs=['bas'],
+                      message='Delineate basins according to outlets',
+                      direction='dra', points='outlets_vec',
+                      basins='bas'))
+
+    # Save the outputs as TIFs
+    options = dict(overviews=params['overviews'], cog=params['cog'])
+    for raster, suffix in [('outlets', 'outlets'), ('acc', 'fac'), ('dra', 'fdr'), ('bas', 'basins')]:
+        steps.append(export_step(raster, os.path.join(dst, '{}_{}.tif'.format(name, suffix)),
+                                 **options))
+
+    return fuse(steps)
 
 
 @click.command(options_metavar='<options>')
 @click.argument('infile', nargs=1, type=click.Path(exists=True))
 @click.argument('dst', nargs=1, type=click.Path(exists=True))
 @click.option('--threshold', nargs=1, default=1500, help="r.watershed threshold parameter")
+@click.option('--flow-engine', nargs=1, default='terraflow', type=click.Choice(ENGINES),
+              help="Route flow with r.terraflow, r.watershed or by DEM size and memory")
+@click.option('--stream-dir', nargs=1, default=None, type=click.Path(exists=True, file_okay=False),
+              help="r.terraflow directory for temporary files")
+@click.option('--link', default=False, is_flag=True,
+              help="Link the input with r.external and write rasters with r.external.out")
+@click.option('--overviews', default=False, is_flag=True,
+              help="Add internal overviews to the exported rasters")
+@click.option('--cog', default=False, is_flag=True,
+              help="Export rasters as Cloud Optimized GeoTIFF")
 @click.pass_context
-def terraflow(ctx, infile, dst, threshold):
+def terraflow(ctx, infile, dst, threshold, flow_engine, stream_dir, link, overviews, cog):
     """Create first order raster hydrography products including basins
 
     Writes output files:
 
         <fname>_outlets.tif
-        <fname>_fsc.tif
+        <fname>_fac.tif
         <fname>_fdr.tif
         <fname>_basins.tif
 
     Parameters:
         threshold : r.watershed threshold
+        flow_engine : terraflow, watershed or auto
+        stream_dir : r.terraflow temporary directory
+        overviews : add overviews to the exported rasters
+        cog : export the rasters as COG
 
     Returns:
         None
 
     """
 
-    t0 = clock()
+    t0 = time.time()
 
-    location, mapset = initialize(gisbase, gisdbdir, location=ctx.obj['location'],
-                                  mapset=ctx.obj['mapset'], infile=infile, epsg=ctx.obj['epsg'])
+    location, mapset = initialize(gisbase, ctx.obj['dbdir'], location=ctx.obj['location'],
+                                  mapset=ctx.obj['mapset'], infile=infile, epsg=ctx.obj['epsg'],
+                                  pool=ctx.obj['pool'], scratch=ctx.obj['scratch'])
 
     fname = os.path.basename(infile).split('.')[0]
 
     click.echo(click.style('Loading DEM', fg='green'))
     click.echo(click.style('GRASS layer: {}'.format(fname), fg='green'))
-    g.run_command('r.in.gdal', input=infile,
-                  output=fname, overwrite=True)
-
-    g.run_command('r.watershed', flags='am', overwrite=True,
-                  elevation=fname,
-                  threshold=threshold,
-                  accumulation='acc',
-                  drainage='dra')
-
-    print('Identify outlets by negative flow direction')
-    g.run_command('r.mapcalc', overwrite=True,
-                  expression='outlets = if(dra >= 0,null(),1)')
-
-    print('Convert outlet raster to vector')
-    g.run_command('r.to.vect', overwrite=True,
-                  input='outlets', output='outlets_vec',
-                  type='point')
-
-    print('Delineate basins according to outlets')
-    g.run_command('r.stream.basins', overwrite=True,
-                  direction='dra', points='outlets_vec',
-                  basins='bas')
-
-    # Save the outputs as TIFs
-    outlets_fname = fname + '_outlets.tif'
-    g.run_command('r.out.gdal', overwrite=True,
-                  input='outlets', type='Float32',
-                  output=os.path.join(dst, outlets_fname),
-                  format='GTiff')
-
-    fac_fname = fname + '_fac.tif'
-    g.run_command('r.out.gdal', overwrite=True,
-                  input='acc', type='Float64',
-                  output=os.path.join(dst, fac_fname),
-                  format='GTiff')
-
-    fdr_fname = fname + '_fdr.tif'
-    g.run_command('r.out.gdal', overwrite=True,
-                  input='dra', type='Float64',
-                  output=os.path.join(dst, fdr_fname),
-                  format='GTiff')
-
-    bas_fname = fname + '_basins.tif'
-    g.run_command('r.out.gdal', overwrite=True,
-                  input='bas', type='Int16',
-                  output=os.path.join(dst, bas_fname),
-                  format='GTiff')
-
-    elapsed = time_diff(t0, clock())
+    pipeline = Pipeline(**ctx.obj['pipeline'])
+    pipeline.add(load_step(infile, fname, link))
+
+    pipeline.extend(analysis_steps(fname, dst, dict(ctx.params, memory=ctx.obj['memory'])))
+    output = ExternalOutput(dst) if link else None
+    if output:
+        pipeline.steps = output.apply(pipeline.steps)
+    try:
+        pipeline.run()
+        if output:
+            output.finish()
+    finally:
+        if output:
+            output.close()
+
+    REPORT.write(os.path.join(dst, 'run_report.json'), command='terraflow',
+                 wall=time.time() - t0)
+
+    elapsed = time_diff(t0, time.time())
     click.echo(click.style('Finished in:', fg='green'))
     click.echo(click.style(elapsed, fg='green'))
@@ -0,0 +1,144 @@
+from __future__ import print_function
+
+import os
+import time
+
+import click
+
+from wsi_grasstools.manage import initialize, setup_env, time_diff
+gisbase, gisdbdir = setup_env()
+
+import grass.script as g
+
+from wsi_grasstools import incremental
+from wsi_grasstools.cli.hydrolines import (drainage_export_steps, drainage_steps, extract_steps,
+                                           network_steps, stream_export_steps)
+from wsi_grasstools.gdalio import load_step
+from wsi_grasstools.instrument import REPORT, parse_command
+from wsi_grasstools.pipeline import Pipeline, Step
+from wsi_grasstools.routing import ENGINES, region_cells
+
+
+@click.command(options_metavar='<options>')
+@click.argument('previous_dem', nargs=1, type=click.Path(exists=True))
+@click.argument('previous', nargs=1, type=click.Path(exists=True, file_okay=False))
+@click.argument('dst', nargs=1, type=click.Path(exists=True))
+@click.option('--dem', nargs=1, default=None, type=click.Path(exists=True),
+              help="New DEM replacing the previous one")
+@click.option('--tile', 'tiles', multiple=True, type=click.Path(exists=True),
+              help="Changed DEM tile patched over the previous DEM, may be repeated")
+@click.option('--tolerance', nargs=1, default=0.0,
+              help="Elevation change below which a cell is unchanged")
+@click.option('--mod', nargs=1, default=10, help="r.hydrodem mod parameter")
+@click.option('--size', nargs=1, default=40, help="r.hydrodem size parameter")
+@click.option('--threshold', nargs=1, default=5000,
+              help="r.watershed threshold parameter")
+@click.option('--d8cut', nargs=1, default=1000000,
+              help="r.stream.extract d8cut parameter")
+@click.option('--mexp', nargs=1, default=1.2,
+              help="r.stream.extract mexp parameter")
+@click.option('--stream-length', nargs=1, default=100,
+              help="r.stream.extract stream_length parameter")
+@click.option('--flow-engine', nargs=1, default='auto', type=click.Choice(ENGINES),
+              help="Route flow with r.watershed, r.terraflow or by DEM size and memory")
+@click.option('--hand-engine', nargs=1, default='grass', type=click.Choice(['native', 'grass']),
+              help="Height above streams by pointer jumping or with r.stream.distance")
+@click.option('--overviews', default=False, is_flag=True,
+              help="Add internal overviews to the exported rasters")
+@click.option('--cog', default=False, is_flag=True,
+              help="Export rasters as Cloud Optimized GeoTIFF")
+@click.option('--vector-format', nargs=1, default='shp', type=click.Choice(['shp', 'gpkg', 'fgb']),
+              help="Vector format of the previous and the updated products")
+@click.pass_context
+def hydrolines_update(ctx, previous_dem, previous, dst, dem, tiles, tolerance, mod, size, threshold,
+                      d8cut, mexp, stream_length, flow_engine, hand_engine, overviews, cog,
+                      vector_format):
+    """Update the products of a hydrolines run where the DEM changed
+
+    Parameters:
+        previous_dem : DEM of the previous run
+        previous : output directory of the previous run
+        dem : new DEM
+        tiles : changed tiles of the DEM
+        tolerance : elevation change taken as no change
+        mod, size, threshold, d8cut, mexp, stream_length : as in the previous run
+        flow_engine : auto, watershed or terraflow
+        hand_engine : native or grass r.stream.distance
+        overviews : add overviews to the exported rasters
+        cog : export the rasters as COG
+        vector_format : shp, gpkg or fgb
+    """
+    if bool(dem) == bool(tiles):
+        raise click.UsageError('Give either --dem or --tile')
+
+    t0 = time.time()
+
+    location, mapset = initialize(gisbase, ctx.obj['dbdir'],
+                                  location=ctx.obj['location'],
+                                  mapset=ctx.obj['mapset'],
+                                  infile=previous_dem,
+                                  epsg=ctx.obj['epsg'],
+                                  pool=ctx.obj['pool'],
+                                  scratch=ctx.obj['scratch'])
+
+    click.echo(click.style('Loading DEMs and previous products', fg='green'))
+    pipeline = Pipeline(keep=['dem'], **ctx.obj['pipeline'])
+    pipeline.add(load_step(previous_dem, 'prev_dem'))
+    if dem:
+        pipeline.add(load_step(dem, 'dem'))
+    else:
+        names = ['tile_{}'.format(i) for i in range(len(tiles))]
+        for tile, name in zip(tiles, names):
+            pipeline.add(load_step(tile, name))
+        pipeline.add(Step('r.patch', inputs=names + ['prev_dem'], outputs=['dem'],
+                          input=','.join(names + ['prev_dem']),
+                          output='dem'))
+    pipeline.extend(incremental.previous_steps(previous, vector_format))
+    pipeline.add(incremental.changed_step('dem', 'prev_dem', 'update_changed', tolerance))
+    pipeline.run()
+
+    if not parse_command('r.univar', flags='g', map='update_changed').get('n'):
+        click.echo(click.style('No cells changed', fg='green'))
+        return
+
+    def recompute():
+        steps = (drainage_steps('dem', mod, size, threshold, ctx.obj['memory'], flow_engine) +
+                 extract_steps('dem', threshold, d8cut, mexp, stream_length, hand_engine))
+        # the cache keys do not cover the MASK
+        Pipeline(steps, keep=[name for name, _ in incremental.MERGED_MAPS],
+                 **dict(ctx.obj['pipeline'], cache=None)).run()
+
+    click.echo(click.style('Recomputing changed basins', fg='green'))
+    cells, contained = incremental.update('update_changed', 'update_zone', recompute)
+    click.echo(click.style('Recomputed {} of {} cells'.format(cells, region_cells()), fg='green'))
+    if not contained:
+        click.echo(click.style('Flow still leaves the recomputed basins after {} rounds; the '
+                               'products downstream of them are those of the previous run'.format(
+                                   incremental.MAX_ROUNDS), fg='red'))
+
+    click.echo(click.style('Merging with the previous products', fg='green'))
+    incremental.merge('update_zone', incremental.id_offsets())
+
+    pipeline = Pipeline(**ctx.obj['pipeline'])
+    pipeline.add(Step('r.thin', inputs=['hydem_streams'], outputs=['hydem_streams_thin'],
+                      input='hydem_streams',
+                      output='hydem_streams_thin'))
+
+    # the stream ids become the categories, as previous_steps reads them
+    pipeline.add(Step('r.to.vect', inputs=['hydem_streams_thin'], outputs=['hydem_streams_vec'],
+                      flags='v',
+                      input='hydem_streams_thin',
+                      output='hydem_streams_vec',
+                      type='line'))
+
+    pipeline.extend(network_steps())
+    pipeline.extend(drainage_export_steps(dst, overviews=overviews, cog=cog))
+    pipeline.extend(stream_export_steps(dst, vector_format, overviews=overviews, cog=cog))
+    pipeline.run()
+
+    REPORT.write(os.path.join(dst, 'run_report.json'), command='hydrolines-update',
+                 wall=time.time() - t0)
+
+    elapsed = time_diff(t0, time.time())
+    click.echo(click.style('Finished in:', fg='green'))
+    click.echo(click.style(elapsed, fg='green'))
@@ -0,0 +1,30 @@
+from __future__ import print_function
+
+import click
+
+from wsi_grasstools.manage import setup_env
+gisbase, gisdbdir = setup_env()
+
+from wsi_grasstools import pool
+from wsi_grasstools.manage_session import initialize
+
+
+@click.command('warm-pool', options_metavar='<options>')
+@click.argument('infile', nargs=1, required=False, type=click.Path(exists=True))
+@click.option('--size', nargs=1, default=4, help="Number of mapsets to prepare")
+@click.pass_context
+def warm_pool(ctx, infile, size):
+    """Prepare a pool location and mapsets ahead of --pool runs
+
+    The location takes the CRS of --epsg, or else of infile.
+
+    Parameters:
+        size : number of mapsets to prepare
+    """
+    if not (infile or ctx.obj['epsg']):
+        raise click.UsageError('Give an infile or --epsg')
+
+    # pool locations live in the persistent database, never in --scratch
+    dbdir = initialize(ctx.parent.params['dbdir'])[0]
+    location = pool.warm(gisbase, dbdir, size, infile=infile, epsg=ctx.obj['epsg'])
+    click.echo(click.style('Pool location {} has {} mapsets ready'.format(location, size), fg='green'))
@@ -0,0 +1,96 @@
+"""Labeling and measurement of filled depressions
+
+The depth of every cell is the difference between the filled and the
+original surface. Cells with a positive depth are grouped into sinks of
+connected cells, diagonals included as with r.clump -d, and the cell count,
+area, maximum depth and volume of every sink are gathered from the same
+arrays, in place of the separate difference, clump, zonal statistics and
+selection passes over the rasters.
+"""
+
+from __future__ import print_function
+
+import csv
+
+import numpy as np
+
+from wsi_grasstools.pipeline import Step
+
+
+# columns of the sink attribute table
+FIELDS = ['cat', 'cells', 'area', 'max_depth', 'volume', 'masked']
+
+
+def label_sinks(dem, filled):
+    """Label the sinks of a filled surface and measure them
+
+    Parameters:
+        dem (ndarray) : 2D elevations, NaN where null
+        filled (ndarray) : dem with its depressions filled
+
+    Returns:
+        labels (ndarray) : sink number of each cell from 1, 0 outside sinks
+        depth (ndarray) : depth of each cell
+        stats (dict) : cells, max_depth and summed depth arrays indexed by
+            sink number, with the unused entry 0
+    """
+    from scipy import ndimage
+
+    depth = filled - dem
+    depth[np.isnan(depth)] = 0
+    labels, count = ndimage.label(depth > 0, structure=np.ones((3, 3)))
+
+    index = np.arange(count + 1)
+    stats = {'cells': np.bincount(labels.ravel(), minlength=count + 1),
+             'depth': np.bincount(labels.ravel(), weights=depth.ravel(), minlength=count + 1),
+             'max_depth': np.asarray(ndimage.maximum(depth, labels, index))}
+
+    return labels, depth, stats
+
+
+def sink_rasters(dem, filled, target, mask, min_depth, mask_depth, table):
+    """Write the sinks deeper than min_depth and mask_depth and their table
+
+    target and mask carry the sink number of the sinks deeper than
+    min_depth and mask_depth. The table lists the sinks of target, with area
+    and volume in map units, and whether they are also masked.
+    """
+    import grass.script as g
+    from grass.script import array as garray
+
+    dem_array = garray.array(dtype=np.float64)
+    dem_array.read(dem, null=np.nan)
+    filled_array = garray.array(dtype=np.float64)
+    filled_array.read(filled, null=np.nan)
+
+    labels, depth, stats = label_sinks(np.asarray(dem_array), np.asarray(filled_array))
+    max_depth = stats['max_depth']
+    deep = max_depth > min_depth
+    very_deep = max_depth > mask_depth
+    deep[0] = very_deep[0] = False
+
+    out = garray.array(dtype=np.int32)
+    out[...] = np.where(deep[labels], labels, 0)
+    out.write(target, null=0, overwrite=True)
+    out[...] = np.where(very_deep[labels], labels, 0)
+    out.write(mask, null=0, overwrite=True)
+
+    region = g.region()
+    cell_area = region['nsres'] * region['ewres']
+    with open(table, 'w') as f:
+        writer = csv.writer(f)
+        writer.writerow(FIELDS)
+        for cat in np.flatnonzero(deep):
+            writer.writerow([cat, stats['cells'][cat],
+                             stats['cells'][cat] * cell_area,
+                             max_depth[cat],
+                             stats['depth'][cat] * cell_area,
+                             int(very_deep[cat])])
+
+
+def sink_step(dem, filled, target, mask, min_depth, mask_depth, table, message=None):
+    """Step writing the target and mask sinks of filled and their table"""
+    return Step(sink_rasters, inputs=[dem, filled], outputs=[target, mask],
+                targets=[table], message=message,
+                dem=dem, filled=filled, target=target, mask=mask,
+                min_depth=min_depth, mask_depth=mask_depth, table=table)
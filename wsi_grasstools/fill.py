@@ -0,0 +1,123 @@
+"""Depression filling by priority-flood
+
+Cells on the edge of the data, next to the region border or a null cell,
+drain freely and seed a priority queue. The lowest open cell is taken from
+the queue and its unvisited neighbours are raised to at least its elevation.
+Neighbours raised this way lie in a depression and are visited from a plain
+queue before the priority queue is used again, which keeps most cells out of
+the heap. Every depression is filled in a single O(n log n) pass.
+
+The pass is a Python loop over the cells, taking about 3 s and 100 MB per
+million cells, so the native engine is kept to regions of up to
+NATIVE_CELLS cells and larger regions are filled with r.fill.dir.
+
+References:
+    Barnes, R., Lehman, C., Mulla, D., 2014. Priority-flood: An optimal
+    depression-filling and watershed-labeling algorithm for digital elevation
+    models. Computers & Geosciences 62, 117-127.
+"""
+
+from __future__ import print_function
+
+import heapq
+from collections import deque
+
+import numpy as np
+
+from wsi_grasstools.pipeline import Step
+
+
+# cells beyond which the native engine gives way to r.fill.dir
+NATIVE_CELLS = 10 ** 7
+
+
+def choose_engine(engine='native', cells=None):
+    """Resolve native to grass when the current region is too large for it"""
+    if engine != 'native':
+        return engine
+
+    if cells is None:
+        from wsi_grasstools.routing import region_cells
+        cells = region_cells()
+
+    return 'native' if cells <= NATIVE_CELLS else 'grass'
+
+
+def priority_flood(dem):
+    """Fill every depression of an elevation array
+
+    Parameters:
+        dem (ndarray) : 2D elevations, NaN where null
+
+    Returns:
+        filled (ndarray) : float64 elevations with no depression, NaN where null
+    """
+    rows, cols = dem.shape
+    width = cols + 2
+
+    # a ring of null cells around the array stands in for the region border
+    padded = np.full((rows + 2, width), np.nan)
+    padded[1:-1, 1:-1] = dem
+    null = np.isnan(padded)
+
+    edge = np.zeros_like(null)
+    for dr in (-1, 0, 1):
+        for dc in (-1, 0, 1):
+            edge[1:-1, 1:-1] |= null[1 + dr:rows + 1 + dr, 1 + dc:cols + 1 + dc]
+    edge &= ~null
+
+    z = padded.ravel().tolist()
+    closed = bytearray(null.ravel().astype(np.uint8).tobytes())
+    offsets = [dr * width + dc for dr in (-1, 0, 1) for dc in (-1, 0, 1) if dr or dc]
+
+    heap = []
+    for i in np.flatnonzero(edge).tolist():
+        closed[i] = 1
+        heap.append((z[i], i))
+    heapq.heapify(heap)
+
+    pit = deque()
+    while heap or pit:
+        if pit:
+            i = pit.popleft()
+        else:
+            i = heapq.heappop(heap)[1]
+        zi = z[i]
+        for offset in offsets:
+            n = i + offset
+            if closed[n]:
+                continue
+            closed[n] = 1
+            if z[n] <= zi:
+                z[n] = zi
+                pit.append(n)
+            else:
+                heapq.heappush(heap, (z[n], n))
+
+    return np.array(z).reshape(rows + 2, width)[1:-1, 1:-1]
+
+
+def fill_raster(input, output):
+    """Fill the depressions of a raster with priority_flood
+
+    The raster is read and written over the current region.
+    """
+    from grass.script import array as garray
+
+    dem = garray.array(dtype=np.float64)
+    dem.read(input, null=np.nan)
+    filled = priority_flood(np.asarray(dem))
+
+    # r.in.bin cannot match NaN, so nulls are written as a value below the data
+    null = np.isnan(filled)
+    nodata = np.nanmin(filled) - 1 if not null.all() else 0
+    filled[null] = nodata
+
+    dem[...] = filled
+    dem.write(output, null=nodata, overwrite=True)
+
+
+def fill_step(dem, output, message=None):
+    """Step filling the depressions of dem into output"""
+    return Step(fill_raster, inputs=[dem], outputs=[output], message=message,
+                input=dem, output=output)
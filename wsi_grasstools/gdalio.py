@@ -0,0 +1,320 @@
+"""Move rasters between GDAL files and GRASS
+
+Inputs can be linked in place with r.external instead of imported with
+r.in.gdal. Products are exported by export_raster in the smallest GDAL type
+that holds their values exactly, as tiled and compressed GeoTIFF or COG, or
+written by GDAL from the module computing them, through r.external.out,
+instead of computed natively and then copied out. Vector products are
+written as Shapefiles, FlatGeobuf files or layers of one GeoPackage.
+"""
+
+from __future__ import print_function
+
+import os
+import shutil
+import tempfile
+
+import grass.script as g
+from grass.exceptions import CalledModuleError
+
+from wsi_grasstools.instrument import run_command
+from wsi_grasstools.pipeline import Step
+
+
+# GDAL integer types in order of size, with the values each can hold; Int8
+# is left out since r.out.gdal checks data and nodata against the Byte range
+INTEGER_TYPES = [('Byte', 0, 255),
+                 ('Int16', -32768, 32767),
+                 ('UInt16', 0, 65535),
+                 ('Int32', -2147483648, 2147483647)]
+
+# v.out.ogr format and file extension of each vector format choice
+VECTOR_FORMATS = {'shp': ('ESRI_Shapefile', '.shp'),
+                  'gpkg': ('GPKG', '.gpkg'),
+                  'fgb': ('FlatGeobuf', '.fgb')}
+
+# overviews are added until the smaller raster side fits in one block
+BLOCK_SIZE = 256
+
+
+def raster_type(info, float32=False):
+    """Smallest GDAL type writing the values of a raster exactly
+
+    Integer rasters get the smallest integer type whose range also holds a
+    nodata value outside the data: the largest value of an unsigned type or
+    the smallest value of a signed type. Floating point rasters get their own
+    precision and NaN as nodata.
+
+    Parameters:
+        info (dict) : raster info as returned by grass.script.raster_info()
+        float32 (bool) : write DCELL rasters as Float32
+
+    Returns:
+        type (str) : GDAL type name
+        nodata (int) : nodata value, None for floating point types
+    """
+    if info['datatype'] == 'FCELL' or (info['datatype'] == 'DCELL' and float32):
+        return 'Float32', None
+    if info['datatype'] == 'DCELL':
+        return 'Float64', None
+
+    low = int(info['min']) if info['min'] is not None else 0
+    high = int(info['max']) if info['max'] is not None else 0
+    for name, type_min, type_max in INTEGER_TYPES:
+        if type_min == 0 and type_min <= low and high < type_max:
+            return name, type_max
+        if type_min < 0 and type_min < low and high <= type_max:
+            return name, type_min
+
+    return 'Float64', None
+
+
+def _overview_levels(info):
+    levels = []
+    size = min(int(info['rows']), int(info['cols']))
+    while size > BLOCK_SIZE:
+        size //= 2
+        levels.append(2 ** (len(levels) + 1))
+
+    return levels
+
+
+def export_raster(input, output, float32=False, overviews=False, cog=False,
+                  compress='LZW'):
+    """Write a raster in the smallest exact type as tiled, compressed GeoTIFF
+
+    Integer rasters use horizontal differencing and floating point rasters
+    floating point prediction ahead of compression. Overviews are internal,
+    nearest neighbour for integer rasters and averaged for floating point
+    rasters. A COG always has overviews and no world file.
+
+    Parameters:
+        input (str) : raster map
+        output (str) : GeoTIFF path
+        float32 (bool) : write DCELL rasters as Float32
+        overviews (bool) : add overviews
+        cog (bool) : write a Cloud Optimized GeoTIFF with the COG driver
+        compress (str) : GDAL compression
+    """
+    info = g.raster_info(input)
+    type, nodata = raster_type(info, float32)
+    floating = type.startswith('Float')
+    resampling = 'AVERAGE' if floating else 'NEAREST'
+
+    if cog:
+        options = ['COMPRESS={}'.format(compress), 'PREDICTOR=YES',
+                   'BLOCKSIZE={}'.format(BLOCK_SIZE),
+                   'OVERVIEW_RESAMPLING={}'.format(resampling), 'BIGTIFF=IF_SAFER']
+    else:
+        options = ['TILED=YES', 'COMPRESS={}'.format(compress),
+                   'PREDICTOR={}'.format(3 if floating else 2),
+                   'BIGTIFF=IF_SAFER', 'TFW=YES']
+
+    params = {}
+    if nodata is not None:
+        params['nodata'] = nodata
+    run_command('r.out.gdal', overwrite=True, quiet=True,
+                input=input,
+                output=output,
+                type=type,
+                format='COG' if cog else 'GTiff',
+                createopt=','.join(options),
+                **params)
+
+    levels = _overview_levels(info)
+    if overviews and levels and not cog:
+        from osgeo import gdal
+
+        gdal.SetThreadLocalConfigOption('COMPRESS_OVERVIEW', compress)
+        ds = gdal.Open(output, gdal.GA_Update)
+        ds.BuildOverviews(resampling, levels)
+        ds = None
+
+
+def export_step(input, output, message=None, **options):
+    """Step exporting a raster with export_raster
+
+    Parameters:
+        options : export_raster float32, overviews, cog and compress
+    """
+    return Step(export_raster, inputs=[input], targets=[output], message=message,
+                input=input, output=output, **options)
+
+
+def link_raster(input, output):
+    """Link a raster with r.external, importing it if GDAL cannot link it"""
+    try:
+        run_command('r.external', overwrite=True, input=input, output=output)
+    except CalledModuleError:
+        run_command('r.in.gdal', overwrite=True, input=input, output=output)
+
+
+def load_step(infile, output, link=False):
+    """Step importing or linking a raster file as output"""
+    if link:
+        return Step(link_raster, outputs=[output], sources=[infile],
+                    input=infile, output=output)
+
+    return Step('r.in.gdal', outputs=[output], sources=[infile],
+                input=infile, output=output)
+
+
+def write_geopackage(layers, output):
+    """Write vector maps as the layers of a new GeoPackage
+
+    Layers are written one after the other since a GeoPackage takes one
+    writer at a time. Syncing is left to the operating system, so v.out.ogr
+    commits its feature batches without waiting on the disk.
+
+    Parameters:
+        layers (list) : (map, layer name, feature type) triples
+        output (str) : GeoPackage path
+    """
+    if os.path.exists(output):
+        os.remove(output)
+
+    env = dict(os.environ, OGR_SQLITE_SYNCHRONOUS='OFF')
+    for i, (input, layer, type) in enumerate(layers):
+        run_command('v.out.ogr', overwrite=True, env=env,
+                    flags='u' if i else '',
+                    input=input,
+                    output=output,
+                    output_layer=layer,
+                    format='GPKG',
+                    lco='SPATIAL_INDEX=YES',
+                    type=type)
+
+
+def vector_export_steps(layers, dst, name, vector_format='shp', message=None):
+    """Steps writing vector maps to dst
+
+    Shapefile and FlatGeobuf layers are written to their own files by
+    parallel steps; FlatGeobuf files carry a spatial index. GeoPackage layers
+    are all written to name.gpkg by a single step.
+
+    Parameters:
+        layers (list) : (map, layer name, feature type) triples
+        dst (str) : output directory
+        name (str) : GeoPackage file name without extension
+        vector_format (str) : shp, gpkg or fgb
+        message (str) : progress message of the first step
+    """
+    format, ext = VECTOR_FORMATS[vector_format]
+    if vector_format == 'gpkg':
+        output = os.path.join(dst, name + ext)
+        return [Step(write_geopackage, inputs=[input for input, _, _ in layers],
+                     targets=[output], message=message,
+                     layers=[list(layer) for layer in layers],
+                     output=output)]
+
+    params = {'lco': 'SPATIAL_INDEX=YES'} if vector_format == 'fgb' else {}
+    steps = []
+    for input, layer, type in layers:
+        output = os.path.join(dst, layer + ext)
+        steps.append(Step('v.out.ogr', inputs=[input], targets=[output],
+                          message=message if not steps else None,
+                          input=input,
+                          output=output,
+                          format=format,
+                          type=type,
+                          **params))
+
+    return steps
+
+
+class ExternalOutput(object):
+    """Write exported rasters from the modules that compute them
+
+    Steps whose every output is exported by an export step run in a
+    companion mapset set up with r.external.out, so GDAL writes their outputs
+    into the export directory and the export steps are dropped. Each
+    mapset is in the search path of the other, so the steps still read their
+    inputs and later steps still read the products. Written rasters take the
+    type of the GRASS map rather than the smallest type export_raster picks.
+    Once the pipeline has run, finish renames the written files and close
+    removes the companion mapset, whose links the renames break.
+
+    Parameters:
+        directory (str) : export directory
+        options (str) : GDAL creation options
+    """
+
+    def __init__(self, directory, options='TILED=YES,COMPRESS=LZW,BIGTIFF=IF_SAFER,TFW=YES'):
+        self.directory = os.path.abspath(directory)
+        self.options = options
+        self.renames = {}
+        self.env = None
+        self.mapset = None
+        self.gisrc = None
+
+    def setup(self):
+        """Create the companion mapset and direct its new rasters to GDAL"""
+        genv = g.gisenv()
+        mapset = genv['MAPSET']
+        location_path = os.path.join(genv['GISDBASE'], genv['LOCATION_NAME'])
+        out = '{}_out'.format(mapset)
+        if not os.path.isdir(os.path.join(location_path, out)):
+            os.mkdir(os.path.join(location_path, out))
+        shutil.copy(os.path.join(location_path, mapset, 'WIND'),
+                    os.path.join(location_path, out, 'WIND'))
+
+        fd, gisrc = tempfile.mkstemp(suffix='.gisrc')
+        with os.fdopen(fd, 'w') as f:
+            f.write('GISDBASE: {}\nLOCATION_NAME: {}\nMAPSET: {}\nGUI: text\n'.format(
+                genv['GISDBASE'], genv['LOCATION_NAME'], out))
+        self.mapset = os.path.join(location_path, out)
+        self.gisrc = gisrc
+        self.env = dict(os.environ, GISRC=gisrc)
+
+        run_command('r.external.out', env=self.env,
+                    directory=self.directory,
+                    format='GTiff',
+                    extension='tif',
+                    options=self.options)
+        run_command('g.mapsets', operation='add', mapset=mapset, env=self.env)
+        run_command('g.mapsets', operation='add', mapset=out)
+
+    def apply(self, steps):
+        """Route the steps computing exported rasters through GDAL
+
+        Returns:
+            steps (list) : the steps without the exports made redundant
+        """
+        exports = dict((step.params['input'], step) for step in steps
+                       if step.module is export_raster)
+        routed = [step for step in steps
+                  if not callable(step.module) and step.outputs
+                  and all(name in exports for name in step.outputs)]
+        if not routed:
+            return steps
+
+        self.setup()
+        dropped = []
+        for step in routed:
+            step.env = self.env
+            for name in step.outputs:
+                target = exports[name].params['output']
+                step.targets.append(target)
+                self.renames[name] = target
+                dropped.append(exports[name])
+
+        return [step for step in steps if step not in dropped]
+
+    def finish(self):
+        """Give the written rasters the names of the exports they replace"""
+        for name, target in self.renames.items():
+            base = os.path.splitext(target)[0]
+            for ext in ['.tif', '.tfw', '.tif.aux.xml']:
+                written = os.path.join(self.directory, name + ext)
+                if os.path.exists(written) and written != os.path.abspath(base + ext):
+                    os.rename(written, base + ext)
+
+    def close(self):
+        """Remove the companion mapset and its GISRC, whether or not the run succeeded"""
+        if self.mapset is None:
+            return
+
+        run_command('g.mapsets', operation='remove', mapset=os.path.basename(self.mapset))
+        shutil.rmtree(self.mapset, ignore_errors=True)
+        os.remove(self.gisrc)
+        self.mapset = self.gisrc = self.env = None
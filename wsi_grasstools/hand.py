@@ -0,0 +1,145 @@
+"""Height above nearest drainage from drainage and stream arrays
+
+Every cell points to the next cell down its drainage and every stream cell
+to itself. Pointer jumping replaces each pointer by the pointer of its
+target until all of them rest on a stream cell, which takes about log2 of
+the longest flow path in whole-array numpy passes. Cells draining out of
+the region or into a null cell before reaching a stream have no height.
+"""
+
+from __future__ import print_function, division
+
+import numpy as np
+
+from wsi_grasstools.pipeline import Step
+from wsi_grasstools.routing import DIRECTIONS
+
+
+def drainage_targets(drainage, streams):
+    """Flat index of the stream cell each cell drains to, -1 if none
+
+    Parameters:
+        drainage (ndarray) : 2D r.watershed drainage codes, 0 where null
+        streams (ndarray) : 2D boolean stream cells
+    """
+    rows, cols = drainage.shape
+    code = drainage.reshape(-1)
+    index = np.arange(rows * cols, dtype=np.int64)
+
+    target = np.full(rows * cols, -1, dtype=np.int64)
+    row, col = np.divmod(index, cols)
+    for _, drain, (dr, dc) in DIRECTIONS:
+        cells = code == drain
+        r, c = row[cells] + dr, col[cells] + dc
+        inside = (r >= 0) & (r < rows) & (c >= 0) & (c < cols)
+        target[index[cells][inside]] = (r * cols + c)[inside]
+
+    stream = streams.reshape(-1)
+    target[stream] = index[stream]
+
+    for _ in range(int(np.ceil(np.log2(max(rows * cols, 2)))) + 1):
+        valid = target >= 0
+        jumped = np.where(valid, target[np.where(valid, target, 0)], -1)
+        if np.array_equal(jumped, target):
+            break
+        target = jumped
+
+    # pointers still short of a stream are caught in a loop
+    valid = target >= 0
+    target[valid & ~stream[np.where(valid, target, 0)]] = -1
+
+    return target
+
+
+def height_above_drainage(elevation, drainage, streams):
+    """Height of each cell above the stream cell it drains to
+
+    Parameters:
+        elevation (ndarray) : 2D elevations, NaN where null
+        drainage (ndarray) : 2D r.watershed drainage codes, 0 where null
+        streams (ndarray) : 2D boolean stream cells
+
+    Returns:
+        hand (ndarray) : heights, NaN where no stream is reached
+    """
+    target = drainage_targets(drainage, streams)
+    flat = elevation.reshape(-1)
+    hand = np.where(target >= 0, flat - flat[np.maximum(target, 0)], np.nan)
+
+    return hand.reshape(elevation.shape)
+
+
+def hand_raster(elevation, direction, stream_rast, output):
+    """Write the height above the streams of an elevation raster"""
+    from grass.script import array as garray
+
+    dem = garray.array(dtype=np.float64)
+    dem.read(elevation, null=np.nan)
+    drainage = garray.array(dtype=np.int32)
+    drainage.read(direction, null=0)
+    streams = garray.array(dtype=np.int32)
+    streams.read(stream_rast, null=0)
+
+    hand = height_above_drainage(np.asarray(dem), np.asarray(drainage), np.asarray(streams) != 0)
+
+    # r.in.bin cannot match NaN, so nulls are written as a value below the data
+    null = np.isnan(hand)
+    nodata = np.nanmin(hand) - 1 if not null.all() else 0
+    hand[null] = nodata
+    dem[...] = hand
+    dem.write(output, null=nodata, overwrite=True)
+
+
+def check_hand(hand, elevation, direction, stream_rast):
+    """Compare a native height above streams with that of r.stream.distance
+
+    Returns:
+        stats (dict) : r.univar statistics of the absolute difference
+    """
+    import click
+    import grass.script as g
+    from wsi_grasstools.instrument import parse_command, run_command
+
+    reference = '{}_check'.format(hand)
+    run_command('r.stream.distance', overwrite=True,
+                stream_rast=stream_rast,
+                direction=direction,
+                elevation=elevation,
+                method='downstream',
+                difference=reference)
+    run_command('r.mapcalc', overwrite=True,
+                expression='{0}_diff = abs({0} - {1})'.format(hand, reference))
+    stats = parse_command('r.univar', flags='g', map='{}_diff'.format(hand))
+
+    click.echo(click.style('HAND check against r.stream.distance: max {} mean {} over {} cells'.format(
+        stats.get('max'), stats.get('mean'), stats.get('n')), fg='yellow'))
+
+    return stats
+
+
+def hand_steps(elevation, direction, stream_rast, output, engine='grass', check=False):
+    """Steps computing the height above streams with r.stream.distance or natively
+
+    Parameters:
+        engine (str) : native or grass
+        check (bool) : compare a native result with r.stream.distance
+    """
+    if engine == 'grass':
+        return [Step('r.stream.distance', inputs=[stream_rast, direction, elevation],
+                     outputs=[output],
+                     stream_rast=stream_rast,
+                     direction=direction,
+                     elevation=elevation,
+                     method='downstream',
+                     difference=output)]
+
+    steps = [Step(hand_raster, inputs=[elevation, direction, stream_rast], outputs=[output],
+                  elevation=elevation, direction=direction, stream_rast=stream_rast,
+                  output=output)]
+    if check:
+        steps.append(Step(check_hand, inputs=[output, elevation, direction, stream_rast],
+                          outputs=['{}_check'.format(output), '{}_diff'.format(output)],
+                          hand=output, elevation=elevation, direction=direction,
+                          stream_rast=stream_rast))
+
+    return steps
@@ -0,0 +1,209 @@
+"""Incremental update of hydrolines products after part of a DEM changed
+
+The new DEM is compared with the DEM of the previous run. Every outlet
+basin of the previous run touching a changed cell, or a cell next to one,
+is recomputed whole, which covers everything downstream of the changes and
+every cell upstream of them whose drainage or sinks they can alter. The
+recomputation runs under a MASK of those basins. Where the new drainage
+leaves the masked cells into another previous basin, the flow has been
+captured downstream of the changes, so that basin joins the mask and the
+recomputation is repeated. Recomputed maps replace the previous ones inside
+the mask, with their stream and basin ids offset past the previous ids.
+"""
+
+from __future__ import print_function
+
+import os
+
+import numpy as np
+
+import grass.script as g
+
+from wsi_grasstools.gdalio import VECTOR_FORMATS
+from wsi_grasstools.instrument import read_command, run_command, write_command
+from wsi_grasstools.pipeline import Step
+from wsi_grasstools.routing import DIRECTIONS
+
+
+# exported rasters of a previous run and the maps they were written from
+PREVIOUS_RASTERS = [('fac.tif', 'acc'),
+                    ('dirs.tif', 'dirs'),
+                    ('hand.tif', 'above_stream')]
+
+# exported vector layers of a previous run, the raster maps they hold and the
+# column holding the raster values; r.stream.extract writes stream ids as
+# categories, r.to.vect numbers the basin areas and keeps their ids in value
+PREVIOUS_VECTORS = [('stream_ln', 'hydem_streams', None),
+                    ('basin_elem_ply', 'basins_elem', 'value'),
+                    ('basin_last_ply', 'basins_last', 'value')]
+
+# merged maps, with the id map whose offset applies to them; basins hold
+# the ids of the streams they drain to
+MERGED_MAPS = [('acc', None),
+               ('dirs', None),
+               ('dirs_', None),
+               ('above_stream', None),
+               ('hydem_streams', 'hydem_streams'),
+               ('basins_elem', 'hydem_streams'),
+               ('basins_last', 'hydem_streams')]
+
+# times the mask may grow by captured basins
+MAX_ROUNDS = 5
+
+
+def previous_steps(previous, vector_format='shp'):
+    """Steps importing the products of a previous run as prev_ maps
+
+    Streams are rasterized from their vector layers by category and basins
+    by their value column.
+    """
+    steps = []
+    for filename, name in PREVIOUS_RASTERS:
+        path = os.path.join(previous, filename)
+        steps.append(Step('r.in.gdal', outputs=['prev_' + name], sources=[path],
+                          input=path, output='prev_' + name))
+
+    _, ext = VECTOR_FORMATS[vector_format]
+    for layer, name, column in PREVIOUS_VECTORS:
+        if vector_format == 'gpkg':
+            path = os.path.join(previous, 'hydrolines' + ext)
+            params = {'layer': layer}
+        else:
+            path = os.path.join(previous, layer + ext)
+            params = {}
+        values = {'use': 'attr', 'attribute_column': column} if column else {'use': 'cat'}
+        # key keeps the exported categories instead of numbering the features anew
+        steps.append(Step('v.in.ogr', outputs=['prev_{}_vec'.format(name)], sources=[path],
+                          input=path, output='prev_{}_vec'.format(name), key='cat', **params))
+        steps.append(Step('v.to.rast', inputs=['prev_{}_vec'.format(name)],
+                          outputs=['prev_' + name],
+                          input='prev_{}_vec'.format(name),
+                          output='prev_' + name,
+                          **values))
+
+    return steps
+
+
+def changed_step(dem, previous, output, tolerance=0.0):
+    """Step marking the cells whose elevation or null state changed"""
+    expression = ('{2} = if(isnull({0}) != isnull({1}) || '
+                  'abs({0} - {1}) > {3}, 1, null())').format(dem, previous, output, tolerance)
+
+    return Step('r.mapcalc', inputs=[dem, previous], outputs=[output],
+                expression=expression)
+
+
+def select_zone(changed, basins, zone, ids=()):
+    """Write the mask of the changed cells and the basins they touch
+
+    Parameters:
+        changed (str) : raster of the changed cells
+        basins (str) : previous outlet basins
+        zone (str) : output mask, 1 inside and null elsewhere
+        ids (iterable) : further basins to include
+
+    Returns:
+        ids (set) : basins in the mask
+        cells (int) : cells in the mask
+    """
+    from scipy import ndimage
+    from grass.script import array as garray
+
+    cells = garray.array(dtype=np.int32)
+    cells.read(changed, null=0)
+    near = ndimage.binary_dilation(np.asarray(cells) != 0, structure=np.ones((3, 3)))
+
+    basin = garray.array(dtype=np.int32)
+    basin.read(basins, null=0)
+    ids = set(np.unique(np.asarray(basin)[near]).tolist()) | set(ids)
+    ids.discard(0)
+
+    inside = near | np.isin(np.asarray(basin), sorted(ids))
+    cells[...] = inside
+    cells.write(zone, null=0, overwrite=True)
+
+    return ids, int(inside.sum())
+
+
+def spill_expression(drainage, zone, basins, output):
+    """r.mapcalc expression of the previous basin each zone cell drains into
+
+    Only cells draining out of the zone into a cell outside it are set.
+    """
+    target = 'null()'
+    for _, code, (row, col) in DIRECTIONS:
+        target = 'if(abs({0}) == {1} && isnull({2}[{3},{4}]), {5}[{3},{4}], {6})'.format(
+            drainage, code, zone, row, col, basins, target)
+
+    return '{} = if(isnull({}) || {} >= 0, null(), {})'.format(output, zone, drainage, target)
+
+
+def spilled(drainage, zone, basins, output='update_spill'):
+    """Previous basins receiving flow from the zone"""
+    run_command('r.mapcalc', overwrite=True,
+                expression=spill_expression(drainage, zone, basins, output))
+
+    return set(int(float(line)) for line in
+               read_command('r.stats', flags='n', input=output).split())
+
+
+def id_offsets():
+    """Offsets moving the recomputed stream and basin ids past the previous ones"""
+    offsets = {}
+    for _, name, _ in PREVIOUS_VECTORS:
+        value = g.raster_info('prev_' + name)['max']
+        offsets[name] = int(value) if value is not None else 0
+
+    return offsets
+
+
+def merge(zone, offsets):
+    """Replace the previous maps inside the zone by the recomputed maps
+
+    The merged maps take the names of the recomputed ones. dirs_ has no
+    export and takes the previous drainage outside the zone.
+    """
+    expressions = []
+    for name, id_map in MERGED_MAPS:
+        previous = 'prev_dirs' if name == 'dirs_' else 'prev_' + name
+        run_command('g.rename', overwrite=True,
+                    raster='{0},{0}_update'.format(name))
+        value = '{}_update'.format(name)
+        if id_map:
+            value = 'if(isnull({0}), null(), {0} + {1})'.format(value, offsets[id_map])
+        expressions.append('{} = if(isnull({}), {}, {})'.format(name, zone, previous, value))
+
+    write_command('r.mapcalc', overwrite=True, file='-',
+                  stdin='\n'.join(expressions))
+
+
+def update(changed, zone, run, basins='prev_basins_last'):
+    """Recompute the basins touched by the changed cells until no flow escapes
+
+    Parameters:
+        changed (str) : raster of the changed cells
+        zone (str) : mask raster written
+        run (callable) : runs the recomputation under the current MASK
+        basins (str) : previous outlet basins
+
+    Returns:
+        cells (int) : cells recomputed
+        contained (bool) : whether no flow escapes the recomputed basins,
+            false when MAX_ROUNDS was reached first
+    """
+    ids, cells = select_zone(changed, basins, zone)
+    for i in range(MAX_ROUNDS):
+        if i:
+            # the zone only grows before a run, so it stays that of the recomputed maps
+            ids, cells = select_zone(changed, basins, zone, ids | captured)
+        run_command('r.mask', overwrite=True, raster=zone)
+        try:
+            run()
+        finally:
+            run_command('r.mask', flags='r')
+
+        captured = spilled('dirs', zone, basins) - ids
+        if not captured:
+            return cells, True
+
+    return cells, False
@@ -0,0 +1,206 @@
+"""Timing and resource use of the GRASS modules run by a command
+
+Module processes are reaped with os.wait4, which returns the resource use
+of the process and of the children it waited for: user and system CPU time,
+peak resident memory and blocks read and written. Function steps are
+measured on their own thread where the platform allows it. Every call adds
+a record to REPORT, which a command writes as run_report.json next to its
+products, along with totals per module and for all child processes.
+"""
+
+from __future__ import print_function, division
+
+import os
+import sys
+import json
+import time
+import subprocess
+import threading
+
+try:
+    import resource
+except ImportError:
+    resource = None
+
+import grass.script as g
+from grass.exceptions import CalledModuleError
+
+
+# bytes per block counted by ru_inblock and ru_oublock
+BLOCK_BYTES = 512
+
+# ru_maxrss is in kilobytes except on macOS
+RSS_BYTES = 1 if sys.platform == 'darwin' else 1024
+
+
+def usage_record(usage):
+    """Resource use as a dict, empty when it is not known"""
+    if usage is None:
+        return {}
+
+    return {'cpu_user': usage.ru_utime,
+            'cpu_system': usage.ru_stime,
+            'max_rss': usage.ru_maxrss * RSS_BYTES,
+            'read_bytes': usage.ru_inblock * BLOCK_BYTES,
+            'write_bytes': usage.ru_oublock * BLOCK_BYTES}
+
+
+def thread_usage():
+    """Resource use of the calling thread, or None where it is not measured"""
+    if resource is None or not hasattr(resource, 'RUSAGE_THREAD'):
+        return None
+
+    return resource.getrusage(resource.RUSAGE_THREAD)
+
+
+def usage_since(start):
+    """Resource use of the calling thread since start, as a dict"""
+    end = thread_usage()
+    if start is None or end is None:
+        return {}
+
+    record = usage_record(end)
+    for key, value in usage_record(start).items():
+        if key != 'max_rss':
+            record[key] -= value
+
+    return record
+
+
+def _exit_code(status):
+    if os.WIFSIGNALED(status):
+        return -os.WTERMSIG(status)
+
+    return os.WEXITSTATUS(status)
+
+
+def poll(process, wait=False):
+    """Reap a module process once it has exited
+
+    Returns:
+        returncode (int) : exit code, None while the process runs
+        usage (dict) : resource use of the process and its children
+    """
+    if process.returncode is not None or not hasattr(os, 'wait4'):
+        code = process.wait() if wait else process.poll()
+        return code, {}
+
+    pid, status, usage = os.wait4(process.pid, 0 if wait else os.WNOHANG)
+    if pid == 0:
+        return None, {}
+    process.returncode = _exit_code(status)
+
+    return process.returncode, usage_record(usage)
+
+
+class Report(object):
+    """Records of the module calls and steps of a run"""
+
+    def __init__(self):
+        self.records = []
+        self.peak_disk = 0
+        self._pid = os.getpid()
+        self._lock = threading.Lock()
+
+    def _own(self):
+        # a forked worker starts without the records of its parent
+        if self._pid != os.getpid():
+            self._pid = os.getpid()
+            self.records = []
+
+    def add(self, name, start, outputs=(), **usage):
+        record = dict(usage, name=name, start=start, wall=time.time() - start,
+                      outputs=list(outputs))
+        with self._lock:
+            self._own()
+            self.records.append(record)
+
+    def extend(self, records):
+        with self._lock:
+            self._own()
+            self.records.extend(records)
+
+    def pop(self):
+        """Return the records and clear them, to pass them on from a worker"""
+        with self._lock:
+            self._own()
+            records, self.records = self.records, []
+
+        return records
+
+    def modules(self):
+        """Totals of the records by module, the most wall time first"""
+        totals = {}
+        for record in self.records:
+            total = totals.setdefault(record['name'], {'name': record['name'], 'calls': 0})
+            total['calls'] += 1
+            for key in ['wall', 'cpu_user', 'cpu_system', 'read_bytes', 'write_bytes']:
+                total[key] = total.get(key, 0) + record.get(key, 0)
+            total['max_rss'] = max(total.get('max_rss', 0), record.get('max_rss', 0))
+
+        return sorted(totals.values(), key=lambda total: -total['wall'])
+
+    def write(self, path, **info):
+        """Write the report as JSON
+
+        Parameters:
+            info : command, wall time and other facts of the run
+        """
+        children = {}
+        if resource is not None:
+            children = usage_record(resource.getrusage(resource.RUSAGE_CHILDREN))
+
+        with self._lock:
+            steps = sorted(self.records, key=lambda record: record['start'])
+        report = dict(info, children=children, peak_disk=self.peak_disk,
+                      modules=self.modules(), steps=steps)
+        with open(path, 'w') as f:
+            json.dump(report, f, indent=1, sort_keys=True)
+
+
+REPORT = Report()
+
+
+def run_command(module, **kwargs):
+    """grass.script.run_command recording the call in REPORT"""
+    start = time.time()
+    process = g.start_command(module, **kwargs)
+    code, usage = poll(process, wait=True)
+    REPORT.add(module, start, **usage)
+    if code != 0:
+        raise CalledModuleError(module, kwargs, code)
+
+    return code
+
+
+def write_command(module, stdin, **kwargs):
+    """grass.script.write_command recording the call in REPORT"""
+    start = time.time()
+    process = g.start_command(module, stdin=subprocess.PIPE, **kwargs)
+    process.stdin.write(stdin if isinstance(stdin, bytes) else stdin.encode('utf-8'))
+    process.stdin.close()
+    code, usage = poll(process, wait=True)
+    REPORT.add(module, start, **usage)
+    if code != 0:
+        raise CalledModuleError(module, kwargs, code)
+
+    return code
+
+
+def read_command(module, **kwargs):
+    """grass.script.read_command recording the call in REPORT"""
+    start = time.time()
+    process = g.start_command(module, stdout=subprocess.PIPE, **kwargs)
+    output = process.stdout.read()
+    process.stdout.close()
+    code, usage = poll(process, wait=True)
+    REPORT.add(module, start, **usage)
+    if code != 0:
+        raise CalledModuleError(module, kwargs, code)
+
+    return output if isinstance(output, str) else output.decode('utf-8')
+
+
+def parse_command(module, **kwargs):
+    """grass.script.parse_command recording the call in REPORT, key=value output"""
+    return g.parse_key_val(read_command(module, **kwargs), sep='=')
@@ -14,6 +14,9 @@ sys.path.append(os.path.join(os.environ['GISBASE'], 'etc', 'python'))
 import grass.script as g
 import grass.script.setup as gsetup
 
+from wsi_grasstools.instrument import run_command
+from wsi_grasstools.resources import check_disk
+
 
 def time_diff(t0, t1):
     m, s = divmod(t1 - t0, 60)
@@ -44,9 +47,8 @@ def setup_env():
     return gisbase, gisdbdir
 
 
-def initialize(gisbase, gisdbdir,
-               location=None, mapset=None,
-               infile=None, epsg=None):
+def create_location(gisbase, location_path, infile=None, epsg=None):
+    """Create a location from an EPSG code or the projection of infile"""
 
     # determine the platform-specific startup script
     if sys.platform.startswith('linux'):
@@ -56,13 +58,6 @@ def initialize(gisbase, gisdbdir,
     else:
         OSError('Platform not configured.')
 
-    if location is None:
-        # string_length = 16
-        # location = binascii.hexlify(os.urandom(string_length))
-        location = uuid.uuid4().hex
-
-    location_path = os.path.join(gisdbdir, location)
-
     if epsg:
         startcmd = '"{0}" -c epsg:{1} -e {2}'.format(executable, epsg, location_path)
     else:
@@ -78,14 +73,42 @@ def initialize(gisbase, gisdbdir,
     else:
         print('Created location %s' % location_path)
 
-    gsetup.init(gisbase, gisdbdir, location, 'PERMANENT')
+
+def initialize(gisbase, gisdbdir,
+               location=None, mapset=None,
+               infile=None, epsg=None, pool=False, scratch=False):
+
+    if scratch and infile:
+        # a scratch database is small and fast, so fail before filling it
+        check_disk(gisdbdir, infile)
+
+    if pool:
+        # a pooled mapset of a ready location, with the region set to infile
+        from wsi_grasstools import pool as location_pool
+        location, mapset = location_pool.acquire(gisbase, gisdbdir, infile=infile, epsg=epsg)
+        if infile:
+            try:
+                run_command('g.region', **location_pool.raster_region(infile))
+            except Exception:
+                location_pool.release_all()
+                raise
+        return location, mapset
+
+    if location is None:
+        # string_length = 16
+        # location = binascii.hexlify(os.urandom(string_length))
+        location = uuid.uuid4().hex
+
+    location_path = os.path.join(gisdbdir, location)
+    if not os.path.isdir(location_path):
+        create_location(gisbase, location_path, infile=infile, epsg=epsg)
 
     if mapset is None:
         mapset = 'PERMANENT'
+        gsetup.init(gisbase, gisdbdir, location, mapset)
     else:
         print('create mapset...')
-        g.run_command('g.mapset', flags='c', mapset=mapset, location=location, dbase=gisdbdir)
-        gsetup.init(gisbase, gisdbdir, location, mapset)
+        init_mapset(gisbase, gisdbdir, location, mapset)
 
     #vg.run_command('g.mapsets', mapset=mapset, operation='set')
     # os.environ['MAPSET'] = mapset
@@ -93,6 +116,22 @@ def initialize(gisbase, gisdbdir,
     return location, mapset
 
 
+def init_mapset(gisbase, gisdbdir, location, mapset):
+    """Create a mapset in an existing location and make it current
+
+    Each call writes its own GISRC, so worker processes can hold separate
+    mapsets of the same location at the same time.
+    """
+    gsetup.init(gisbase, gisdbdir, location, 'PERMANENT')
+    if mapset != 'PERMANENT':
+        run_command('g.mapset', flags='c', mapset=mapset, location=location, dbase=gisdbdir)
+        gsetup.init(gisbase, gisdbdir, location, mapset)
+
+    return mapset
+
+
 def clean(location_path):
+    if not os.path.isdir(location_path):
+        return
     print('Removing location {}'.format(location_path))
-    shutil.rmtree(location_path)
+    shutil.rmtree(location_path, ignore_errors=True)
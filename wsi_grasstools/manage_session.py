@@ -39,5 +39,7 @@ def initialize(gisdbdir=None, location=None, mapset=None):
 
 
 def clean(location_path):
+    if not os.path.isdir(location_path):
+        return
     print('Removing location {}'.format(location_path))
-    shutil.rmtree(location_path)
+    shutil.rmtree(location_path, ignore_errors=True)
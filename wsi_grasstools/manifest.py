@@ -0,0 +1,82 @@
+"""Run manifest recording the completed steps of a pipeline
+
+A checkpointed pipeline writes a record of every step it completes, with
+its module, parameters, outputs and targets, to run_manifest.json in the
+mapset, and notes the maps it removes once no step reads them. A pipeline
+resumed in the same mapset skips the recorded steps whose outputs still
+exist or were removed after use, and runs the rest.
+"""
+
+from __future__ import print_function
+
+import os
+import json
+import time
+import hashlib
+
+import grass.script as g
+
+
+MANIFEST_NAME = 'run_manifest.json'
+
+
+def step_id(step):
+    """Identify a step by its module, parameters, outputs and targets"""
+    digest = hashlib.sha1()
+    digest.update(step.name.encode('utf-8'))
+    digest.update(json.dumps([step.params, step.outputs, step.targets],
+                             sort_keys=True).encode('utf-8'))
+
+    return digest.hexdigest()
+
+
+def map_exists(name):
+    """Whether a raster or vector map of the name is found"""
+    return bool(g.find_file(name, element='cell')['file'] or
+                g.find_file(name, element='vector')['file'])
+
+
+class Manifest(object):
+    """Completion records of the steps run in a mapset
+
+    Parameters:
+        path (str) : manifest file, read if it exists
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.steps = {}
+        self.removed = set()
+        if os.path.exists(path):
+            with open(path) as f:
+                manifest = json.load(f)
+            self.steps = manifest['steps']
+            self.removed = set(manifest['removed'])
+
+    def __contains__(self, step):
+        return step_id(step) in self.steps
+
+    def record(self, step):
+        """Record a completed step"""
+        self.steps[step_id(step)] = {'module': step.name,
+                                     'params': step.params,
+                                     'outputs': step.outputs,
+                                     'targets': step.targets,
+                                     'finished': time.time()}
+        self.removed.difference_update(step.outputs)
+        self.save()
+
+    def remove(self, names):
+        """Note maps removed once their readers completed"""
+        self.removed.update(names)
+        self.save()
+
+    def save(self):
+        tmp = '{}.tmp'.format(self.path)
+        with open(tmp, 'w') as f:
+            json.dump({'steps': self.steps, 'removed': sorted(self.removed)}, f,
+                      indent=1, sort_keys=True)
+        # rename replaces the manifest atomically, except on Windows
+        if os.name == 'nt' and os.path.exists(self.path):
+            os.remove(self.path)
+        os.rename(tmp, self.path)
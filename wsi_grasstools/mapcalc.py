@@ -0,0 +1,154 @@
+"""Fusion of r.mapcalc steps
+
+Every r.mapcalc run is a process of its own and a full pass over the rasters
+it reads and writes. fuse substitutes the expression of a map into the
+expressions reading it, drops the map when nothing else reads it, and then
+evaluates the remaining expressions that do not depend on each other in one
+multi-expression r.mapcalc run.
+"""
+
+from __future__ import print_function
+
+import re
+
+from wsi_grasstools.instrument import write_command
+from wsi_grasstools.pipeline import Step
+
+
+def mapcalc(expressions):
+    """Evaluate several r.mapcalc expressions in one pass over the rasters"""
+    write_command('r.mapcalc', overwrite=True, file='-',
+                  stdin='\n'.join(expressions))
+
+
+def _parse(step):
+    """Output and right hand side of a single expression r.mapcalc step"""
+    if step.module != 'r.mapcalc' or step.env or step.targets or len(step.outputs) != 1:
+        return None
+    match = re.match(r'^\s*([\w.]+)\s*=(?!=)(.*)$', step.params.get('expression', ''), re.S)
+    if not match or match.group(1) != step.outputs[0] or '\n' in match.group(2):
+        return None
+
+    return match.group(2).strip()
+
+
+def _reference(name):
+    return re.compile(r'(?<![\w@.]){}(?![\w@.])'.format(re.escape(name)))
+
+
+def _ancestors(steps):
+    producers = dict((name, step) for step in steps for name in step.outputs)
+    ancestors = {}
+
+    def visit(step):
+        if step not in ancestors:
+            ancestors[step] = set()
+            for name in step.inputs:
+                if name in producers:
+                    ancestors[step] |= visit(producers[name]) | set([producers[name]])
+        return ancestors[step]
+
+    for step in steps:
+        visit(step)
+
+    return ancestors
+
+
+def fuse(steps, keep=()):
+    """Inline and merge the r.mapcalc steps of a list of steps
+
+    A map written by an r.mapcalc step is inlined into the r.mapcalc steps
+    reading it, unless they read it at a neighbourhood offset. Its step is
+    dropped when only r.mapcalc steps read it and it is not in keep.
+    Independent r.mapcalc steps are then merged into one mapcalc step.
+
+    Parameters:
+        steps (list) : pipeline steps
+        keep (list) : maps that must exist once the steps have run
+
+    Returns:
+        steps (list) : the fused steps
+    """
+    rhs = dict((step, _parse(step)) for step in steps)
+    calc = dict((step.outputs[0], step) for step in steps if rhs[step] is not None)
+
+    # substitute mapcalc inputs, producers before readers
+    inputs = dict((step, list(step.inputs)) for step in steps)
+    done = set()
+
+    def expand(step):
+        if step in done:
+            return
+        done.add(step)
+        for name in list(step.inputs):
+            producer = calc.get(name)
+            if producer is None or producer is step:
+                continue
+            if re.search(r'(?<![\w@.]){}\s*\['.format(re.escape(name)), rhs[step]):
+                continue
+            expand(producer)
+            rhs[step] = _reference(name).sub(lambda m: '({})'.format(rhs[producer]), rhs[step])
+            inputs[step].remove(name)
+            inputs[step].extend(i for i in inputs[producer] if i not in inputs[step])
+
+    for step in calc.values():
+        expand(step)
+
+    read = set(name for step in steps for name in inputs[step])
+    fused = []
+    fusable = set()
+    for step in steps:
+        if rhs[step] is None:
+            fused.append(step)
+            continue
+        # only ever read by the expressions it was inlined into
+        name = step.outputs[0]
+        inlined = name not in read and any(name in other.inputs for other in steps)
+        if inlined and name not in keep:
+            continue
+        step = Step('r.mapcalc', inputs=inputs[step], outputs=step.outputs,
+                    message=step.message,
+                    expression='{} = {}'.format(name, rhs[step]))
+        fused.append(step)
+        fusable.add(step)
+
+    groups = [[step] for step in fused]
+    while True:
+        pair = _independent(groups, fusable)
+        if pair is None:
+            break
+        i, j = pair
+        groups[i].extend(groups.pop(j))
+
+    return [_group_step(group) for group in groups]
+
+
+def _group_step(group):
+    """One step evaluating the expressions of a group of r.mapcalc steps"""
+    if len(group) == 1:
+        return group[0]
+
+    inputs = []
+    for step in group:
+        inputs.extend(name for name in step.inputs if name not in inputs)
+    messages = [step.message for step in group if step.message]
+
+    return Step(mapcalc, inputs=inputs, outputs=[step.outputs[0] for step in group],
+                message=messages[0] if messages else None,
+                expressions=[step.params['expression'] for step in group])
+
+
+def _independent(groups, fusable):
+    """First pair of groups of r.mapcalc steps neither of which depends on the other"""
+    current = [_group_step(group) for group in groups]
+    ancestors = _ancestors(current)
+    for i in range(len(groups)):
+        if groups[i][0] not in fusable:
+            continue
+        for j in range(i + 1, len(groups)):
+            if groups[j][0] not in fusable:
+                continue
+            if current[i] not in ancestors[current[j]] and current[j] not in ancestors[current[i]]:
+                return i, j
+
+    return None
@@ -0,0 +1,367 @@
+"""Run GRASS modules as a graph of steps
+
+Each step names the maps it reads and the maps or files it writes. A step is
+ready once every step writing one of its inputs has finished; ready steps are
+started as separate GRASS processes, up to jobs at a time, so the wall clock
+time of a pipeline approaches its critical path.
+
+With a cache, steps whose key is already stored are not run; their outputs
+are restored from the cache only when a step that is not cached reads them,
+or when they are kept for use after the pipeline has run.
+
+With clean, a map written and read within the pipeline is removed as soon
+as the last step reading it has finished, unless it is kept, so the mapset
+holds only the maps still needed. The size of the mapset is measured as
+each step finishes and its peak reported once the pipeline has run.
+
+With checkpoint, every completed step is recorded in the run manifest of
+the mapset, and the recorded steps whose outputs are still there, or were
+removed after use, are skipped when the pipeline is run again.
+"""
+
+from __future__ import print_function, division
+
+import os
+import time
+import threading
+
+import click
+
+import grass.script as g
+from grass.exceptions import CalledModuleError
+
+from wsi_grasstools.cache import dir_size
+from wsi_grasstools.instrument import REPORT, poll, run_command, thread_usage, usage_since
+from wsi_grasstools.manifest import MANIFEST_NAME, Manifest, map_exists
+
+
+# seconds to wait between polls of the running processes
+POLL_INTERVAL = 0.05
+
+
+class Step(object):
+    """A GRASS module call and the maps it reads and writes
+
+    Parameters:
+        module (str or callable) : GRASS module name, or a function run in a
+            thread and called with params
+        inputs (list) : maps read by the module
+        outputs (list) : maps written by the module
+        sources (list) : files read by the module
+        targets (list) : files written by the module
+        message (str) : progress message echoed when the step starts
+        env (dict) : environment of the module process
+        tuning (dict) : parameters, including flags, that set the resources
+            the module uses but not its outputs; they are left out of the
+            cache key and step id, which the available memory must not change
+        params : module parameters, including flags
+    """
+
+    def __init__(self, module, inputs=(), outputs=(), sources=(), targets=(),
+                 message=None, env=None, tuning=None, **params):
+        self.module = module
+        self.inputs = list(inputs)
+        self.outputs = list(outputs)
+        self.sources = list(sources)
+        self.targets = list(targets)
+        self.message = message
+        self.env = env
+        self.tuning = dict(tuning or {})
+        self.params = params
+
+    def __repr__(self):
+        return '<Step {} -> {}>'.format(self.name, ','.join(self.outputs + self.targets))
+
+    @property
+    def name(self):
+        return getattr(self.module, '__name__', self.module)
+
+    @property
+    def call_params(self):
+        """Parameters the module is run with, the tuning added to params"""
+        params = dict(self.params, **self.tuning)
+        if self.tuning.get('flags'):
+            params['flags'] = self.params.get('flags', '') + self.tuning['flags']
+        elif 'flags' in self.params:
+            params['flags'] = self.params['flags']
+
+        return params
+
+    @property
+    def cacheable(self):
+        """Whether the step only writes maps, so that they can be cached"""
+        return bool(self.outputs) and not self.targets
+
+
+class _Call(threading.Thread):
+    """A function step running in a thread, polled like a process"""
+
+    def __init__(self, func, params):
+        threading.Thread.__init__(self)
+        self.daemon = True
+        self.func = func
+        self.params = params
+        self.returncode = None
+        self.error = None
+        self.usage = {}
+
+    def run(self):
+        start = thread_usage()
+        try:
+            self.func(**self.params)
+        except Exception as e:
+            self.error = e
+        # the usage is set before the return code that marks the call finished
+        self.usage = usage_since(start)
+        self.returncode = 0 if self.error is None else 1
+
+    def poll(self):
+        return self.returncode
+
+    def terminate(self):
+        pass
+
+    def wait(self):
+        self.join()
+
+
+class Pipeline(object):
+    """A set of steps run concurrently in dependency order
+
+    Maps read by a step but written by no step of the pipeline are expected to
+    exist before the pipeline is run.
+
+    Parameters:
+        steps (list) : initial steps
+        jobs (int) : maximum number of steps running at once
+        cache (Cache) : store of step outputs reused across runs
+        keep (list) : maps that must exist once the pipeline has run
+        fg (str) : color of the progress messages
+        clean (bool) : remove maps once no remaining step reads them
+        checkpoint (bool) : record completed steps and skip those recorded
+    """
+
+    def __init__(self, steps=(), jobs=1, cache=None, keep=(), fg='green', clean=False,
+                 checkpoint=False):
+        self.steps = []
+        self.jobs = max(int(jobs), 1)
+        self.cache = cache
+        self.keep = set(keep)
+        self.fg = fg
+        self.clean = clean
+        self.checkpoint = checkpoint
+        self.manifest = None
+        self.peak_disk = 0
+        self.extend(steps)
+
+    def add(self, step):
+        self.steps.append(step)
+        return step
+
+    def extend(self, steps):
+        for step in steps:
+            self.add(step)
+
+    def graph(self):
+        """Map each step to the set of steps it depends on"""
+        producers = {}
+        for step in self.steps:
+            for name in step.outputs:
+                if name in producers:
+                    raise ValueError('{} is written by more than one step'.format(name))
+                producers[name] = step
+
+        return dict((step, set(producers[name] for name in step.inputs if name in producers))
+                    for step in self.steps)
+
+    def keys(self, graph):
+        """Map each cacheable step to its cache key
+
+        A step is left out when it is not cacheable or reads a map that no
+        cacheable step of the pipeline writes.
+        """
+        producers = dict((name, step) for step in self.steps for name in step.outputs)
+        region = g.parse_command('g.region', flags='g')
+
+        keys = {}
+        remaining = list(self.steps)
+        while remaining:
+            ready = [s for s in remaining if graph[s].isdisjoint(remaining)]
+            if not ready:
+                break
+            for step in ready:
+                remaining.remove(step)
+                upstream = [keys.get(producers.get(name)) for name in step.inputs]
+                if step.cacheable and None not in upstream:
+                    keys[step] = self.cache.key(step, upstream, region)
+
+        return keys
+
+    def _cached(self, graph):
+        """Find the cached steps and those whose outputs must be restored"""
+        if self.cache is None:
+            return {}, set(), set()
+
+        keys = self.keys(graph)
+        hits = set(step for step, key in keys.items() if key in self.cache)
+        restore = set(step for step in hits
+                      if any(step in graph[other] and other not in hits for other in self.steps)
+                      or self.keep.intersection(step.outputs))
+
+        return keys, hits, restore
+
+    def _resumed(self, graph):
+        """Find the steps completed by an earlier run that need not run again
+
+        A recorded step is complete while each of its outputs exists or was
+        removed after use, unless a step still to run reads a removed output.
+        """
+        if self.manifest is None:
+            return set()
+
+        present = dict((name, map_exists(name)) for step in self.steps for name in step.outputs)
+        complete = set(step for step in self.steps if step in self.manifest
+                       and all(present[name] or name in self.manifest.removed
+                               for name in step.outputs)
+                       and all(os.path.exists(target) for target in step.targets))
+
+        changed = True
+        while changed:
+            changed = False
+            for step in self.steps:
+                if step in complete:
+                    continue
+                for producer in graph[step] & complete:
+                    if not all(present[name] for name in producer.outputs if name in step.inputs):
+                        complete.discard(producer)
+                        changed = True
+
+        return complete
+
+    def lifetimes(self):
+        """Map each removable map to the steps reading it
+
+        Maps written by no step, read by no step or kept are not removable.
+        """
+        written = set(name for step in self.steps for name in step.outputs)
+        readers = {}
+        for step in self.steps:
+            for name in step.inputs:
+                if name in written and name not in self.keep:
+                    readers.setdefault(name, set()).add(step)
+
+        return readers
+
+    def _release(self, step, readers, existing):
+        """Remove the maps whose last reader is step"""
+        expired = []
+        for name in step.inputs:
+            if name in readers:
+                readers[name].discard(step)
+                if not readers[name]:
+                    del readers[name]
+                    if name in existing:
+                        expired.append(name)
+        if expired:
+            run_command('g.remove', flags='f', quiet=True, type='raster,vector',
+                        name=','.join(expired))
+            existing.difference_update(expired)
+            if self.manifest is not None:
+                self.manifest.remove(expired)
+
+    def _start(self, step):
+        if step.message:
+            click.echo(click.style(step.message, fg=self.fg))
+
+        if callable(step.module):
+            call = _Call(step.module, step.call_params)
+            call.start()
+            return call
+
+        return g.start_command(step.module, overwrite=True, env=step.env, **step.call_params)
+
+    def run(self):
+        graph = self.graph()
+        keys, hits, restore = self._cached(graph)
+        pending = list(self.steps)
+        running = []
+        started = {}
+        done = set()
+
+        genv = g.gisenv()
+        mapset = os.path.join(genv['GISDBASE'], genv['LOCATION_NAME'], genv['MAPSET'])
+        readers = self.lifetimes() if self.clean else {}
+        existing = set()
+
+        if self.checkpoint:
+            self.manifest = Manifest(os.path.join(mapset, MANIFEST_NAME))
+        resumed = self._resumed(graph)
+        if resumed:
+            click.echo(click.style('Resuming after {} of {} completed steps'.format(
+                len(resumed), len(self.steps)), fg=self.fg))
+
+        try:
+            while pending or running:
+                for step in [s for s in pending if graph[s] <= done]:
+                    if step in resumed:
+                        pending.remove(step)
+                        existing.update(name for name in step.outputs
+                                        if name not in self.manifest.removed)
+                        done.add(step)
+                        self._release(step, readers, existing)
+                        continue
+                    if step in hits:
+                        pending.remove(step)
+                        if step in restore:
+                            click.echo(click.style('Restoring {} from cache'.format(
+                                ', '.join(step.outputs)), fg=self.fg))
+                            self.cache.restore(keys[step])
+                            existing.update(step.outputs)
+                        done.add(step)
+                        self._release(step, readers, existing)
+                        continue
+                    if len(running) >= self.jobs:
+                        break
+                    pending.remove(step)
+                    started[step] = time.time()
+                    running.append((step, self._start(step)))
+
+                if not running:
+                    if pending and not [s for s in pending if graph[s] <= done]:
+                        raise ValueError('Unresolved dependencies in steps {}'.format(pending))
+                    continue
+
+                finished = []
+                for step, process in running:
+                    if callable(step.module):
+                        code, usage = process.poll(), process.usage
+                    else:
+                        code, usage = poll(process)
+                    if code is not None:
+                        finished.append((step, process))
+                        REPORT.add(step.name, started[step], step.outputs, **usage)
+                if not finished:
+                    time.sleep(POLL_INTERVAL)
+
+                for step, process in finished:
+                    running.remove((step, process))
+                    if getattr(process, 'error', None) is not None:
+                        raise process.error
+                    if process.returncode != 0:
+                        raise CalledModuleError(step.module, step.call_params, process.returncode)
+                    if step in keys:
+                        self.cache.store(keys[step], step.outputs)
+                    done.add(step)
+                    existing.update(step.outputs)
+                    if self.manifest is not None:
+                        self.manifest.record(step)
+                    self.peak_disk = max(self.peak_disk, dir_size(mapset))
+                    self._release(step, readers, existing)
+        finally:
+            for step, process in running:
+                process.terminate()
+                process.wait()
+
+        REPORT.peak_disk = max(REPORT.peak_disk, self.peak_disk)
+        click.echo(click.style('Peak mapset size: {:.1f} MB'.format(
+            self.peak_disk / 1024 ** 2), fg=self.fg))
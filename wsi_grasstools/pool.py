@@ -0,0 +1,180 @@
+"""Pool of GRASS locations kept ready for jobs
+
+Creating a location runs the GRASS startup script, which costs seconds. The
+pool keeps one location per coordinate reference system in the GRASS
+database, named pool_<crs>, and hands each job a mapset of it. A mapset is
+claimed by creating its lock directory and is emptied and returned to the
+pool by release_all, which runs when the process exits. Pool workers leave
+without running atexit handlers, so a worker running jobs calls release_all
+itself once each job is done.
+"""
+
+from __future__ import print_function
+
+import os
+import time
+import errno
+import shutil
+import atexit
+import hashlib
+
+import grass.script.setup as gsetup
+
+from wsi_grasstools.manage import create_location
+
+
+LOCK_DIR = '.locks'
+
+# seconds to wait for another process to create a pool location
+CREATE_TIMEOUT = 300
+
+# (gisdbdir, location, mapset) of the mapsets this process holds
+_claimed = []
+
+
+def crs_key(infile=None, epsg=None):
+    """Name the coordinate reference system of an EPSG code or a raster"""
+    if epsg:
+        return 'epsg{}'.format(epsg)
+
+    from osgeo import gdal, osr
+
+    srs = osr.SpatialReference(wkt=gdal.Open(infile).GetProjection())
+    if srs.GetAuthorityName(None) == 'EPSG' and srs.GetAuthorityCode(None):
+        return 'epsg{}'.format(srs.GetAuthorityCode(None))
+
+    return 'crs{}'.format(hashlib.sha1(srs.ExportToWkt().encode('utf-8')).hexdigest()[:12])
+
+
+def raster_region(infile):
+    """Region parameters matching the extent and cells of a raster"""
+    from osgeo import gdal
+
+    ds = gdal.Open(infile)
+    x0, dx, _, y0, _, dy = ds.GetGeoTransform()
+
+    return {'n': y0, 's': y0 + dy * ds.RasterYSize,
+            'w': x0, 'e': x0 + dx * ds.RasterXSize,
+            'rows': ds.RasterYSize, 'cols': ds.RasterXSize}
+
+
+def location_for(gisbase, gisdbdir, infile=None, epsg=None):
+    """Return the pool location of a CRS, creating it if needed"""
+    location = 'pool_{}'.format(crs_key(infile, epsg))
+    location_path = os.path.join(gisdbdir, location)
+    default_wind = os.path.join(location_path, 'PERMANENT', 'DEFAULT_WIND')
+    if os.path.exists(default_wind):
+        return location
+
+    lock = location_path + '.lock'
+    try:
+        os.mkdir(lock)
+    except OSError:
+        # another process is creating the location
+        t0 = time.time()
+        while not os.path.exists(default_wind):
+            if time.time() - t0 > CREATE_TIMEOUT:
+                raise OSError('Timed out waiting for location {}'.format(location_path))
+            time.sleep(0.5)
+    else:
+        try:
+            create_location(gisbase, location_path, infile=infile, epsg=epsg)
+            os.makedirs(os.path.join(location_path, LOCK_DIR))
+        finally:
+            os.rmdir(lock)
+
+    return location
+
+
+def _new_mapset(location_path, mapset):
+    path = os.path.join(location_path, mapset)
+    os.mkdir(path)
+    shutil.copy(os.path.join(location_path, 'PERMANENT', 'DEFAULT_WIND'),
+                os.path.join(path, 'WIND'))
+
+
+def _stale(lock):
+    try:
+        with open(os.path.join(lock, 'pid')) as f:
+            pid = int(f.read())
+        os.kill(pid, 0)
+    except ValueError:
+        return False
+    except (IOError, OSError) as e:
+        # IOError is OSError on Python 3; a missing pid file is not ESRCH
+        return e.errno == errno.ESRCH
+
+    return False
+
+
+def _claim(location_path, mapset):
+    lock = os.path.join(location_path, LOCK_DIR, mapset)
+    try:
+        os.mkdir(lock)
+    except OSError:
+        if not _stale(lock):
+            return False
+        # the holder died; reset the mapset before handing it out again
+        reset(location_path, mapset)
+    with open(os.path.join(lock, 'pid'), 'w') as f:
+        f.write(str(os.getpid()))
+
+    return True
+
+
+def reset(location_path, mapset):
+    """Empty a mapset and restore the default region"""
+    shutil.rmtree(os.path.join(location_path, mapset), ignore_errors=True)
+    _new_mapset(location_path, mapset)
+
+
+def warm(gisbase, gisdbdir, size, infile=None, epsg=None):
+    """Create the pool location of a CRS with at least size free mapsets"""
+    location = location_for(gisbase, gisdbdir, infile=infile, epsg=epsg)
+    location_path = os.path.join(gisdbdir, location)
+    for i in range(size):
+        mapset = 'slot_{}'.format(i)
+        if not os.path.isdir(os.path.join(location_path, mapset)):
+            _new_mapset(location_path, mapset)
+
+    return location
+
+
+def acquire(gisbase, gisdbdir, infile=None, epsg=None):
+    """Claim a clean mapset of the pool location and make it current
+
+    The mapset is released by release_all.
+
+    Returns:
+        location (str), mapset (str)
+    """
+    location = location_for(gisbase, gisdbdir, infile=infile, epsg=epsg)
+    location_path = os.path.join(gisdbdir, location)
+
+    i = 0
+    while not _claim(location_path, 'slot_{}'.format(i)):
+        i += 1
+    mapset = 'slot_{}'.format(i)
+    if not os.path.isdir(os.path.join(location_path, mapset)):
+        _new_mapset(location_path, mapset)
+
+    _claimed.append((gisdbdir, location, mapset))
+    gsetup.init(gisbase, gisdbdir, location, mapset)
+
+    return location, mapset
+
+
+def release(gisdbdir, location, mapset):
+    """Reset a claimed mapset and return it to the pool"""
+    location_path = os.path.join(gisdbdir, location)
+    reset(location_path, mapset)
+    shutil.rmtree(os.path.join(location_path, LOCK_DIR, mapset))
+
+
+def release_all():
+    """Release every mapset this process has claimed"""
+    while _claimed:
+        release(*_claimed.pop())
+
+
+atexit.register(release_all)
@@ -0,0 +1,190 @@
+"""Coarse-to-fine stream extraction
+
+The DEM is averaged to a resolution factor times coarser, where flow is
+routed and an approximate stream network and its basins are extracted for
+about 1 / factor**2 of the cost. The coarse streams, grown by a corridor of
+cells, become the MASK of the full resolution run, so conditioning, routing
+and extraction only visit the cells near the channels. Flow accumulation in
+the corridor counts the corridor cells only, which moves stream heads
+downstream; agreement measures how far the result is from an unmasked run.
+"""
+
+from __future__ import print_function, division
+
+import os
+import shutil
+import multiprocessing
+
+import grass.script as g
+
+from wsi_grasstools.instrument import REPORT, parse_command, run_command, write_command
+from wsi_grasstools.manage import init_mapset
+from wsi_grasstools.resources import watershed_params
+
+
+# distance in cells within which streams of two runs are taken to agree
+TOLERANCE = 2
+
+# maps of the coarse run and its corridor, removed by remove_corridor
+COARSE_MAPS = ['pyramid_dem', 'pyramid_streams', 'pyramid_basins', 'pyramid_corridor']
+
+# maps of the full resolution check, removed by agreement
+CHECK_MAPS = ['pyramid_near_full', 'pyramid_near', 'pyramid_hits', 'pyramid_found']
+
+
+def _count(name):
+    """Non-null cells of a raster under the current region and mask"""
+    return int(parse_command('r.univar', flags='g', map=name).get('n', 0))
+
+
+def coarse_network(dem, factor, threshold, memory=None):
+    """Extract the streams and basins of dem at a coarser resolution
+
+    Writes pyramid_dem, pyramid_streams and pyramid_basins on a temporary
+    region factor times coarser than the current one, with the threshold
+    scaled to the coarse cells.
+
+    Returns:
+        cells (int) : cell count of the coarse region
+    """
+    region = g.region()
+    g.use_temp_region()
+    try:
+        run_command('g.region', nsres=region['nsres'] * factor,
+                    ewres=region['ewres'] * factor)
+        coarse = g.region()
+
+        run_command('r.resamp.stats', overwrite=True,
+                    input=dem,
+                    output='pyramid_dem',
+                    method='average')
+
+        run_command('r.watershed', overwrite=True,
+                    elevation='pyramid_dem',
+                    threshold=max(int(round(threshold / factor ** 2)), 1),
+                    stream='pyramid_streams',
+                    basin='pyramid_basins',
+                    **watershed_params('a', memory))
+    finally:
+        g.del_temp_region()
+
+    return int(coarse['rows']) * int(coarse['cols'])
+
+
+def set_corridor(corridor):
+    """Mask the current region to within corridor cells of pyramid_streams
+
+    Returns:
+        cells (int) : cells inside the corridor
+    """
+    run_command('r.grow', overwrite=True,
+                input='pyramid_streams',
+                output='pyramid_corridor',
+                radius=corridor + 0.5)
+    run_command('r.mask', overwrite=True, raster='pyramid_corridor')
+
+    return _count('pyramid_corridor')
+
+
+def _remove(names):
+    """Remove those of the rasters found in the current mapset"""
+    mapset = g.gisenv()['MAPSET']
+    found = [name for name in names if g.find_file(name, element='cell', mapset=mapset)['name']]
+    if found:
+        run_command('g.remove', flags='f', quiet=True, type='raster', name=','.join(found))
+
+
+def remove_corridor(clean=True):
+    """Remove the corridor MASK and, with clean, the maps of the coarse run"""
+    if g.find_file('MASK', element='cell', mapset=g.gisenv()['MAPSET'])['name']:
+        run_command('r.mask', flags='r')
+    if clean:
+        _remove(COARSE_MAPS)
+
+
+def savings(cells, coarse, corridor):
+    """Share of the full resolution cells the pyramid run does not process"""
+    return 1 - (coarse + corridor) / cells
+
+
+def _full_streams(task):
+    gisbase, gisdbdir, location, mapset, dem, bounds, params = task
+
+    init_mapset(gisbase, gisdbdir, location, mapset)
+    run_command('g.region', align=dem, **bounds)
+
+    run_command('r.hydrodem', input=dem, overwrite=True,
+                output='hydem',
+                mod=params['mod'],
+                size=params['size'])
+
+    run_command('r.watershed', overwrite=True,
+                elevation='hydem',
+                threshold=params['threshold'],
+                accumulation='acc',
+                **watershed_params('a', params.get('memory')))
+
+    run_command('r.stream.extract', overwrite=True,
+                elevation='hydem',
+                accumulation='acc',
+                threshold=params['threshold'],
+                d8cut=params['d8cut'],
+                mexp=params['mexp'],
+                stream_length=params['stream_length'],
+                stream_rast='hydem_streams')
+
+    return REPORT.pop()
+
+
+def agreement(gisbase, gisdbdir, location, dem, streams, params, tolerance=TOLERANCE,
+              clean=True):
+    """Compare streams with those of an unmasked full resolution run
+
+    The reference streams are extracted in a mapset of their own by a worker
+    process, with the same parameters, and the mapset is removed afterwards,
+    as are the comparison maps with clean.
+
+    Parameters:
+        dem (str) : elevation raster in the current mapset
+        streams (str) : stream raster of the pyramid run
+        params (dict) : mod, size, threshold, d8cut, mexp, stream_length and
+            the memory budget
+        tolerance (int) : distance in cells within which streams agree
+        clean (bool) : remove the comparison maps
+
+    Returns:
+        stats (dict) : precision, the share of streams cells near a reference
+            stream, and recall, the share of reference cells near streams
+    """
+    mapset = g.gisenv()['MAPSET']
+    full = '{}_full'.format(mapset)
+    region = g.region()
+    bounds = dict((key, region[key]) for key in ['n', 's', 'e', 'w'])
+
+    pool = multiprocessing.Pool(processes=1)
+    try:
+        REPORT.extend(pool.apply(_full_streams, [(gisbase, gisdbdir, location, full,
+                                                  '{}@{}'.format(dem, mapset), bounds, params)]))
+    finally:
+        pool.close()
+        pool.join()
+
+    reference = 'hydem_streams@{}'.format(full)
+    try:
+        for name, near in [(reference, 'pyramid_near_full'), (streams, 'pyramid_near')]:
+            run_command('r.grow', overwrite=True, input=name, output=near,
+                        radius=tolerance + 0.5)
+        write_command('r.mapcalc', overwrite=True, file='-', stdin='\n'.join([
+            'pyramid_hits = if(isnull({}), null(), {})'.format('pyramid_near_full', streams),
+            'pyramid_found = if(isnull({}), null(), {})'.format('pyramid_near', reference)]))
+
+        counts = [_count(name) for name in [streams, 'pyramid_hits', reference, 'pyramid_found']]
+    finally:
+        if clean:
+            _remove(CHECK_MAPS)
+        shutil.rmtree(os.path.join(gisdbdir, location, full))
+
+    return {'precision': counts[1] / counts[0] if counts[0] else 0.0,
+            'recall': counts[3] / counts[2] if counts[2] else 0.0,
+            'cells': counts[0],
+            'reference_cells': counts[2]}
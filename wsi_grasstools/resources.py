@@ -0,0 +1,138 @@
+"""Inspect the processors and memory available to a run"""
+
+from __future__ import division
+
+import os
+import shutil
+import multiprocessing
+
+import click
+
+
+# approximate memory use of r.watershed in all-in-memory mode in bytes per cell
+WATERSHED_CELL_BYTES = 31
+
+# fraction of the available memory a run plans to use, leaving the rest to the system
+MEMORY_FRACTION = 0.8
+
+# approximate disk use of a run in its GRASS database in bytes per DEM cell,
+# about ten double precision maps at once
+DISK_CELL_BYTES = 80
+
+
+def available_memory():
+    """Return the memory available to new processes in bytes, or None if unknown"""
+    try:
+        with open('/proc/meminfo') as f:
+            for line in f:
+                if line.startswith('MemAvailable:'):
+                    return int(line.split()[1]) * 1024
+    except (IOError, OSError):
+        pass
+
+    try:
+        import psutil
+        return psutil.virtual_memory().available
+    except ImportError:
+        return None
+
+
+def worker_count(job_memory=None, limit=None):
+    """Number of processes to run at once given the memory each one needs
+
+    Parameters:
+        job_memory (float) : memory needed by one process in bytes
+        limit (int) : upper bound on the count, defaults to the processor count
+
+    Returns:
+        count (int) : at least one
+    """
+    count = multiprocessing.cpu_count()
+    if limit:
+        count = min(count, limit)
+
+    memory = available_memory()
+    if job_memory and memory:
+        count = min(count, int(memory // job_memory))
+
+    return max(count, 1)
+
+
+def memory_budget(memory=None, share=1):
+    """Memory in MB a process may plan to use
+
+    Parameters:
+        memory (float) : budget of the run in MB, capped by the available memory
+        share (int) : number of processes sharing the budget
+
+    Returns:
+        budget (float) : memory in MB, or None if unknown
+    """
+    available = available_memory()
+    budget = available * MEMORY_FRACTION / 1024 ** 2 if available else None
+    if memory:
+        budget = min(memory, budget) if budget else memory
+    if budget is None:
+        return None
+
+    return budget / share
+
+
+def watershed_params(flags, memory=None, share=1, cells=None):
+    """Choose between all-in-memory and segmented r.watershed
+
+    r.watershed runs all in memory when the current region fits the budget
+    and falls back to the slower segmented mode, with the whole budget as
+    its segment cache, only when it does not.
+
+    Parameters:
+        flags (str) : r.watershed flags other than m
+        memory (float) : budget of the run in MB
+        share (int) : number of r.watershed runs sharing the budget at once
+        cells (int) : cell count, defaults to that of the current region
+
+    Returns:
+        params (dict) : flags and memory parameters of r.watershed
+    """
+    if cells is None:
+        import grass.script as g
+        region = g.region()
+        cells = int(region['rows']) * int(region['cols'])
+
+    budget = memory_budget(memory, share)
+    if budget is not None and cells * WATERSHED_CELL_BYTES / 1024 ** 2 <= budget:
+        return {'flags': flags}
+
+    params = {'flags': flags + 'm'}
+    if budget is not None:
+        params['memory'] = max(int(budget), 1)
+
+    return params
+
+
+def free_disk(path):
+    """Return the space available to new files under path in bytes"""
+    if hasattr(shutil, 'disk_usage'):
+        return shutil.disk_usage(path).free
+
+    stat = os.statvfs(path)
+    return stat.f_bavail * stat.f_frsize
+
+
+def disk_estimate(infile):
+    """Disk a run on a raster file needs in its GRASS database, in bytes"""
+    from osgeo import gdal
+
+    ds = gdal.Open(infile)
+    if ds is None:
+        raise click.ClickException('Cannot read {} as a raster'.format(infile))
+    return ds.RasterXSize * ds.RasterYSize * DISK_CELL_BYTES
+
+
+def check_disk(path, infile):
+    """Stop the command when path has less free space than a run on infile needs"""
+    needed = disk_estimate(infile)
+    free = free_disk(path)
+    if free < needed:
+        raise click.ClickException('{} has {:.1f} GB free, a run on {} needs about {:.1f} GB'.format(
+            path, free / 1024 ** 3, infile, needed / 1024 ** 3))
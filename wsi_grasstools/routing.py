@@ -0,0 +1,137 @@
+"""Flow routing with r.watershed or r.terraflow
+
+r.watershed is fastest while the DEM fits in memory and slows down sharply
+once it has to segment it. r.terraflow is I/O efficient and stays usable on
+DEMs far larger than memory. Its single flow directions are re-encoded to
+r.watershed drainage codes, negative where flow leaves the region, so the
+r.stream modules and the steps written for r.watershed read either.
+"""
+
+from __future__ import print_function
+
+from wsi_grasstools.pipeline import Step
+from wsi_grasstools.resources import memory_budget, watershed_params
+
+
+ENGINES = ['auto', 'watershed', 'terraflow']
+
+# cells beyond which a DEM that does not fit in memory goes to r.terraflow
+TERRAFLOW_CELLS = 10 ** 9
+
+# r.terraflow -s direction, r.watershed drainage code and row, col offset of the next cell
+DIRECTIONS = [(128, 1, (-1, 1)),
+              (64, 2, (-1, 0)),
+              (32, 3, (-1, -1)),
+              (16, 4, (0, -1)),
+              (8, 5, (1, -1)),
+              (4, 6, (1, 0)),
+              (2, 7, (1, 1)),
+              (1, 8, (0, 1))]
+
+
+def region_cells():
+    import grass.script as g
+
+    region = g.region()
+    return int(region['rows']) * int(region['cols'])
+
+
+def choose_engine(engine='auto', memory=None, share=1, cells=None):
+    """Resolve auto to the engine suiting the current region and memory budget
+
+    r.terraflow is chosen when the region holds at least TERRAFLOW_CELLS and
+    r.watershed could not run all in memory.
+    """
+    if engine != 'auto':
+        return engine
+
+    if cells is None:
+        cells = region_cells()
+    segmented = 'm' in watershed_params('', memory, share, cells)['flags']
+
+    return 'terraflow' if segmented and cells >= TERRAFLOW_CELLS else 'watershed'
+
+
+def drainage_expression(terraflow, filled, drainage):
+    """r.mapcalc expression re-encoding r.terraflow directions as r.watershed drainage
+
+    Codes are negated where the next cell is outside the region or null.
+    """
+    code = 'null()'
+    for value, drain, _ in DIRECTIONS:
+        code = 'if({} == {}, {}, {})'.format(terraflow, value, drain, code)
+
+    leaves = ' || '.join('({} == {} && isnull({}[{},{}]))'.format(terraflow, value, filled, row, col)
+                         for value, _, (row, col) in DIRECTIONS)
+
+    return '{0} = if({1}, -{2}, {2})'.format(drainage, leaves, code)
+
+
+def routing_steps(elevation, drainage=None, accumulation=None, threshold=None, flags='a',
+                  engine='auto', memory=None, directory=None, stream=None, basin=None):
+    """Steps routing flow over elevation once into every requested output
+
+    With r.watershed a single run writes all the outputs. With r.terraflow
+    one run computes the drainage and accumulation, using the budget as its
+    main memory and directory for its temporary streams; it writes no
+    streams or basins, so auto keeps to r.watershed when they are requested.
+
+    Parameters:
+        elevation (str) : depressionless or conditioned elevation raster
+        drainage (str) : drainage direction raster, in r.watershed codes
+        accumulation (str) : flow accumulation raster, in cells
+        threshold (int) : r.watershed threshold
+        flags (str) : r.watershed flags other than m
+        engine (str) : auto, watershed or terraflow
+        memory (float) : memory budget in MB
+        directory (str) : r.terraflow stream directory
+        stream (str) : r.watershed stream raster
+        basin (str) : r.watershed basin raster
+    """
+    if stream or basin:
+        if engine == 'terraflow':
+            raise ValueError('r.terraflow does not write streams or basins')
+        engine = 'watershed'
+
+    if choose_engine(engine, memory) == 'watershed':
+        outputs = dict((name, value) for name, value in [('drainage', drainage),
+                                                         ('accumulation', accumulation),
+                                                         ('stream', stream),
+                                                         ('basin', basin)] if value)
+        return [Step('r.watershed', inputs=[elevation], outputs=list(outputs.values()),
+                     message='Running watershed',
+                     tuning=watershed_params('', memory),
+                     elevation=elevation,
+                     threshold=threshold,
+                     flags=flags,
+                     **outputs)]
+
+    prefix = '{}_terraflow'.format(drainage or accumulation)
+    params = {}
+    if directory:
+        params['directory'] = directory
+    tuning = {}
+    budget = memory_budget(memory)
+    if budget:
+        tuning['memory'] = int(budget)
+
+    terraflow = dict((name, '{}_{}'.format(prefix, name))
+                     for name in ['filled', 'direction', 'swatershed', 'accumulation', 'tci'])
+    if accumulation:
+        terraflow['accumulation'] = accumulation
+
+    steps = [Step('r.terraflow', inputs=[elevation], outputs=list(terraflow.values()),
+                  message='Running terraflow',
+                  tuning=tuning,
+                  flags='s',
+                  elevation=elevation,
+                  **dict(terraflow, **params))]
+
+    if drainage:
+        steps.append(Step('r.mapcalc', inputs=[terraflow['direction'], terraflow['filled']],
+                          outputs=[drainage],
+                          message='Converting terraflow directions',
+                          expression=drainage_expression(terraflow['direction'],
+                                                         terraflow['filled'], drainage)))
+
+    return steps
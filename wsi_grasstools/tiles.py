@@ -0,0 +1,316 @@
+"""Tiled processing of a GRASS region
+
+The computational region is split into square tiles of tile_size cells. Each
+tile is buffered by overlap cells so that flow routing near the tile edge sees
+the terrain beyond it, processed in its own mapset by a worker process, then
+clipped back to its core and patched into maps in the calling mapset.
+
+Stream ids are offset per tile, then matched across tile edges: where two
+neighbouring tiles both find a stream on the cells either side of their
+shared edge, the ids they give it are merged into one, and so are the ids
+of the basins draining to it.
+
+Flow accumulation is not carried across tiles: a cell only counts the cells
+upstream of it within its buffered tile. The tiled maps match those of a run
+over the whole region where the drainage of a cell lies within overlap cells
+of its tile, and accumulation, streams, basins and heights above streams
+differ downstream of longer drainage. The overlap must at least hold the
+drainage area of a stream head, so that stream heads near tile edges are
+found.
+"""
+
+from __future__ import print_function, division
+
+import os
+import math
+import shutil
+import multiprocessing
+
+import grass.script as g
+import grass.script.setup as gsetup
+
+from wsi_grasstools.instrument import REPORT, read_command, run_command, write_command
+from wsi_grasstools.resources import watershed_params
+
+
+# maps produced in each tile mapset and patched back together
+TILE_MAPS = ['hydem', 'dirs', 'acc', 'dirs_', 'hydem_streams',
+             'basins_elem', 'basins_last', 'above_stream']
+
+# maps carrying stream ids, which must be made unique across tiles; basins
+# take the id of the stream they drain to
+ID_MAPS = ['hydem_streams', 'basins_elem', 'basins_last']
+
+
+def min_overlap(threshold):
+    """Smallest overlap in cells holding the drainage area of a stream head"""
+    return int(math.ceil(math.sqrt(threshold)))
+
+
+def _bounds(region, r0, r1, c0, c1):
+    return {'n': region['n'] - r0 * region['nsres'],
+            's': region['n'] - r1 * region['nsres'],
+            'w': region['w'] + c0 * region['ewres'],
+            'e': region['w'] + c1 * region['ewres']}
+
+
+def make_tiles(region, tile_size, overlap):
+    """Split a region into tiles aligned to its cells
+
+    Parameters:
+        region (dict) : region as returned by grass.script.region()
+        tile_size (int) : tile edge length in cells
+        overlap (int) : buffer added to every side of a tile in cells
+
+    Returns:
+        tiles (list) : dicts with name, core and buffered bounds
+    """
+    rows, cols = int(region['rows']), int(region['cols'])
+
+    tiles = []
+    for r0 in range(0, rows, tile_size):
+        r1 = min(r0 + tile_size, rows)
+        for c0 in range(0, cols, tile_size):
+            c1 = min(c0 + tile_size, cols)
+            tiles.append({
+                'name': 'tile_{}_{}'.format(r0 // tile_size, c0 // tile_size),
+                'core': _bounds(region, r0, r1, c0, c1),
+                'buffered': _bounds(region,
+                                    max(r0 - overlap, 0), min(r1 + overlap, rows),
+                                    max(c0 - overlap, 0), min(c1 + overlap, cols))
+            })
+
+    return tiles
+
+
+def _init_worker(gisbase, gisdbdir, location):
+    # one GISRC per worker process, switched from tile mapset to tile mapset
+    gsetup.init(gisbase, gisdbdir, location, 'PERMANENT')
+
+
+def _process_tile(task):
+    dem, tile, params = task
+
+    run_command('g.mapset', flags='c', mapset=tile['mapset'], quiet=True)
+    run_command('g.region', align=dem, **tile['buffered'])
+
+    run_command('r.hydrodem', input=dem, overwrite=True,
+                output='hydem',
+                mod=params['mod'],
+                size=params['size'])
+
+    run_command('r.watershed', overwrite=True,
+                elevation='hydem',
+                threshold=params['threshold'],
+                drainage='dirs',
+                accumulation='acc',
+                **watershed_params('a', params.get('memory'), params['share']))
+
+    run_command('r.stream.extract', overwrite=True,
+                elevation='hydem',
+                accumulation='acc',
+                direction='dirs_',
+                threshold=params['threshold'],
+                d8cut=params['d8cut'],
+                mexp=params['mexp'],
+                stream_length=params['stream_length'],
+                stream_rast='hydem_streams')
+
+    run_command('r.stream.basins', overwrite=True,
+                dir='dirs',
+                stream='hydem_streams',
+                basins='basins_elem')
+
+    run_command('r.stream.basins', overwrite=True,
+                flags='l',
+                dir='dirs',
+                stream='hydem_streams',
+                basins='basins_last')
+
+    run_command('r.stream.distance', overwrite=True,
+                stream_rast='hydem_streams',
+                direction='dirs',
+                elevation=dem,
+                method='downstream',
+                difference='above_stream')
+
+    value = g.raster_info('hydem_streams')['max']
+
+    return int(value) if value is not None else 0, REPORT.pop()
+
+
+def _clip_tile(task):
+    dem, tile, offset = task
+
+    run_command('g.mapset', mapset=tile['mapset'], quiet=True)
+    run_command('g.region', align=dem, **tile['core'])
+
+    expressions = []
+    for name in TILE_MAPS:
+        if name in ID_MAPS:
+            expr = '{0}_core = if(isnull({0}), null(), {0} + {1})'.format(name, offset)
+        else:
+            expr = '{0}_core = {0}'.format(name)
+        expressions.append(expr)
+
+    write_command('r.mapcalc', overwrite=True, file='-',
+                  stdin='\n'.join(expressions))
+
+    return REPORT.pop()
+
+
+def tile_offsets(maxima):
+    """Offsets keeping the stream ids of each tile past those of the tiles before it
+
+    Parameters:
+        maxima (list) : largest stream id of each tile, 0 without streams
+    """
+    offsets = []
+    total = 0
+    for tile_max in maxima:
+        offsets.append(total)
+        total += tile_max
+
+    return offsets
+
+
+def _expand(bounds, region):
+    return {'n': bounds['n'] + region['nsres'], 's': bounds['s'] - region['nsres'],
+            'e': bounds['e'] + region['ewres'], 'w': bounds['w'] - region['ewres']}
+
+
+def edge_pairs(dem, tiles, offsets):
+    """Stream ids two neighbouring tiles give the same cells next to their edge
+
+    The cells read are those of the cores of both tiles within one cell of
+    the other core, which lie within the buffers of both tiles.
+
+    Returns:
+        pairs (set) : (id, id) pairs of offset stream ids
+    """
+    region = g.region()
+    pairs = set()
+    g.use_temp_region()
+    try:
+        for i, first in enumerate(tiles):
+            a = _expand(first['core'], region)
+            for j in range(i + 1, len(tiles)):
+                b = _expand(tiles[j]['core'], region)
+                strip = {'n': min(a['n'], b['n']), 's': max(a['s'], b['s']),
+                         'e': min(a['e'], b['e']), 'w': max(a['w'], b['w'])}
+                if strip['n'] <= strip['s'] or strip['e'] <= strip['w']:
+                    continue
+
+                run_command('g.region', align=dem, **strip)
+                stats = read_command('r.stats', flags='n', separator='space', input=[
+                    'hydem_streams@{}'.format(first['mapset']),
+                    'hydem_streams@{}'.format(tiles[j]['mapset'])])
+                for line in stats.splitlines():
+                    if line.strip():
+                        x, y = line.split()[:2]
+                        pairs.add((int(x) + offsets[i], int(y) + offsets[j]))
+    finally:
+        g.del_temp_region()
+
+    return pairs
+
+
+def match_ids(pairs):
+    """Map each id matched with a smaller one to the smallest id it is matched with"""
+    parent = {}
+
+    def root(i):
+        while parent.get(i, i) != i:
+            i = parent[i]
+        return i
+
+    for x, y in pairs:
+        x, y = root(x), root(y)
+        if x != y:
+            parent[max(x, y)] = min(x, y)
+
+    return dict((i, root(i)) for i in parent)
+
+
+def relabel(mapping, maps=ID_MAPS):
+    """Replace the ids of maps of the current mapset as given by mapping"""
+    if not mapping:
+        return
+
+    rules = '\n'.join('{} = {}'.format(*item) for item in sorted(mapping.items())) + '\n'
+    for name in maps:
+        write_command('r.reclass', overwrite=True, rules='-', stdin=rules,
+                      input=name, output='{}_matched'.format(name))
+    # ids left out of the rules are null in the reclassed map and kept
+    write_command('r.mapcalc', overwrite=True, file='-', stdin='\n'.join(
+        '{0}_ids = if(isnull({0}_matched), {0}, {0}_matched)'.format(name) for name in maps))
+    run_command('g.remove', flags='f', quiet=True, type='raster',
+                name=','.join('{}_matched'.format(name) for name in maps))
+    for name in maps:
+        run_command('g.rename', overwrite=True, quiet=True, raster='{0}_ids,{0}'.format(name))
+
+
+def run_tiled(gisbase, gisdbdir, location, dem, tile_size, overlap, jobs, params):
+    """Run the hydrodem, watershed and stream extract chain tile by tile
+
+    Tiles are processed by a pool of jobs worker processes, each in its own
+    mapset of location. Stream ids, and the basin ids equal to them, are
+    offset per tile so they stay unique once the tile cores are patched into
+    the current mapset as the maps listed in TILE_MAPS, then matched across
+    tile edges. Flow accumulation is local to each buffered tile, see the
+    module documentation. The tile mapsets are removed whether or not the
+    run succeeds.
+
+    Parameters:
+        dem (str) : elevation raster in the current mapset
+        tile_size (int) : tile edge length in cells
+        overlap (int) : hydrologic buffer around each tile in cells
+        jobs (int) : number of worker processes
+        params (dict) : mod, size, threshold, d8cut, mexp, stream_length and
+            the memory budget shared by the jobs
+
+    Returns:
+        tiles (list) : the processed tiles
+    """
+    mapset = g.gisenv()['MAPSET']
+    dem = '{}@{}'.format(dem, mapset)
+    tiles = make_tiles(g.region(), tile_size, overlap)
+    for tile in tiles:
+        tile['mapset'] = '{}_{}'.format(mapset, tile['name'])
+
+    params = dict(params, share=min(jobs, len(tiles)))
+    pool = multiprocessing.Pool(processes=min(jobs, len(tiles)), initializer=_init_worker,
+                                initargs=(gisbase, gisdbdir, location))
+    try:
+        try:
+            # workers hand back the records of their module calls
+            results = pool.map(_process_tile, [(dem, tile, params) for tile in tiles])
+            for _, records in results:
+                REPORT.extend(records)
+
+            offsets = tile_offsets([tile_max for tile_max, _ in results])
+
+            clipped = pool.map(_clip_tile, [(dem, tile, offset)
+                                            for tile, offset in zip(tiles, offsets)])
+            for records in clipped:
+                REPORT.extend(records)
+        finally:
+            pool.close()
+            pool.join()
+
+        stitch(tiles)
+        relabel(match_ids(edge_pairs(dem, tiles, offsets)))
+    finally:
+        for tile in tiles:
+            shutil.rmtree(os.path.join(gisdbdir, location, tile['mapset']), ignore_errors=True)
+
+    return tiles
+
+
+def stitch(tiles, maps=TILE_MAPS):
+    """Patch the clipped tile cores into maps of the current mapset"""
+    for name in maps:
+        inputs = ['{}_core@{}'.format(name, tile['mapset']) for tile in tiles]
+        run_command('r.patch', overwrite=True,
+                    input=','.join(inputs),
+                    output=name)
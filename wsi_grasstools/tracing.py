@@ -0,0 +1,300 @@
+"""Flow path tracing from many start points at once
+
+The drainage raster is read in square blocks of BLOCK_SIZE cells, each
+exported with r.out.bin the first time a path enters it, and the claimed
+cells are kept per block read. All start points advance one cell per
+iteration as numpy arrays. A path stops at the first cell already claimed
+by another path and keeps it as its last vertex, so paths merge at
+confluences and every cell is traced once. The path raster is rasterized
+from a point per path cell, so the reads, the writes and the memory grow
+with the blocks the paths cross and with their length, not with the
+region. Start points can be split across worker processes, whose paths are
+merged in start point order.
+"""
+
+from __future__ import print_function, division
+
+import os
+import shutil
+import tempfile
+import multiprocessing
+
+import numpy as np
+
+import grass.script as g
+
+from wsi_grasstools.instrument import REPORT, read_command, run_command, write_command
+from wsi_grasstools.pipeline import Step
+from wsi_grasstools.routing import DIRECTIONS
+
+
+# edge length in cells of the blocks the drainage raster is read in
+BLOCK_SIZE = 1024
+
+
+def _offsets():
+    """Row and column steps indexed by r.watershed drainage code"""
+    rows = np.zeros(9, dtype=np.int64)
+    cols = np.zeros(9, dtype=np.int64)
+    for _, code, (row, col) in DIRECTIONS:
+        rows[code] = row
+        cols[code] = col
+
+    return rows, cols
+
+
+class Blocks(object):
+    """Drainage codes and claimed cells of a region, read block by block
+
+    The blocks read so far are stacked in codes and claimed, which locate
+    indexes into.
+
+    Parameters:
+        shape (tuple) : rows and columns of the region
+        read (callable) : called with the first and past the last row and
+            column of a block, returns the drainage codes of its cells
+        size (int) : block edge length in cells
+    """
+
+    def __init__(self, shape, read, size=BLOCK_SIZE):
+        self.rows, self.cols = shape
+        self.read = read
+        self.size = size
+        self.across = -(-self.cols // size)
+        self.slots = np.full(-(-self.rows // size) * self.across, -1, dtype=np.int64)
+        self.loaded = 0
+        self.codes = np.zeros(0, dtype=np.int32)
+        self.claimed = np.zeros(0, dtype=np.bool_)
+
+    def _load(self, block):
+        r0, c0 = (block // self.across) * self.size, (block % self.across) * self.size
+        r1, c1 = min(r0 + self.size, self.rows), min(c0 + self.size, self.cols)
+        cells = self.size * self.size
+        if (self.loaded + 1) * cells > len(self.codes):
+            # room for twice the blocks, so the copies add up to the cells read
+            capacity = max(2 * self.loaded, 1) * cells
+            self.codes = np.concatenate([self.codes, np.zeros(capacity - len(self.codes),
+                                                              dtype=np.int32)])
+            self.claimed = np.concatenate([self.claimed, np.zeros(capacity - len(self.claimed),
+                                                                  dtype=np.bool_)])
+        codes = self.codes[self.loaded * cells:(self.loaded + 1) * cells].reshape(self.size,
+                                                                                 self.size)
+        codes[:r1 - r0, :c1 - c0] = self.read(r0, r1, c0, c1)
+        self.slots[block] = self.loaded
+        self.loaded += 1
+
+    def locate(self, pos):
+        """Indices into codes and claimed of flat region indices, reading their blocks"""
+        row, col = pos // self.cols, pos % self.cols
+        block = (row // self.size) * self.across + col // self.size
+        for b in np.unique(block[self.slots[block] < 0]).tolist():
+            self._load(b)
+
+        return (self.slots[block] * self.size * self.size +
+                (row % self.size) * self.size + col % self.size)
+
+
+def trace(drainage, starts):
+    """Follow the drainage from start cells until the paths leave or merge
+
+    Each iteration costs the number of paths still moving, and only the
+    blocks of drainage the paths enter are read.
+
+    Parameters:
+        drainage (ndarray or Blocks) : 2D r.watershed drainage codes, 0 where null
+        starts (ndarray) : flat indices of the start cells
+
+    Returns:
+        paths (list) : flat cell indices of each path
+        merged (ndarray) : whether each path ends on a cell of another path
+    """
+    if not isinstance(drainage, Blocks):
+        array = drainage
+        drainage = Blocks(array.shape, lambda r0, r1, c0, c1: array[r0:r1, c0:c1])
+    rows, cols = drainage.rows, drainage.cols
+    step_rows, step_cols = _offsets()
+    merged = np.zeros(len(starts), dtype=np.bool_)
+
+    ids = np.arange(len(starts))
+    pos = np.asarray(starts, dtype=np.int64)
+    visited_ids, visited_pos = [], []
+    first = True
+    while len(ids):
+        # paths reaching a claimed cell end on it
+        key = drainage.locate(pos)
+        taken = drainage.claimed[key]
+        if not first:
+            visited_ids.append(ids[taken])
+            visited_pos.append(pos[taken])
+            merged[ids[taken]] = True
+        ids, pos, key = ids[~taken], pos[~taken], key[~taken]
+
+        # of the paths entering one cell together the first claims it
+        _, index = np.unique(pos, return_index=True)
+        claims = np.zeros(len(pos), dtype=np.bool_)
+        claims[index] = True
+        visited_ids.append(ids)
+        visited_pos.append(pos)
+        merged[ids[~claims]] = True
+        drainage.claimed[key[claims]] = True
+        ids, pos, key = ids[claims], pos[claims], key[claims]
+
+        code = drainage.codes[key]
+        row = pos // cols + step_rows[np.clip(code, 0, 8)]
+        col = pos % cols + step_cols[np.clip(code, 0, 8)]
+        moving = (code > 0) & (row >= 0) & (row < rows) & (col >= 0) & (col < cols)
+        ids, pos = ids[moving], (row * cols + col)[moving]
+        first = False
+
+    ids = np.concatenate(visited_ids) if visited_ids else np.zeros(0, dtype=np.int64)
+    pos = np.concatenate(visited_pos) if visited_pos else np.zeros(0, dtype=np.int64)
+    order = np.argsort(ids, kind='stable')
+    ids, pos = ids[order], pos[order]
+    bounds = np.searchsorted(ids, np.arange(len(starts) + 1))
+
+    return [pos[bounds[i]:bounds[i + 1]] for i in range(len(starts))], merged
+
+
+def _block_reader(drainage, region, directory):
+    """Read the blocks of a drainage raster with r.out.bin
+
+    The blocks are set in a saved region of their own, so the region of the
+    mapset and of the modules running alongside is left alone.
+    """
+    name = 'trace_{}'.format(os.getpid())
+    env = dict(os.environ, WIND_OVERRIDE=name)
+    path = os.path.join(directory, '{}.bin'.format(name))
+    run_command('g.region', overwrite=True, save=name)
+
+    def read(r0, r1, c0, c1):
+        run_command('g.region', env=env,
+                    n=region['n'] - r0 * region['nsres'], s=region['n'] - r1 * region['nsres'],
+                    w=region['w'] + c0 * region['ewres'], e=region['w'] + c1 * region['ewres'],
+                    nsres=region['nsres'], ewres=region['ewres'])
+        run_command('r.out.bin', env=env, input=drainage, output=path, null=0, bytes=4)
+        return np.fromfile(path, dtype=np.int32).reshape(r1 - r0, c1 - c0)
+
+    return name, read
+
+
+def _trace_part(task):
+    drainage, region, directory, starts = task
+    name, read = _block_reader(drainage, region, directory)
+    try:
+        paths, merged = trace(Blocks((int(region['rows']), int(region['cols'])), read), starts)
+    finally:
+        run_command('g.remove', flags='f', quiet=True, type='region', name=name)
+
+    return list(zip(paths, merged.tolist()))
+
+
+def _trace_worker(task):
+    # workers hand back the records of their module calls
+    return _trace_part(task), REPORT.pop()
+
+
+def merge(traced):
+    """Cut paths traced apart at the first cell claimed by an earlier path
+
+    Parameters:
+        traced (list) : (path, merged) pairs as returned by trace
+
+    Returns:
+        paths (list) : the cut paths
+        owned (list) : cells of each cut path, without the last one of a path
+            ending on an earlier path
+    """
+    claimed = set()
+    paths, owned = [], []
+    for path, merged in traced:
+        # the last cell of a merged path belongs to the path it joined
+        own = path[:-1] if merged else path
+        taken = [cell in claimed for cell in own.tolist()]
+        if any(taken):
+            path = path[:taken.index(True) + 1]
+            own = path[:-1]
+        claimed.update(own.tolist())
+        paths.append(path)
+        owned.append(own)
+
+    return paths, owned
+
+
+def trace_paths(drainage, start_points, raster_path, vector_path, workers=1):
+    """Trace the flow paths from the points of a vector map
+
+    Parameters:
+        drainage (str) : r.watershed drainage raster
+        start_points (str) : point vector map
+        raster_path (str) : output raster, cells numbered by the path reaching them first
+        vector_path (str) : output line vector, one line per path
+        workers (int) : processes the start points are split across
+    """
+    region = g.region()
+    rows, cols = int(region['rows']), int(region['cols'])
+
+    points = []
+    for line in read_command('v.out.ascii', input=start_points, format='point',
+                             separator='comma').splitlines():
+        if line.strip():
+            x, y = line.split(',')[:2]
+            points.append((float(x), float(y)))
+    points = np.array(points, dtype=np.float64).reshape(-1, 2)
+    row = np.floor((region['n'] - points[:, 1]) / region['nsres']).astype(np.int64)
+    col = np.floor((points[:, 0] - region['w']) / region['ewres']).astype(np.int64)
+    inside = (row >= 0) & (row < rows) & (col >= 0) & (col < cols)
+    starts = (row * cols + col)[inside]
+
+    tmp = tempfile.mkdtemp(prefix='trace')
+    try:
+        parts = np.array_split(starts, max(min(workers, len(starts)), 1))
+        tasks = [(drainage, region, tmp, part) for part in parts]
+        if len(tasks) > 1:
+            pool = multiprocessing.Pool(processes=len(tasks))
+            try:
+                results = pool.map(_trace_worker, tasks)
+            finally:
+                pool.close()
+                pool.join()
+            traced = []
+            for part, records in results:
+                traced.extend(part)
+                REPORT.extend(records)
+        else:
+            traced = _trace_part(tasks[0])
+    finally:
+        shutil.rmtree(tmp, ignore_errors=True)
+    paths, owned = merge(traced)
+
+    def centers(cells):
+        xs = region['w'] + (cells % cols + 0.5) * region['ewres']
+        ys = region['n'] - (cells // cols + 0.5) * region['nsres']
+        return zip(xs.tolist(), ys.tolist())
+
+    # one point per path cell, numbered by its path, is rasterized into the path raster
+    cells = '{}_cells'.format(raster_path)
+    write_command('v.in.ascii', overwrite=True, flags='t', format='point', separator='pipe',
+                  x=1, y=2, cat=3, input='-', output=cells,
+                  stdin=''.join('{!r}|{!r}|{}\n'.format(x, y, cat)
+                                for cat, own in enumerate(owned, 1) for x, y in centers(own)))
+    run_command('v.to.rast', overwrite=True, input=cells, output=raster_path,
+                type='point', use='cat')
+    run_command('g.remove', flags='f', quiet=True, type='vector', name=cells)
+
+    lines = []
+    for cat, path in enumerate(paths, 1):
+        if len(path) < 2:
+            continue
+        lines.append('L {} 1'.format(len(path)))
+        lines.extend(' {!r} {!r}'.format(x, y) for x, y in centers(path))
+        lines.append(' 1 {}'.format(cat))
+    write_command('v.in.ascii', overwrite=True, flags='n', format='standard',
+                  input='-', output=vector_path, stdin='\n'.join(lines) + '\n')
+
+
+def trace_step(drainage, start_points, raster_path, vector_path, workers=1, message=None):
+    """Step tracing flow paths with trace_paths"""
+    return Step(trace_paths, inputs=[drainage, start_points],
+                outputs=[raster_path, vector_path], message=message,
+                drainage=drainage, start_points=start_points,
+                raster_path=raster_path, vector_path=vector_path, workers=workers)